@@ -2,5 +2,6 @@ import os
 
 
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+SURVEY_DIR = os.path.join(ROOT_DIR, 'trace_number_vs_x')
 
-__all__ = [ROOT_DIR]
+__all__ = [ROOT_DIR, SURVEY_DIR]
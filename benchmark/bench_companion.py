@@ -0,0 +1,55 @@
+"""Benchmark reloading tx.in: parsing text vs. its binary companion
+
+    py -m benchmark.bench_companion --picks 5000000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmark.synthetic import make_txin
+from util import txin
+
+
+def timeit(func, repeat):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--picks', type=int, default=5000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_txin(os.path.join(tmp, 'tx.in'), args.picks)
+        size_mb = os.path.getsize(path) / 2**20
+        print('tx.in: %d records, %.1f MiB' %(args.picks + 3, size_mb))
+
+        t_text, parsed = timeit(lambda: txin.load_records(path), args.repeat)
+        t_save, _ = timeit(lambda: txin.save_companion(path, parsed, exact=True), 1)
+        t_map, mapped = timeit(lambda: txin.load_records(path), args.repeat)
+        t_read, loaded = timeit(lambda: np.array(txin.load_records(path)), args.repeat)
+        if not isinstance(mapped, np.memmap) or not np.array_equal(parsed, loaded):
+            raise AssertionError('companion does not load to the parsed records')
+        if ''.join(txin.format_records(loaded)) != open(path).read():
+            raise AssertionError('companion does not format to the tx.in text')
+
+        print('write companion    %8.3fs' %t_save)
+        for name, t in (
+                ('parse text', t_text), ('companion, mmap', t_map),
+                ('companion, read', t_read)):
+            print('%-18s %8.3fs %12.0f records/s' %(name, t, (args.picks + 3) / t))
+        print('speedup: %.0fx (mmap), %.0fx (read)' %(t_text / t_map, t_text / t_read))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Benchmark deduplicated merge: util.dedup.dedup_records on re-picked shots
+
+    py -m benchmark.bench_dedup --picks 20000000 --sources 3
+
+Each source picks every shot at `--spacing` km, shifted by 0.001 km from
+the previous source, so the x of all sources interleave. With a tolerance
+just below the spacing (the default) every shot side is one chain of
+linked picks, the worst case of `util.dedup`, which must split it into
+clusters of one pick per source.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from util import txin
+from util.dedup import dedup_records
+
+
+def make_records(npicks, nsources, nshots, spacing, seed=0):
+    """Shot blocks of all sources, without ending records, and the source of
+    each record.
+    """
+    rng = np.random.default_rng(seed)
+    per_side = max(npicks // (nsources * nshots * 2), 1)
+    shot_locs = np.sort(rng.uniform(0, 200, nshots))
+    parts, sources = [], []
+    for i in range(nsources):
+        x = np.arange(per_side) * spacing + 0.001 * i
+        for shot_loc in shot_locs:
+            for side in (-1, 1):
+                px = shot_loc + side * (x + 0.01)
+                t = 1 + np.abs(px - shot_loc) / 6 + rng.normal(0, 0.01, per_side)
+                block = np.column_stack([
+                    np.concatenate([[shot_loc], px]), np.concatenate([[side], t]),
+                    np.concatenate([[0], np.full(per_side, 0.03)]),
+                    np.concatenate([[0], np.ones(per_side)])])
+                parts.append(txin.to_records(np.round(block, 3)))
+                sources.append(np.full(per_side + 1, i, dtype=np.int32))
+    return np.concatenate(parts), np.concatenate(sources)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--picks', type=int, default=20000000, help='picks of all sources')
+    parser.add_argument('--sources', type=int, default=3, help='re-picks of each arrival')
+    parser.add_argument('--shots', type=int, default=20)
+    parser.add_argument('--spacing', type=float, default=0.005, help='pick spacing in km')
+    parser.add_argument(
+        '--tolerance', type=float,
+        help='tolerance in km (default: spacing - 0.0005)')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+    if args.sources * 0.001 >= args.spacing:
+        parser.error('--spacing must be over 0.001 km per source')
+    tolerance = args.spacing - 0.0005 if args.tolerance is None else args.tolerance
+
+    records, sources = make_records(args.picks, args.sources, args.shots, args.spacing)
+    npicks = int(np.count_nonzero(records['code']))
+    print('%d picks of %d sources, %d shots, tolerance %g km' %(
+        npicks, args.sources, args.shots, tolerance))
+    for method in ('drop', 'average'):
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = dedup_records(records, sources, (method, tolerance))
+            best = min(best, time.perf_counter() - start)
+        kept = int(np.count_nonzero(result['code'] > 0))
+        # one pick of each arrival is left
+        if kept * args.sources != npicks:
+            raise AssertionError('%d picks left of %d, expect %d' %(
+                kept, npicks, npicks // args.sources))
+        print('%-8s %8.3fs %12.0f picks/s' %(method, best, npicks / best))
+
+
+if __name__ == '__main__':
+    main()
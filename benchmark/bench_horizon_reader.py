@@ -0,0 +1,50 @@
+"""Benchmark horizon loading: np.genfromtxt vs. util.columnar_reader
+
+    py -m benchmark.bench_horizon_reader --rows 3000000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmark.synthetic import make_horizon
+from util.columnar_reader import load_columns
+
+
+def timeit(func, repeat):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=3000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_horizon(os.path.join(tmp, 'horizon.csv'), args.rows)
+        size_mb = os.path.getsize(path) / 2**20
+        print('horizon: %d rows, %.1f MiB' %(args.rows, size_mb))
+
+        t_old, old = timeit(
+            lambda: np.genfromtxt(path, delimiter=',', usecols=(1, 2)), 1)
+        t_new, new = timeit(lambda: load_columns(path, usecols=(1, 2)), args.repeat)
+        if not np.array_equal(old, new):
+            raise AssertionError('load_columns result differs from np.genfromtxt')
+
+        for name, t in (('np.genfromtxt', t_old), ('load_columns', t_new)):
+            print('%-14s %8.3fs %12.0f rows/s %8.1f MiB/s' %(
+                name, t, args.rows / t, size_mb / t))
+        print('speedup: %.1fx' %(t_old / t_new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Benchmark TxMergerCore.run with 1 to N worker processes
+
+Merges a few hundred synthetic OBS tx.in(s), resetting the ray group number,
+and checks that every worker count gives the same output.
+
+    py -m benchmark.bench_merge_parallel --files 300 --picks 20000
+"""
+
+import argparse
+import filecmp
+import os
+import tempfile
+import time
+
+from benchmark.synthetic import make_txin
+from core.merger import TxMergerCore
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=300)
+    parser.add_argument('--picks', type=int, default=20000, help='picks per tx.in')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src_paths = [
+            make_txin(os.path.join(tmp, 'obs%03d_tx.in' %i), args.picks, seed=i)
+            for i in range(args.files)]
+        size_mb = sum(os.path.getsize(p) for p in src_paths) / 2**20
+        print('%d tx.in(s), %.1f MiB in total' %(args.files, size_mb))
+
+        workers = 1
+        base = None
+        while workers <= args.max_workers:
+            target = os.path.join(tmp, 'merged_%d.in' %workers)
+            start = time.perf_counter()
+            TxMergerCore().run(src_paths, target, ray_number=2, workers=workers)
+            elapsed = time.perf_counter() - start
+            if base is None:
+                base = (target, elapsed)
+            elif not filecmp.cmp(base[0], target, shallow=False):
+                raise AssertionError('Output with %d workers differs' %workers)
+            print('workers %3d: %7.3fs %8.1f MiB/s speedup %.2fx' %(
+                workers, elapsed, size_mb / elapsed, base[1] / elapsed))
+            workers *= 2
+
+
+if __name__ == '__main__':
+    main()
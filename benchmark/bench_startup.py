@@ -0,0 +1,78 @@
+"""Benchmark start-up of tx_manager, failing above a time threshold
+
+    py -m benchmark.bench_startup --threshold 0.3
+
+Each sample runs in a fresh interpreter. It measures importing tx_manager
+and, if a display is available, building the window up to the first tab
+shown. Exits with 1 if the median of a stage is above its threshold, or if
+numpy is imported before a tab needs it.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from __init__ import ROOT_DIR
+
+
+PROBE = r'''
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, %(root)r)
+import tx_manager
+result = {'import': time.perf_counter() - start, 'numpy': 'numpy' in sys.modules}
+try:
+    root = tx_manager.tk.Tk()
+except tx_manager.tk.TclError:
+    root = None
+if root is not None:
+    start = time.perf_counter()
+    app = tx_manager.TxManager(master=root)
+    app.grid(sticky='nswe')
+    root.update()
+    result['window'] = time.perf_counter() - start
+    root.destroy()
+print(json.dumps(result))
+'''
+
+
+def sample():
+    out = subprocess.run(
+        [sys.executable, '-c', PROBE %{'root': ROOT_DIR}],
+        check=True, stdout=subprocess.PIPE, cwd=ROOT_DIR).stdout
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument(
+        '--threshold', type=float, default=0.3, help='max seconds to import tx_manager')
+    parser.add_argument(
+        '--window-threshold', type=float, default=1.0,
+        help='max seconds to build the window with its first tab')
+    args = parser.parse_args(argv)
+
+    samples = [sample() for _ in range(args.repeat)]
+    failed = False
+    for stage, threshold in (('import', args.threshold), ('window', args.window_threshold)):
+        times = [s[stage] for s in samples if stage in s]
+        if not times:
+            print('%-7s skipped, no display' %stage)
+            continue
+        median = statistics.median(times)
+        ok = median <= threshold
+        failed |= not ok
+        print('%-7s median %.3fs  min %.3fs  threshold %.3fs  %s' %(
+            stage, median, min(times), threshold, 'ok' if ok else 'REGRESSION'))
+    if any(s['numpy'] for s in samples):
+        print('numpy is imported at start-up  REGRESSION')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""Benchmark trace number to x mapping: np.interp vs. util.trace_lookup
+
+    py -m benchmark.bench_trace_lookup --picks 20000000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmark.synthetic import make_survey
+from util.survey_registry import parse_survey_file
+from util.trace_lookup import TraceLookup
+
+
+def timeit(func, repeat):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--picks', type=int, default=20000000)
+    parser.add_argument('--traces', type=int, default=5000, help='rows of the survey table')
+    parser.add_argument(
+        '--fractional', type=float, default=0.0,
+        help='share of picks at fractional trace numbers')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        _, table = parse_survey_file(make_survey(os.path.join(tmp, 'survey.txt'), args.traces))
+    rng = np.random.default_rng(0)
+    first, last = table[0, 0], table[-1, 0]
+    # a few picks out of the table, like real horizons
+    traces = rng.integers(first - 10, last + 10, args.picks).astype(np.float64)
+    n_frac = int(args.picks * args.fractional)
+    traces[:n_frac] += rng.uniform(0, 1, n_frac)
+    print('%d picks, %d survey rows, %.0f%% fractional' %(
+        args.picks, args.traces, 100 * args.fractional))
+
+    t_build, lookup = timeit(lambda: TraceLookup(table), args.repeat)
+    t_old, old = timeit(lambda: np.interp(traces, table[:, 0], table[:, 1]), args.repeat)
+    t_new, new = timeit(lambda: lookup(traces), args.repeat)
+    if not np.array_equal(old, new):
+        raise AssertionError('TraceLookup result differs from np.interp')
+
+    print('build lookup   %8.3fs (direct: %s)' %(t_build, lookup.direct))
+    for name, t in (('np.interp', t_old), ('TraceLookup', t_new)):
+        print('%-14s %8.3fs %12.0f picks/s' %(name, t, args.picks / t))
+    print('speedup: %.1fx' %(t_old / t_new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Benchmark tx.in writing: per-row Python loop vs. util.txin bulk formatting
+
+Also checks that the output is byte-identical to the per-row writer that
+`TxMakerCore.make_tx_for_scs` used before, for both OBS and SCS. Output of
+the writer before is kept in tests/data, see tests/test_txin_golden.py.
+
+    py -m benchmark.bench_txin_writer --rows 500000
+"""
+
+import argparse
+import filecmp
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from core.maker import TxMakerCore
+from util import txin
+
+
+def legacy_scs(path, tx_data):
+    fmt = txin.LINE_FMT + '\n'
+    with open(path, 'w') as f:
+        for row in tx_data:
+            f.write(fmt %(row[0], 1, 0, 0))
+            f.write(fmt %tuple(row))
+        f.write(fmt %(0, 0, 0, -1))
+
+
+def legacy_obs(path, tx_data, shot_loc):
+    idx = np.searchsorted(tx_data[:, 0], shot_loc)
+    res = np.vstack([
+        [shot_loc, -1, 0, 0], tx_data[:idx, :], [shot_loc, 1, 0, 0], tx_data[idx:, :],
+        [0, 0, 0, -1]])
+    np.savetxt(path, res, fmt=txin.LINE_FMT)
+
+
+def make_tx_data(nrows, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.sort(rng.uniform(-50, 150, nrows))
+    t = rng.uniform(-0.5, 8, nrows)
+    return np.column_stack([x, t, np.full(nrows, 0.02), np.full(nrows, 3.0)])
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500000)
+    args = parser.parse_args(argv)
+
+    tx_data = make_tx_data(args.rows)
+    picks = txin.to_records(tx_data)
+    shot_loc = 13.113
+    with tempfile.TemporaryDirectory() as tmp:
+        p = lambda name: os.path.join(tmp, name)
+        core = TxMakerCore('scs', None, None, 0.02, 3, p('scs_new.in'))
+        t_scs_old = timed(lambda: legacy_scs(p('scs_old.in'), tx_data))
+        t_scs_new = timed(lambda: core.make_tx_for_scs(picks))
+        core.save_path = p('obs_new.in')
+        t_obs_old = timed(lambda: legacy_obs(p('obs_old.in'), tx_data, shot_loc))
+        t_obs_new = timed(lambda: core.make_tx_for_obs(picks, shot_loc))
+        for old, new in (('scs_old.in', 'scs_new.in'), ('obs_old.in', 'obs_new.in')):
+            if not filecmp.cmp(p(old), p(new), shallow=False):
+                raise AssertionError('%s differs from %s' %(new, old))
+
+    print('%d picks, output is byte-identical' %(args.rows))
+    for name, t_old, t_new, nlines in (
+            ('scs', t_scs_old, t_scs_new, 2*args.rows+1),
+            ('obs', t_obs_old, t_obs_new, args.rows+3)):
+        print('%s: loop %7.3fs (%9.0f lines/s), bulk %7.3fs (%9.0f lines/s), %.1fx' %(
+            name, t_old, nlines/t_old, t_new, nlines/t_new, t_old/t_new))
+
+
+if __name__ == '__main__':
+    main()
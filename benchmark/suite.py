@@ -0,0 +1,251 @@
+"""Benchmark suite of the maker and merger hot paths, with a stored baseline
+
+    py -m benchmark.suite --scale small --json benchmark/baseline.json
+    py -m benchmark.suite --scale small --baseline benchmark/baseline.json
+
+Synthetic horizon, survey tables and tx.in(s) are written to a temporary
+directory at the chosen scale. Each stage then runs in a fresh process, so
+that its peak RSS is its own, and its best time of `--repeat` runs is
+reported as rows/s. Rows are horizon rows, survey rows or tx.in picks.
+
+With `--baseline`, rows/s and peak RSS are compared with a previous
+`--json` output of the same scale. Exits with 1 if a stage is slower, or
+its peak RSS larger, than the baseline beyond the tolerance.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmark.synthetic import make_horizon, make_survey, make_txin_set
+from util.perf import peak_rss_mb, reset_peak_rss
+
+
+SCALES = {
+    # horizon rows and survey traces, tx.in(s) to merge, picks per tx.in
+    'small': dict(rows=200000, files=20, picks=20000),
+    'medium': dict(rows=2000000, files=100, picks=50000),
+    'large': dict(rows=20000000, files=300, picks=100000),
+}
+
+
+def timeit(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+# bytes of horizon per block of the chunked maker
+CHUNK_SIZE = 1 << 22
+
+
+def _maker(data, survey_type, survey_path, registry=None, chunk_size=None):
+    from core.maker import TxMakerCore
+    from util.survey_registry import SurveyRegistry
+    return TxMakerCore(
+        survey_type, survey_path, data['horizon'], 0.02, 1,
+        os.path.join(data['dir'], '%s_tx.in' %survey_type),
+        survey_registry=registry or SurveyRegistry(), chunk_size=chunk_size)
+
+
+def _picks(maker):
+    meta, lookup = maker.load_survey_data()
+    return meta, maker.make_picks(maker.load_horizon_data(), meta, lookup)
+
+
+# Stages: setup(data) -> (timed function, number of rows). Setup is not timed.
+
+def stage_load_survey_data(data):
+    from util.survey_registry import SurveyRegistry
+
+    def parse():
+        # a new registry parses the text again
+        _maker(data, 'obs', data['obs_survey'], SurveyRegistry()).load_survey_data()
+    return parse, data['rows']
+
+
+def stage_load_survey_data_cached(data):
+    from util.survey_registry import SurveyRegistry
+    cache_dir = os.path.join(data['dir'], 'cache')
+    SurveyRegistry(cache_dir).get(data['obs_survey'])
+
+    def load():
+        # a new registry loads the sidecar of the first one
+        _maker(data, 'obs', data['obs_survey'], SurveyRegistry(cache_dir)).load_survey_data()
+    return load, data['rows']
+
+
+def stage_load_horizon_data(data):
+    return _maker(data, 'obs', data['obs_survey']).load_horizon_data, data['rows']
+
+
+def stage_trace_map_interp(data):
+    maker = _maker(data, 'obs', data['obs_survey'])
+    meta, lookup = maker.load_survey_data()
+    horizon_data = maker.load_horizon_data()
+    return lambda: np.interp(horizon_data[:, 0], lookup.trace, lookup.x), data['rows']
+
+
+def stage_make_picks(data):
+    maker = _maker(data, 'obs', data['obs_survey'])
+    meta, lookup = maker.load_survey_data()
+    horizon_data = maker.load_horizon_data()
+    return lambda: maker.make_picks(horizon_data, meta, lookup), data['rows']
+
+
+def stage_make_tx_for_obs(data):
+    maker = _maker(data, 'obs', data['obs_survey'])
+    meta, picks = _picks(maker)
+    return lambda: maker.make_tx_for_obs(picks, meta['shot_loc']), data['rows']
+
+
+def stage_make_tx_for_scs(data):
+    maker = _maker(data, 'scs', data['scs_survey'])
+    _, picks = _picks(maker)
+    return lambda: maker.make_tx_for_scs(picks), data['rows']
+
+
+def stage_run_obs(data):
+    return _maker(data, 'obs', data['obs_survey']).run, data['rows']
+
+
+def stage_run_obs_chunked(data):
+    return _maker(data, 'obs', data['obs_survey'], chunk_size=CHUNK_SIZE).run, data['rows']
+
+
+def stage_merge(data):
+    from core.merger import TxMergerCore
+    target = os.path.join(data['dir'], 'merged_tx.in')
+    return (
+        lambda: TxMergerCore().run(data['txins'], target, ray_number=2),
+        data['files'] * data['picks'])
+
+
+STAGES = {
+    'load_survey_data': stage_load_survey_data,
+    'load_survey_data_cached': stage_load_survey_data_cached,
+    'load_horizon_data': stage_load_horizon_data,
+    'trace_map_interp': stage_trace_map_interp,
+    'make_picks': stage_make_picks,
+    'make_tx_for_obs': stage_make_tx_for_obs,
+    'make_tx_for_scs': stage_make_tx_for_scs,
+    'run_obs': stage_run_obs,
+    'run_obs_chunked': stage_run_obs_chunked,
+    'merge': stage_merge,
+}
+
+
+def run_stage(name, data, repeat):
+    """Run a stage in this process. Returns its result row."""
+    func, rows = STAGES[name](data)
+    reset_peak_rss()
+    seconds = timeit(func, repeat)
+    return {
+        'seconds': seconds, 'rows': rows, 'rows_per_s': rows / seconds,
+        'peak_rss_mb': peak_rss_mb()}
+
+
+def make_data(dir_path, rows, files, picks):
+    """Write synthetic inputs. Returns their paths and sizes for the stages."""
+    txin_dir = os.path.join(dir_path, 'txin')
+    os.makedirs(txin_dir)
+    return {
+        'dir': dir_path, 'rows': rows, 'files': files, 'picks': picks,
+        'horizon': make_horizon(os.path.join(dir_path, 'horizon.csv'), rows),
+        'obs_survey': make_survey(os.path.join(dir_path, 'obs.txt'), rows),
+        'scs_survey': make_survey(os.path.join(dir_path, 'scs.txt'), rows, shot_loc=0),
+        'txins': make_txin_set(txin_dir, files, picks),
+    }
+
+
+def compare(results, baseline, tolerance, rss_tolerance):
+    """Print results against baseline. Returns names of regressed stages."""
+    if baseline['params'] != results['params']:
+        print('Warning: baseline is of other parameters %s' %(baseline['params'],))
+    regressed = []
+    print('\n%-24s %10s %10s' %('vs. baseline', 'rows/s', 'peak RSS'))
+    for name, res in results['stages'].items():
+        base = baseline['stages'].get(name)
+        if base is None:
+            print('%-24s %10s' %(name, 'new'))
+            continue
+        speed = res['rows_per_s'] / base['rows_per_s']
+        rss = None
+        if res['peak_rss_mb'] and base['peak_rss_mb']:
+            rss = res['peak_rss_mb'] / base['peak_rss_mb']
+        bad = speed < 1 - tolerance or (rss is not None and rss > 1 + rss_tolerance)
+        if bad:
+            regressed.append(name)
+        print('%-24s %9.2fx %10s  %s' %(
+            name, speed, 'n/a' if rss is None else '%.2fx' %rss,
+            'REGRESSION' if bad else 'ok'))
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--rows', type=int, help='horizon rows and survey traces')
+    parser.add_argument('--files', type=int, help='number of tx.in(s) to merge')
+    parser.add_argument('--picks', type=int, help='picks per tx.in to merge')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='write results to this file, e.g. as a baseline')
+    parser.add_argument('--baseline', help='compare with results of a previous --json')
+    parser.add_argument(
+        '--tolerance', type=float, default=0.1, help='allowed loss of rows/s (default: 0.1)')
+    parser.add_argument(
+        '--rss-tolerance', type=float, default=0.25,
+        help='allowed growth of peak RSS (default: 0.25)')
+    args = parser.parse_args(argv)
+
+    params = dict(SCALES[args.scale])
+    for key in params:
+        if getattr(args, key) is not None:
+            params[key] = getattr(args, key)
+    results = {
+        'params': params,
+        'machine': {
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'stages': {},
+    }
+    # spawn, so that a stage does not inherit the memory of this process
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        data = make_data(tmp, **params)
+        print('%(rows)d horizon rows, %(files)d tx.in(s) of %(picks)d picks' %params)
+        print('\n%-24s %10s %14s %10s' %('stage', 'seconds', 'rows/s', 'peak RSS'))
+        for name in args.stages:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                res = executor.submit(run_stage, name, data, args.repeat).result()
+            results['stages'][name] = res
+            rss = res['peak_rss_mb']
+            print('%-24s %10.3f %14.0f %10s' %(
+                name, res['seconds'], res['rows_per_s'],
+                'n/a' if rss is None else '%.0f MiB' %rss))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance, args.rss_tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""Synthetic input files for benchmarks
+
+    py -m benchmark.synthetic /tmp/data --rows 1000000 --files 100 --picks 20000
+
+writes a horizon, OBS and SCS survey tables and a set of tx.in(s) there.
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+
+def make_horizon(path, nrows, first_trace=11120, line=4, seed=0, header=False):
+    """Write a horizon file in the Kingdom export format "Line,Trace,Time" """
+    rng = np.random.default_rng(seed)
+    trace = np.arange(first_trace, first_trace + nrows)
+    time = 2.0 + np.cumsum(rng.normal(0, 1e-3, nrows))
+    with open(path, 'w') as f:
+        if header:
+            f.write('Line,Trace,Time\n')
+        block = 1 << 20
+        for i in range(0, nrows, block):
+            rows = np.column_stack([
+                np.full(trace[i:i+block].size, line), trace[i:i+block], time[i:i+block]])
+            f.write(('%d,%d,%.4f\n' * rows.shape[0]) %tuple(rows.ravel().tolist()))
+    return path
+
+
+def make_survey(path, ntraces, first_trace=11120, shot_loc=13.113, time_offset=0.0,
+                spacing=0.0185):
+    """Write a Trace-Number vs. X-Offset table like `trace_number_vs_x/obs30.txt`"""
+    trace = np.arange(first_trace, first_trace + ntraces)
+    x = np.arange(ntraces) * spacing
+    with open(path, 'w') as f:
+        f.write('%g,%g\n' %(shot_loc, time_offset))
+        for t, v in zip(trace, x):
+            f.write('%d,%.3f\n' %(t, v))
+    return path
+
+
+def make_txin(path, npicks, shot_loc=None, ray_number=1, seed=0):
+    """Write an OBS tx.in with picks at both sides of the shot"""
+    from util import txin
+
+    rng = np.random.default_rng(seed)
+    # distinct x on the 0.001 km grid of tx.in, duplicate picks fail QC
+    x = np.sort(rng.choice(200000, npicks, replace=False)) / 1000
+    shot_loc = rng.uniform(0, 200) if shot_loc is None else shot_loc
+    t = 1 + np.abs(x - shot_loc) / 6 + rng.normal(0, 0.01, npicks)
+    picks = txin.to_records(np.column_stack([
+        x, t, np.full(npicks, 0.03), np.full(npicks, ray_number)]))
+    idx = np.searchsorted(x, shot_loc)
+    shots = txin.to_records([[shot_loc, -1, 0, 0], [shot_loc, 1, 0, 0]])
+    records = np.concatenate([
+        shots[:1], picks[:idx], shots[1:], picks[idx:], txin.to_records(txin.ENDING_RECORD)])
+    txin.save_records(path, records)
+    return path
+
+
+def make_txin_set(dir_path, nfiles, npicks, ray_number=1):
+    """Write `nfiles` OBS tx.in(s) of `npicks` picks each. Returns their paths."""
+    return [
+        make_txin(
+            os.path.join(dir_path, 'obs%03d_tx.in' %i), npicks, ray_number=ray_number, seed=i)
+        for i in range(nfiles)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write synthetic input files for benchmarks.')
+    parser.add_argument('dir', help='output directory')
+    parser.add_argument('--rows', type=int, default=1000000, help='horizon rows and survey traces')
+    parser.add_argument('--files', type=int, default=100, help='number of tx.in(s)')
+    parser.add_argument('--picks', type=int, default=20000, help='picks per tx.in')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.dir, exist_ok=True)
+    make_horizon(os.path.join(args.dir, 'obs_horizon.csv'), args.rows)
+    make_survey(os.path.join(args.dir, 'obs.txt'), args.rows)
+    make_survey(os.path.join(args.dir, 'scs.txt'), args.rows, shot_loc=0)
+    make_txin_set(args.dir, args.files, args.picks)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+"""Headless API of tx.in maker and merger, free of tkinter.
+
+    from core import make_multi_tx, make_tx, merge_tx
+    make_tx('horizon/obs30_Pg.csv', 'trace_number_vs_x/obs30.txt', 'tx_in/obs30_Pg_tx.in')
+    make_multi_tx(
+        [('horizon/obs30_Pg.csv', 0.02, 1), ('horizon/obs30_PmP.csv', 0.03, 2)],
+        'trace_number_vs_x/obs30.txt', 'tx_in/obs30_tx.in')
+    merge_tx(['tx_in/a_tx.in', 'tx_in/b_tx.in'], 'tx_in/all_tx.in', ray_number=2)
+"""
+
+from core.maker import (
+    SURVEY_DIR, SURVEY_REGISTRY, Horizon, MultiTxMakerCore, SurveyType, TxMakerCore,
+    make_multi_tx, make_tx)
+from core.merger import TxMergerCore, merge_tx
+
+__all__ = [
+    'SURVEY_DIR', 'SURVEY_REGISTRY', 'Horizon', 'MultiTxMakerCore', 'SurveyType',
+    'TxMakerCore', 'make_multi_tx', 'make_tx',
+    'TxMergerCore', 'merge_tx']
@@ -0,0 +1,410 @@
+"""tx.in maker core: build a tx.in from a horizon and a survey table"""
+
+from collections import namedtuple
+from contextlib import ExitStack
+from enum import Enum
+import os
+import tempfile
+
+import numpy as np
+
+from __init__ import ROOT_DIR, SURVEY_DIR
+from util.columnar_reader import iter_columns, load_columns
+from util.decimate import StreamDecimator, decimate
+from util.job_runner import no_progress, report_committed
+from util.survey_registry import SurveyRegistry
+from util.trace_lookup import TraceLookup
+from util import perf, qc, txin
+
+
+# parsed survey tables, shared by GUI, core and batch mode
+SURVEY_REGISTRY = SurveyRegistry(cache_dir=os.path.join(ROOT_DIR, 'cache', 'survey'))
+
+# a horizon of one phase (e.g. Pg, PmP or Pn) with its precision and ray group
+Horizon = namedtuple('Horizon', 'path precision ray_number')
+
+
+class SurveyType(Enum):
+    """Enumerate class for survey types"""
+    SCS = 1
+    OBS = 2
+
+    @classmethod
+    def from_survey_name(cls, survey_name):
+        """Guess survey type from survey name, e.g. "obs30" or "scs_line4a"."""
+        return cls.OBS if 'obs' in survey_name.lower() else cls.SCS
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _read_blocks(f, dtype):
+    """Blocks of records of a raw file, from its current position"""
+    while True:
+        records = np.fromfile(f, dtype=dtype, count=txin.BLOCK_ROWS)
+        if not records.size:
+            return
+        yield records
+
+
+class TxMakerCore(object):
+    """Create tx.in file from trace-time data exported from the Kingdom Software"""
+
+    LINE_FMT = txin.LINE_FMT
+
+    def __init__(
+            self, survey_type, survey_path, horizon_path,
+            horizon_precision, ray_number, save_path, survey_registry=None,
+            decimation=None, companion=False, check=True, chunk_size=None):
+        self.survey_type = survey_type
+        self.survey_path = survey_path
+        self.horizon_path = horizon_path
+        self.horizon_precision = horizon_precision
+        self.ray_number = ray_number
+        self.save_path = save_path
+        self.survey_registry = survey_registry or SURVEY_REGISTRY
+        # (method, value) of `util.decimate.parse_decimation`, None keeps all picks
+        self.decimation = decimation
+        # also write the binary companion `<tx.in>.npy`, see `util.txin`
+        self.companion = companion
+        # QC horizon and records before writing, see `util.qc`
+        self.check = check
+        self.qc_reports = []
+        # bytes of horizon read at a time, see `run_chunked`. None loads it all
+        self.chunk_size = chunk_size
+
+    def is_obs(self):
+        obs, scs = SurveyType.OBS, SurveyType.SCS
+        if self.survey_type in (obs, obs.name, obs.value, obs.name.lower()):
+            return True
+        if self.survey_type in (scs, scs.name, scs.value, scs.name.lower()):
+            return False
+        raise ValueError('Invalid survey type "%r". Support only "obs" and "scs"' %(self.survey_type))
+
+    def load_survey_data(self):
+        """(meta, `TraceLookup`) of the survey table"""
+        survey = self.survey_registry.get(self.survey_path)
+        return survey.meta, survey.lookup
+
+    def load_horizon_data(self):
+        # horizon line format: <line>,<trace>,<time>
+        return load_columns(self.horizon_path, usecols=(1, 2))
+
+    def horizon_list(self):
+        """`Horizon`(s) of the tx.in"""
+        return [Horizon(self.horizon_path, self.horizon_precision, self.ray_number)]
+
+    def horizon_bytes(self):
+        return perf.file_size(self.horizon_path)
+
+    def split_obs_picks(self, picks, shot_loc):
+        """(left, right) picks of the shot. Horizon rows are in order of trace."""
+        idx = np.searchsorted(picks['x'], shot_loc)
+        return picks[:idx], picks[idx:]
+
+    def check_horizon(self, horizon_data, trace_number_map):
+        """QC of horizon data. Raises `util.qc.QCError` if it fails."""
+        trace_range = (trace_number_map.trace.min(), trace_number_map.trace.max())
+        self.qc_reports.append(
+            qc.check_horizon(horizon_data, trace_range, self.horizon_path).raise_for_errors())
+
+    def save_records(self, records, progress=no_progress):
+        """Write the tx.in. `progress()` is called last before it replaces
+        the previous one, so a cancelled job leaves that untouched.
+        """
+        if self.check:
+            self.qc_reports.append(
+                qc.check_records(records, self.save_path).raise_for_errors())
+        tmp_path = '%s.%d.tmp' %(self.save_path, os.getpid())
+        try:
+            txin.save_records(tmp_path, records)
+            progress()
+        except BaseException:
+            _remove(tmp_path)
+            raise
+        txin.remove_companion(self.save_path)
+        os.replace(tmp_path, self.save_path)
+        if self.companion:
+            txin.save_companion(self.save_path, records)
+
+    def decimate_picks(self, picks, shot_loc=None):
+        return decimate(picks, self.decimation, shot_loc)
+
+    def make_tx_for_obs(self, picks, shot_loc, progress=no_progress):
+        left, right = self.split_obs_picks(picks, shot_loc)
+        left = self.decimate_picks(left, shot_loc)
+        right = self.decimate_picks(right, shot_loc)
+        shots = txin.to_records([[shot_loc, -1, 0, 0], [shot_loc, 1, 0, 0]])
+        res = np.concatenate([
+            shots[:1], left, shots[1:], right, txin.to_records(txin.ENDING_RECORD)])
+        self.save_records(res, progress)
+
+    @staticmethod
+    def scs_records(picks, ending=True):
+        # every pick follows a shot header of its own: <x>, 1, 0, 0
+        n = picks.shape[0]
+        res = txin.empty_records(2*n + ending)
+        res['x'][0:2*n:2] = picks['x']
+        res['t'][0:2*n:2] = 1
+        res[1:2*n:2] = picks
+        if ending:
+            res[-1] = txin.ENDING_RECORD
+        return res
+
+    def make_tx_for_scs(self, picks, progress=no_progress):
+        self.save_records(self.scs_records(self.decimate_picks(picks)), progress)
+
+    def make_picks(self, horizon_data, meta, trace_number_map, precision=None, ray_number=None):
+        """Records of picks from horizon trace-time data.
+
+        `trace_number_map` is a `TraceLookup` or the survey table itself.
+        `precision` and `ray_number` default to those of the maker. Either
+        may also be an array of one value per row.
+        """
+        if not isinstance(trace_number_map, TraceLookup):
+            trace_number_map = TraceLookup(trace_number_map)
+        picks = txin.empty_records(horizon_data.shape[0])
+        picks['x'] = trace_number_map(horizon_data[:, 0])
+        picks['t'] = horizon_data[:, 1] + meta['time_offset']
+        picks['uncertainty'] = self.horizon_precision if precision is None else precision
+        picks['code'] = self.ray_number if ray_number is None else ray_number
+        return picks
+
+    def run(self, progress=no_progress):
+        """Create tx.in. `progress(fraction, message)` is called between steps.
+        With a `chunk_size`, see `run_chunked`.
+        """
+        if self.chunk_size:
+            return self.run_chunked(progress)
+        self.qc_reports = []
+        progress(0, 'Loading survey table')
+        with perf.stage('load_survey_data', path=self.survey_path) as st:
+            meta, trace_number_map = self.load_survey_data()
+            st.set(rows=trace_number_map.trace.size, file_bytes=perf.file_size(self.survey_path))
+        progress(0.1, 'Loading horizon')
+        with perf.stage('load_horizon_data', path=self.horizon_path) as st:
+            horizon_data = self.load_horizon_data()
+            st.set(rows=horizon_data.shape[0], bytes_read=self.horizon_bytes())
+        if self.check:
+            with perf.stage('qc_horizon', rows=horizon_data.shape[0]):
+                self.check_horizon(horizon_data, trace_number_map)
+        progress(0.6, 'Mapping trace numbers to x')
+        with perf.stage('interp', rows=horizon_data.shape[0], direct=trace_number_map.direct):
+            picks = self.make_picks(horizon_data, meta, trace_number_map)
+        progress(0.7, 'Writing tx.in')
+        with perf.stage('write', path=self.save_path, picks=picks.shape[0]) as st:
+            if self.is_obs():
+                self.make_tx_for_obs(picks, meta['shot_loc'], progress)
+            else:
+                self.make_tx_for_scs(picks, progress)
+            st.set(bytes_written=perf.file_size(self.save_path))
+        self.report_completed(progress)
+
+    def report_completed(self, progress):
+        # the tx.in is written, too late to cancel
+        warnings = sum(len(report.warnings) for report in self.qc_reports)
+        report_committed(progress, 1, 'Completed with %d QC warning(s)' %warnings if warnings else 'Completed')
+
+    def run_chunked(self, progress=no_progress):
+        """Create tx.in from horizon(s) read `chunk_size` bytes at a time.
+
+        Each block is mapped to x, checked and written before the next one is
+        read, so memory is bounded by the block size and the survey table,
+        not by the horizon. For OBS, picks at the left of the shot go
+        straight to the tx.in, those at the right are spilled to a temporary
+        file next to it and copied after the left ones. The tx.in is the
+        same as of `run`, but decimation by curvature is not supported and
+        records are checked block by block (see `util.qc.RecordsCheck`).
+        """
+        self.qc_reports = []
+        obs = self.is_obs()
+        progress(0, 'Loading survey table')
+        with perf.stage('load_survey_data', path=self.survey_path) as st:
+            meta, trace_number_map = self.load_survey_data()
+            st.set(rows=trace_number_map.trace.size, file_bytes=perf.file_size(self.survey_path))
+        trace_range = (trace_number_map.trace.min(), trace_number_map.trace.max())
+        shot_loc = meta['shot_loc'] if obs else None
+        # all picks of SCS go to the left one
+        left = StreamDecimator(self.decimation, shot_loc)
+        right = StreamDecimator(self.decimation, shot_loc)
+        records_check = qc.RecordsCheck(self.save_path) if self.check else None
+        horizon_checks = []
+        save_dir = os.path.dirname(os.path.abspath(self.save_path))
+        tmp_path = '%s.%d.tmp' %(self.save_path, os.getpid())
+        total_bytes = self.horizon_bytes() or 1
+        read_bytes = rows = blocks = records_written = 0
+
+        with perf.stage('stream', path=self.save_path, chunk_size=self.chunk_size) as st, \
+                ExitStack() as stack:
+            out = stack.enter_context(open(tmp_path, 'w'))
+            # right picks of OBS, and text values of records for the companion,
+            # as raw records
+            spill = stack.enter_context(tempfile.TemporaryFile(dir=save_dir)) if obs else None
+            raw = stack.enter_context(
+                tempfile.TemporaryFile(dir=save_dir)) if self.companion else None
+
+            def write(records, final=False):
+                nonlocal records_written
+                if records_check is not None:
+                    records_check.update(records, final).raise_for_errors()
+                txin.write_records(out, records)
+                if raw is not None:
+                    txin.text_values(records).astype(txin.COMPANION_DTYPE).tofile(raw)
+                records_written += records.shape[0]
+
+            try:
+                if obs:
+                    write(txin.to_records([shot_loc, -1, 0, 0]))
+                for horizon in self.horizon_list():
+                    horizon_check = None
+                    if self.check:
+                        horizon_check = qc.HorizonCheck(trace_range, horizon.path)
+                    at_right = False
+                    for block in iter_columns(
+                            horizon.path, usecols=(1, 2), chunk_size=self.chunk_size):
+                        progress(
+                            0.1 + 0.85 * min(read_bytes / total_bytes, 1),
+                            'Writing tx.in from %s' %os.path.basename(horizon.path))
+                        if horizon_check is not None:
+                            horizon_check.update(block).raise_for_errors()
+                        picks = TxMakerCore.make_picks(
+                            self, block, meta, trace_number_map,
+                            horizon.precision, horizon.ray_number)
+                        if not obs:
+                            write(self.scs_records(left.feed(picks), ending=False))
+                        else:
+                            # rows are in order of trace: all picks after the
+                            # first one at the right of the shot are at the right
+                            idx = 0 if at_right else int(np.searchsorted(picks['x'], shot_loc))
+                            at_right = idx < picks.shape[0]
+                            write(left.feed(picks[:idx]))
+                            right.feed(picks[idx:]).tofile(spill)
+                        read_bytes += self.chunk_size
+                        rows += block.shape[0]
+                        blocks += 1
+                    if horizon_check is not None:
+                        horizon_checks.append(horizon_check.report)
+                if not obs:
+                    write(self.scs_records(left.flush(), ending=False))
+                else:
+                    write(left.flush())
+                    right.flush().tofile(spill)
+                    write(txin.to_records([shot_loc, 1, 0, 0]))
+                    spill.seek(0)
+                    for records in _read_blocks(spill, txin.RECORD_DTYPE):
+                        write(records)
+                write(txin.to_records(txin.ENDING_RECORD), final=True)
+                out.close()
+                # last chance to cancel before the tx.in is replaced
+                progress()
+            except BaseException:
+                out.close()
+                _remove(tmp_path)
+                raise
+            txin.remove_companion(self.save_path)
+            os.replace(tmp_path, self.save_path)
+            if raw is not None:
+                raw.seek(0)
+                txin.save_companion_blocks(
+                    self.save_path, _read_blocks(raw, txin.COMPANION_DTYPE), records_written)
+            st.set(
+                rows=rows, blocks=blocks, bytes_read=self.horizon_bytes(),
+                records=records_written, bytes_written=perf.file_size(self.save_path))
+        self.qc_reports.extend(horizon_checks)
+        if records_check is not None:
+            self.qc_reports.append(records_check.report)
+        self.report_completed(progress)
+
+
+class MultiTxMakerCore(TxMakerCore):
+    """Create one tx.in from several horizons of a survey, e.g. the Pg, PmP
+    and Pn of an OBS, each with its own precision and ray group.
+
+    The survey table is loaded once and all horizons are mapped to x in one
+    pass. For OBS, the picks at the left of the shot come first, horizon by
+    horizon in the given order, then those at the right.
+    """
+
+    def __init__(self, survey_type, survey_path, horizons, save_path, survey_registry=None,
+                 decimation=None, companion=False, check=True, chunk_size=None):
+        horizons = [Horizon(*h) for h in horizons]
+        if not horizons:
+            raise ValueError('No horizon given')
+        super().__init__(
+            survey_type, survey_path, None, None, None, save_path, survey_registry,
+            decimation, companion, check, chunk_size)
+        self.horizons = horizons
+        # row bounds of each horizon in the stacked horizon data
+        self.horizon_bounds = None
+
+    def load_horizon_data(self):
+        """Trace-time data of all horizons, stacked in order"""
+        data = [load_columns(h.path, usecols=(1, 2)) for h in self.horizons]
+        self.horizon_bounds = np.cumsum([0] + [d.shape[0] for d in data])
+        return np.concatenate(data).reshape(-1, 2)
+
+    def horizon_bytes(self):
+        return sum(perf.file_size(h.path) or 0 for h in self.horizons)
+
+    def horizon_list(self):
+        return self.horizons
+
+    def check_horizon(self, horizon_data, trace_number_map):
+        """QC of each horizon, traces may repeat across horizons"""
+        trace_range = (trace_number_map.trace.min(), trace_number_map.trace.max())
+        reports = [
+            qc.check_horizon(horizon_data[start:stop], trace_range, h.path)
+            for h, start, stop in zip(
+                self.horizons, self.horizon_bounds[:-1], self.horizon_bounds[1:])]
+        self.qc_reports.extend(reports)
+        failed = [report for report in reports if not report.ok]
+        if failed:
+            raise qc.QCError(failed)
+
+    def make_picks(self, horizon_data, meta, trace_number_map):
+        counts = np.diff(self.horizon_bounds)
+        return super().make_picks(
+            horizon_data, meta, trace_number_map,
+            np.repeat([h.precision for h in self.horizons], counts),
+            np.repeat([h.ray_number for h in self.horizons], counts))
+
+    def split_obs_picks(self, picks, shot_loc):
+        """Same split as `TxMakerCore.split_obs_picks` for each horizon,
+        computed for all horizons at once.
+        """
+        starts, stops = self.horizon_bounds[:-1], self.horizon_bounds[1:]
+        # searchsorted of each horizon is its number of picks left of shot
+        below = np.concatenate([[0], np.cumsum(picks['x'] < shot_loc)])
+        counts = stops - starts
+        n_left = np.repeat(below[stops] - below[starts], counts)
+        position = np.arange(picks.shape[0]) - np.repeat(starts, counts)
+        is_left = position < n_left
+        return picks[is_left], picks[~is_left]
+
+
+def make_tx(horizon_path, survey_path, save_path, horizon_precision=0.02, ray_number=1,
+            survey_type=None, progress=no_progress, decimation=None, companion=False,
+            check=True, chunk_size=None):
+    """Create a tx.in. The survey type is guessed from the survey file name if not given."""
+    if survey_type is None:
+        survey_type = SurveyType.from_survey_name(os.path.basename(survey_path))
+    TxMakerCore(
+        survey_type, survey_path, horizon_path, horizon_precision, ray_number, save_path,
+        decimation=decimation, companion=companion, check=check,
+        chunk_size=chunk_size).run(progress)
+    return save_path
+
+
+def make_multi_tx(horizons, survey_path, save_path, survey_type=None, progress=no_progress,
+                  decimation=None, companion=False, check=True, chunk_size=None):
+    """Create a tx.in from (path, precision, ray_number) of several horizons of a survey"""
+    if survey_type is None:
+        survey_type = SurveyType.from_survey_name(os.path.basename(survey_path))
+    MultiTxMakerCore(
+        survey_type, survey_path, horizons, save_path, decimation=decimation,
+        companion=companion, check=check, chunk_size=chunk_size).run(progress)
+    return save_path
@@ -0,0 +1,359 @@
+"""tx.in merger core: merge tx.in(s) of several OBS(s) into one"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import io
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from util import perf, qc, txin
+from util.dedup import dedup_records
+from util.job_runner import no_progress, report_committed
+from util.merge_manifest import MergeManifest, copy_range
+from util.txin_index import ShotIndex
+from util.txin_reader import TxinFile
+
+
+class TxMergerCore(object):
+    """Merge tx.in(s) from several OBS(s) into one tx.in file.
+
+    Fixed-width sources are memory-mapped and copied as raw text (see
+    `util.txin_reader`). Other sources are parsed into records (see
+    `util.txin`) in blocks of `BLOCK_SIZE` characters. Either way memory
+    usage does not depend on the size of the tx.in(s).
+    """
+
+    TX_ENDING_LINE = txin.LINE_FMT %txin.ENDING_RECORD + '\n'
+    BLOCK_SIZE = txin.BLOCK_SIZE
+
+    def __init__(self):
+        super().__init__()
+        # `util.qc.QCReport` of each source checked by the last merge
+        self.qc_reports = []
+
+    def run(self, src_paths, target_path, ray_number=None, incremental=False, workers=1,
+            progress=no_progress, companion=False, check=True, dedup=None, index=False):
+        """Merge src_paths into target_path.
+
+        With `incremental`, a manifest of the merge is kept next to the
+        target (see `util.merge_manifest`), and sources unchanged since the
+        previous merge are copied from the previous target as raw bytes.
+        With `workers` > 1, sources are normalized in parallel by a pool of
+        worker processes, then concatenated in the order of src_paths.
+        `progress(fraction, message)` is called as sources are merged.
+        With `companion`, the binary companion of the target is written too
+        (see `util.txin`).
+        With `check`, sources are checked by `util.qc`, a block at a time,
+        and the target is not replaced if any fails. Sources reused by an
+        incremental merge passed at the previous merge and are not checked
+        again; with `workers` > 1 the workers check the sources they
+        normalize.
+        With `dedup`, a (method, tolerance) of `util.dedup.parse_dedup`,
+        sources are loaded as records and duplicate picks collapsed, see
+        `util.dedup`. `incremental` and `workers` do not apply then.
+        With `index`, or if the target has one already, the shot block index
+        of the target is written, see `util.txin_index`.
+        Returns the number of sources reused from the previous merge.
+        """
+        if ray_number is not None and not isinstance(ray_number, int):
+            raise ValueError('Invalid ray_number: %r' %ray_number)
+        self.qc_reports = []
+        # an incremental or parallel merge checks the sources it processes
+        if check and (dedup is not None or not (incremental or workers > 1)):
+            with perf.stage('qc_sources', sources=len(src_paths)):
+                self.check_sources(src_paths, progress)
+        with perf.stage(
+                'merge', path=target_path, sources=len(src_paths), workers=workers,
+                bytes_read=sum(perf.file_size(p) or 0 for p in src_paths)) as st:
+            if dedup is not None:
+                records = self._run_dedup(src_paths, target_path, ray_number, dedup, progress)
+                reused = 0
+            elif incremental or workers > 1:
+                reused = self._run_assembled(
+                    src_paths, target_path, ray_number, incremental, workers, progress, check)
+            else:
+                reused = self._run_serial(src_paths, target_path, ray_number, progress)
+            st.set(reused=reused, checked=len(self.qc_reports), bytes_written=perf.file_size(target_path))
+        # the target is written, too late to cancel
+        txin.remove_companion(target_path)
+        if companion:
+            report_committed(progress, 1, 'Writing binary companion')
+            with perf.stage('write_companion', path=target_path):
+                if dedup is not None:
+                    txin.save_companion(target_path, records)
+                else:
+                    self.write_companion(src_paths, target_path, ray_number)
+        if index or os.path.isfile(ShotIndex.sidecar_path(target_path)):
+            report_committed(progress, 1, 'Indexing shot blocks')
+            with perf.stage('write_index', path=target_path):
+                self.write_index(target_path)
+        report_committed(progress, 1, 'Completed')
+        return reused
+
+    def check_sources(self, src_paths, progress=no_progress):
+        """QC of sources. Raises `util.qc.QCError` if any fails."""
+        self.qc_reports = qc.check_txins(src_paths, progress=progress)
+
+    def _run_serial(self, src_paths, target_path, ray_number, progress):
+        """Write target straight from the sources"""
+        tmp_path = '%s.%d.tmp' %(target_path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as fw:
+                for i, file in enumerate(src_paths):
+                    progress(i / len(src_paths), 'Merging %s' %os.path.basename(file))
+                    self.write_source(fw, file, ray_number, progress)
+                fw.write(self.TX_ENDING_LINE)
+            # last chance to cancel before the target is replaced
+            progress()
+        except BaseException:
+            _remove(tmp_path)
+            raise
+        os.replace(tmp_path, target_path)
+        return 0
+
+    def _run_dedup(self, src_paths, target_path, ray_number, dedup, progress):
+        """Write target from the records of all sources, duplicates collapsed.
+        Returns the records written.
+        """
+        parts, sources = [], []
+        for i, path in enumerate(src_paths):
+            progress(0.5 * i / len(src_paths), 'Loading %s' %os.path.basename(path))
+            records = txin.load_records(path)
+            # merged tx.in ends with one ending record of its own
+            records = records[~txin.is_ending(records)]
+            if ray_number is not None:
+                records = self.reset_ray_number(np.array(records), ray_number)
+            parts.append(records)
+            sources.append(np.full(records.shape[0], i, dtype=np.int32))
+        progress(0.5, 'Removing duplicate picks')
+        records = dedup_records(
+            np.concatenate(parts).astype(txin.RECORD_DTYPE, copy=False), np.concatenate(sources),
+            dedup)
+        progress(0.7, 'Writing %s' %os.path.basename(target_path))
+        tmp_path = '%s.%d.tmp' %(target_path, os.getpid())
+        try:
+            txin.save_records(tmp_path, records)
+            progress()
+        except BaseException:
+            _remove(tmp_path)
+            raise
+        os.replace(tmp_path, target_path)
+        return records
+
+    def _run_assembled(
+            self, src_paths, target_path, ray_number, incremental, workers, progress, check):
+        """Assemble target from segments of the previous target, parts made
+        by worker processes, or sources processed here.
+        """
+        old = None
+        if incremental and os.path.isfile(target_path):
+            old = MergeManifest.load(target_path)
+        if incremental and old is None:
+            progress(0, 'No manifest of a previous merge, merging all tx.in(s)')
+        segs = [old.find_unchanged(p, ray_number) if old else None for p in src_paths]
+        todo = [p for p, seg in zip(src_paths, segs) if seg is None]
+        in_workers = workers > 1 and len(todo) > 1
+        if check and not in_workers:
+            self.check_sources(todo, progress)
+        new = MergeManifest(target_path)
+        tmp_dir = tempfile.mkdtemp(
+            prefix='.merge_', dir=os.path.dirname(os.path.abspath(target_path)))
+        tmp_path = os.path.join(tmp_dir, 'target')
+        try:
+            parts = {}
+            if in_workers:
+                parts = self._make_parts(todo, ray_number, tmp_dir, workers, progress, check)
+            with open(tmp_path, 'wb') as fb:
+                # same newline translation as open(path, 'w')
+                fw = io.TextIOWrapper(fb, encoding='ascii')
+                old_target = open(target_path, 'rb') if old is not None else None
+                try:
+                    # workers did the first half of the work, if any
+                    base = 0.5 if parts else 0
+                    for i, (file, seg) in enumerate(zip(src_paths, segs)):
+                        progress(
+                            base + (1 - base) * i / len(src_paths),
+                            'Merging %s' %os.path.basename(file))
+                        fw.flush()
+                        offset = fb.tell()
+                        if seg is not None:
+                            copy_range(old_target, fb, seg['offset'], seg['length'])
+                        elif file in parts:
+                            with open(parts[file], 'rb') as part:
+                                copy_range(part, fb, 0, os.fstat(part.fileno()).st_size)
+                        else:
+                            self.write_source(fw, file, ray_number, progress)
+                            fw.flush()
+                        if incremental:
+                            new.add(
+                                file, ray_number, offset, fb.tell() - offset,
+                                seg['sha1'] if seg is not None else None)
+                finally:
+                    if old_target is not None:
+                        old_target.close()
+                fw.write(self.TX_ENDING_LINE)
+                fw.flush()
+                fw.detach()
+            progress()
+            os.replace(tmp_path, target_path)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        if incremental:
+            new.save()
+        return len(src_paths) - len(todo)
+
+    def _make_parts(
+            self, src_paths, ray_number, tmp_dir, workers, progress=no_progress, check=False):
+        """Normalize sources in worker processes, after checking them with
+        `check`. Returns {source: part file}. Raises `util.qc.QCError` if any
+        source fails.
+        """
+        tasks = [
+            (path, ray_number, os.path.join(tmp_dir, 'part%d' %i), check)
+            for i, path in enumerate(src_paths)]
+        reports = {}
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = dict(
+                (executor.submit(_make_part, task), task[0]) for task in tasks)
+            try:
+                for i, future in enumerate(as_completed(futures)):
+                    report = future.result()
+                    if report is not None:
+                        reports[futures[future]] = report
+                    progress(
+                        0.5 * (i + 1) / len(tasks),
+                        'Normalized %d of %d tx.in(s)' %(i + 1, len(tasks)))
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        if check:
+            self.qc_reports = [reports[path] for path in src_paths]
+            failed = [report for report in self.qc_reports if not report.ok]
+            if failed:
+                raise qc.QCError(failed)
+        return dict((task[0], task[2]) for task in tasks)
+
+    def write_companion(self, src_paths, target_path, ray_number=None):
+        """Binary companion of a merged tx.in. It is assembled from those of
+        the sources if they all have one, else parsed from the target.
+        """
+        parts = []
+        for path in src_paths:
+            records = txin.load_companion(path)
+            if records is None:
+                parts = None
+                break
+            if records.size and txin.is_ending(records[-1:])[0]:
+                records = records[:-1]
+            parts.append(records)
+        if parts is None:
+            try:
+                with TxinFile(target_path) as tx_file:
+                    records = tx_file.records()
+            except ValueError:
+                # not fixed-width
+                records = txin.load_records(target_path)
+        else:
+            parts.append(txin.to_records(txin.ENDING_RECORD))
+            records = np.concatenate(parts).astype(txin.RECORD_DTYPE)
+            if ray_number is not None:
+                records = self.reset_ray_number(records, ray_number)
+        txin.save_companion(target_path, records, exact=True)
+
+    def write_index(self, target_path):
+        """Shot block index of a merged tx.in, None if it is not fixed-width"""
+        try:
+            return ShotIndex.build(target_path)
+        except ValueError:
+            # an index of a previous target is of no use
+            try:
+                os.remove(ShotIndex.sidecar_path(target_path))
+            except FileNotFoundError:
+                pass
+            return None
+
+    def write_source(self, fw, path, ray_number=None, progress=no_progress):
+        """Write records of a source tx.in, without its ending record.
+
+        `progress()` is called for every block written, to allow cancelling.
+        """
+        tx_file = None
+        if not path.endswith(txin.COMPANION_SUFFIX):
+            try:
+                tx_file = TxinFile(path)
+            except ValueError:
+                # empty or not fixed-width
+                pass
+        if tx_file is None:
+            for records in self.iter_tx_records(path):
+                progress()
+                if ray_number is not None:
+                    records = self.reset_ray_number(records, ray_number)
+                txin.write_records(fw, records)
+            return
+        with tx_file:
+            stop = len(tx_file) - tx_file.has_ending
+            if stop == 0:
+                raise ValueError('Invalid tx.in format')
+            for text in tx_file.iter_text(0, stop, ray_number):
+                progress()
+                fw.write(text)
+
+    def iter_tx_records(self, path):
+        """Yield records of a tx.in block by block, without the ending record.
+
+        The last record is held back until the end of file, and dropped if
+        it is the ending record.
+        """
+        pending = None
+        count = 0
+        for records in txin.iter_record_blocks(path, self.BLOCK_SIZE):
+            if not records.size:
+                continue
+            if pending is not None:
+                yield pending
+            count += records.size
+            pending = records[-1:]
+            yield records[:-1]
+        if pending is None:
+            raise ValueError('Empty tx.in file: %s' %path)
+        if not txin.is_ending(pending)[0]:
+            yield pending
+        elif count == 1:
+            raise ValueError('Invalid tx.in format')
+
+    def reset_ray_number(self, records, ray_number):
+        """Set ray group of all picks. Shot headers and ending are kept."""
+        records['code'][txin.is_pick(records)] = ray_number
+        return records
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _make_part(task):
+    """Worker of parallel merge: check one source, if asked, and write it
+    normalized to a part file unless it fails. Returns the `QCReport`, or
+    None if not checked.
+    """
+    path, ray_number, part_path, check = task
+    report = qc.check_txin(path) if check else None
+    if report is None or report.ok:
+        with open(part_path, 'w') as fw:
+            TxMergerCore().write_source(fw, path, ray_number)
+    return report
+
+
+def merge_tx(src_paths, target_path, ray_number=None, incremental=False, workers=1,
+             progress=no_progress, companion=False, check=True, dedup=None, index=False):
+    """Merge tx.in(s). Returns the number of sources reused from the previous merge."""
+    return TxMergerCore().run(
+        src_paths, target_path, ray_number, incremental, workers, progress, companion, check,
+        dedup, index)
@@ -0,0 +1,76 @@
+"""Golden-file tests of tx.in writing
+
+    py -m pytest tests
+    py -m unittest discover tests
+
+`data/golden_*_tx.in` were written from `data/golden_*.csv` and the
+survey tables `data/golden_*.txt` by `TxMakerCore.run` as it was before
+tx.in(s) were formatted in bulk: np.savetxt for OBS, a '%' per line for
+SCS. The inputs give values at ties of the third decimal (x.xxx5),
+negative zeros and values wider than the 10 column fields, which
+`util.txin` leaves to '%'.
+"""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from core.maker import TxMakerCore
+from util import txin
+from util.survey_registry import SurveyRegistry
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+# survey type, horizon precision and ray number of each golden tx.in
+GOLDEN = (('obs', 0.0125, 2), ('scs', 0.0305, 3))
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class TestTxinGolden(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def make_tx(self, survey_type, precision, ray_number, **kwargs):
+        save_path = os.path.join(self.tmp.name, '%s_tx.in' %survey_type)
+        TxMakerCore(
+            survey_type, os.path.join(DATA_DIR, 'golden_%s.txt' %survey_type),
+            os.path.join(DATA_DIR, 'golden_%s.csv' %survey_type), precision, ray_number,
+            save_path, survey_registry=SurveyRegistry(), **kwargs).run()
+        return read_bytes(save_path)
+
+    def test_run(self):
+        for survey_type, precision, ray_number in GOLDEN:
+            with self.subTest(survey_type=survey_type):
+                self.assertEqual(
+                    self.make_tx(survey_type, precision, ray_number),
+                    read_bytes(os.path.join(DATA_DIR, 'golden_%s_tx.in' %survey_type)))
+
+    def test_run_chunked(self):
+        for survey_type, precision, ray_number in GOLDEN:
+            with self.subTest(survey_type=survey_type):
+                self.assertEqual(
+                    self.make_tx(survey_type, precision, ray_number, chunk_size=64),
+                    read_bytes(os.path.join(DATA_DIR, 'golden_%s_tx.in' %survey_type)))
+
+    def test_format_records(self):
+        values = [
+            0.0005, 0.0015, 1.0005, 2.0125, 13.1125, 6.5555, 123456.7895, 999999.9995,
+            -0.0, -0.0004, -0.0005, -1.0005, -999999.9995, 1234567.891, -123456.789,
+            1e12, np.nan, np.inf, -np.inf]
+        rows = [[x, t, 0.0125, code] for x in values for t in (0.0, -0.0, 1.2345)
+                for code in (0, 1, -1, 123456789, 12345678901)]
+        records = txin.to_records(rows)
+        expected = ''.join(txin.LINE_FMT %tuple(row) + '\n' for row in txin.to_columns(records))
+        self.assertEqual(''.join(txin.format_records(records, block_rows=97)), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,298 @@
+"""Headless batch mode of tx.in maker.
+
+Build tx.in(s) for many horizon/survey pairs in parallel, without the GUI.
+Jobs come either from a manifest file or from a glob of horizon files, e.g.
+
+    py tx_batch.py --horizons "horizon/*.csv" --jobs 4
+    py tx_batch.py --manifest jobs.csv --report report.json
+
+The manifest is a csv file with one job per line, in format of
+"horizon,survey[,precision[,ray_number[,save_path]]]". A header line starting
+with "horizon" is allowed. Relative paths are relative to the manifest file,
+and a survey may be given either as a path or as a file name in
+`trace_number_vs_x`.
+
+With `--horizons`, each horizon is paired with the survey whose name appears
+in the horizon file name (e.g. "obs30_Pg.csv" -> "obs30.txt"). Use
+`--all-pairs` to build every horizon against every survey instead.
+
+Exit code is 0 if all jobs succeed, 1 otherwise.
+"""
+
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import csv
+import glob
+import json
+import os
+import sys
+import time
+import traceback
+
+from __init__ import ROOT_DIR
+from core.maker import SURVEY_DIR, SURVEY_REGISTRY, SurveyType, TxMakerCore
+from util.log import get_logger
+from util import perf
+
+
+DEFAULT_PRECISION = 0.02
+DEFAULT_RAY_NUMBER = 1
+DEFAULT_SAVE_DIR = os.path.join(ROOT_DIR, 'tx_in')
+
+BatchJob = namedtuple(
+    'BatchJob',
+    'horizon_path survey_path survey_type horizon_precision ray_number save_path')
+JobResult = namedtuple('JobResult', 'job ok error detail elapsed')
+
+
+def _stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def resolve_survey_path(survey, base_dir=None):
+    """Resolve survey given as a path or as a file name in `trace_number_vs_x`"""
+    candidates = [survey]
+    if base_dir is not None:
+        candidates.insert(0, os.path.join(base_dir, survey))
+    candidates.append(os.path.join(SURVEY_DIR, survey))
+    candidates.append(os.path.join(SURVEY_DIR, survey + '.txt'))
+    for p in candidates:
+        if os.path.isfile(p):
+            return os.path.normpath(p)
+    raise ValueError('No Trace-Number vs. X-Offset table for survey "%s"' %(survey))
+
+
+def list_survey_paths(surveys=None):
+    """Survey tables to use. Default to all tables in `trace_number_vs_x`"""
+    if surveys:
+        return [resolve_survey_path(s) for s in surveys]
+    return sorted(
+        os.path.join(SURVEY_DIR, s) for s in os.listdir(SURVEY_DIR) if s.endswith('.txt'))
+
+
+def make_job(horizon_path, survey_path, precision=None, ray_number=None,
+             save_path=None, save_dir=DEFAULT_SAVE_DIR, survey_type=None):
+    if survey_type is None:
+        survey_type = SurveyType.from_survey_name(_stem(survey_path))
+    if precision is None:
+        precision = DEFAULT_PRECISION
+    if ray_number is None:
+        ray_number = DEFAULT_RAY_NUMBER
+    if save_path is None:
+        save_path = os.path.join(save_dir, _stem(horizon_path) + '_tx.in')
+    return BatchJob(
+        os.path.normpath(horizon_path), os.path.normpath(survey_path), survey_type,
+        float(precision), int(ray_number), os.path.normpath(save_path))
+
+
+def jobs_from_manifest(manifest_path, save_dir=DEFAULT_SAVE_DIR, survey_type=None):
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    jobs = []
+    with open(manifest_path, 'r', newline='') as f:
+        for lineno, row in enumerate(csv.reader(f), 1):
+            row = [s.strip() for s in row]
+            if not row or not row[0] or row[0].startswith('#'):
+                continue
+            if lineno == 1 and row[0].lower() == 'horizon':
+                continue
+            if len(row) < 2:
+                raise ValueError(
+                    'Manifest "%s" line %d: expect at least "horizon,survey"'
+                    %(manifest_path, lineno))
+            row += [''] * (5 - len(row))
+            horizon, survey, precision, ray_number, save_path = row[:5]
+            horizon = os.path.join(base_dir, horizon)
+            if save_path:
+                save_path = os.path.join(base_dir, save_path)
+            jobs.append(make_job(
+                horizon, resolve_survey_path(survey, base_dir),
+                precision or None, ray_number or None, save_path or None,
+                save_dir, survey_type))
+    return jobs
+
+
+def match_survey(horizon_path, survey_paths):
+    """The survey whose name appears in the horizon file name, longest name first"""
+    horizon_name = _stem(horizon_path).lower()
+    matched = [p for p in survey_paths if _stem(p).lower() in horizon_name]
+    if not matched:
+        return None
+    return max(matched, key=lambda p: len(_stem(p)))
+
+
+def jobs_from_glob(pattern, survey_paths, precision=None, ray_number=None,
+                   save_dir=DEFAULT_SAVE_DIR, all_pairs=False, survey_type=None):
+    """Returns (jobs, unmatched horizon paths)"""
+    jobs, unmatched = [], []
+    for horizon_path in sorted(glob.glob(pattern)):
+        if all_pairs:
+            for survey_path in survey_paths:
+                save_path = os.path.join(
+                    save_dir, '%s_%s_tx.in' %(_stem(horizon_path), _stem(survey_path)))
+                jobs.append(make_job(
+                    horizon_path, survey_path, precision, ray_number, save_path,
+                    survey_type=survey_type))
+            continue
+        survey_path = match_survey(horizon_path, survey_paths)
+        if survey_path is None:
+            unmatched.append(horizon_path)
+            continue
+        jobs.append(make_job(
+            horizon_path, survey_path, precision, ray_number,
+            save_dir=save_dir, survey_type=survey_type))
+    return jobs, unmatched
+
+
+def run_job(job):
+    """Build one tx.in. Runs in a worker process, so never raises."""
+    start = time.perf_counter()
+    try:
+        TxMakerCore(
+            job.survey_type, job.survey_path,
+            job.horizon_path, job.horizon_precision,
+            job.ray_number, job.save_path).run()
+    except Exception as e:
+        return JobResult(
+            job, False, '%s: %s' %(type(e).__name__, e), traceback.format_exc(),
+            time.perf_counter() - start)
+    return JobResult(job, True, None, None, time.perf_counter() - start)
+
+
+def warm_surveys(jobs):
+    """Parse each survey once in the parent process. Workers then load the
+    parsed tables from the registry's sidecar files instead of parsing text.
+    """
+    for survey_path in sorted(set(job.survey_path for job in jobs)):
+        try:
+            SURVEY_REGISTRY.get(survey_path)
+        except (OSError, ValueError):
+            # reported by the jobs using this survey
+            pass
+
+
+def run_batch(jobs, max_workers=None, on_result=None):
+    """Run jobs in a process pool and return results in the order of jobs.
+
+    `on_result` is called with each `JobResult` as soon as it completes.
+    With `max_workers=1` jobs run serially in current process.
+    """
+    results = [None] * len(jobs)
+    warm_surveys(jobs)
+    if max_workers == 1:
+        for i, job in enumerate(jobs):
+            results[i] = run_job(job)
+            if on_result is not None:
+                on_result(results[i])
+        return results
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run_job, job): i for i, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # worker process died, e.g. BrokenProcessPool
+                result = JobResult(
+                    jobs[i], False, '%s: %s' %(type(e).__name__, e),
+                    traceback.format_exc(), 0.0)
+            results[i] = result
+            if on_result is not None:
+                on_result(result)
+    return results
+
+
+def summarize(results, elapsed):
+    n_ok = sum(1 for r in results if r.ok)
+    return {
+        'total': len(results),
+        'succeeded': n_ok,
+        'failed': len(results) - n_ok,
+        'elapsed': round(elapsed, 3),
+        'jobs': [{
+            'horizon': r.job.horizon_path,
+            'survey': r.job.survey_path,
+            'survey_type': r.job.survey_type.name,
+            'ray_number': r.job.ray_number,
+            'save_path': r.job.save_path,
+            'ok': r.ok,
+            'error': r.error,
+            'elapsed': round(r.elapsed, 3),
+            } for r in results],
+        }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Build tx.in(s) for many horizon/survey pairs in parallel.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-m', '--manifest', help='csv manifest of jobs')
+    source.add_argument('-g', '--horizons', help='glob of horizon files, e.g. "horizon/*.csv"')
+    parser.add_argument(
+        '-s', '--surveys', nargs='+',
+        help='survey tables to pair with horizons (default: all in trace_number_vs_x)')
+    parser.add_argument(
+        '--all-pairs', action='store_true',
+        help='build every horizon against every survey')
+    parser.add_argument('--survey-type', choices=['obs', 'scs'], help='override guessed survey type')
+    parser.add_argument('-p', '--precision', type=float, help='horizon time precision')
+    parser.add_argument('-r', '--ray-number', type=int, help='ray group number')
+    parser.add_argument('-o', '--save-dir', default=DEFAULT_SAVE_DIR, help='directory for tx.in(s)')
+    parser.add_argument('-j', '--jobs', type=int, help='number of worker processes')
+    parser.add_argument('--report', help='write summary report as json to this path')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logger = get_logger('TxBatch', 'tx_batch.log')
+    survey_type = SurveyType[args.survey_type.upper()] if args.survey_type else None
+
+    unmatched = []
+    if args.manifest:
+        jobs = jobs_from_manifest(args.manifest, args.save_dir, survey_type)
+    else:
+        jobs, unmatched = jobs_from_glob(
+            args.horizons, list_survey_paths(args.surveys), args.precision,
+            args.ray_number, args.save_dir, args.all_pairs, survey_type)
+    for p in unmatched:
+        print('[SKIP] %s: no matching survey' %(p))
+        logger.warning('No matching survey for horizon: %s', p)
+    if not jobs:
+        print('No jobs to run.')
+        return 1
+
+    save_paths = [job.save_path for job in jobs]
+    duplicated = sorted(set(p for p in save_paths if save_paths.count(p) > 1))
+    if duplicated:
+        print('Several jobs would write to the same tx.in:\n  %s' %('\n  '.join(duplicated)))
+        return 1
+
+    def on_result(result):
+        job = result.job
+        if result.ok:
+            print('[ OK ] %s + %s -> %s (%.2fs)' %(
+                os.path.basename(job.horizon_path), os.path.basename(job.survey_path),
+                job.save_path, result.elapsed))
+        else:
+            print('[FAIL] %s + %s: %s' %(
+                os.path.basename(job.horizon_path), os.path.basename(job.survey_path),
+                result.error))
+            logger.error('Job failed: %r\n%s', job, result.detail)
+
+    start = time.perf_counter()
+    results = run_batch(jobs, args.jobs, on_result)
+    summary = summarize(results, time.perf_counter() - start)
+    summary['unmatched'] = unmatched
+
+    print('%d job(s): %d succeeded, %d failed, %d horizon(s) unmatched, in %.2fs' %(
+        summary['total'], summary['succeeded'], summary['failed'], len(unmatched),
+        summary['elapsed']))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return 0 if summary['failed'] == 0 and not unmatched else 1
+
+
+if __name__ == '__main__':
+    sys.exit(perf.run_profiled(main))
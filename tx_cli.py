@@ -0,0 +1,243 @@
+"""Command line interface of tx.in manager, without the GUI.
+
+    py tx_cli.py make horizon/obs30_Pg.csv -s obs30 -p 0.03 -r 2
+    py tx_cli.py make horizon/obs30_Pg.csv horizon/obs30_PmP.csv -s obs30 -r 1 2
+    py tx_cli.py make horizon/obs30_Pg.csv -s obs30 --decimate bin:0.1
+    py tx_cli.py make horizon/obs30_3d.csv -s obs30 --chunk-size 64
+    py tx_cli.py merge tx_in/obs30_Pg_tx.in tx_in/obs31_Pg_tx.in -o tx_in/Pg_tx.in -r 2
+    py tx_cli.py merge tx_in/obs30_Pg_tx.in tx_in/obs30_Pg_v2_tx.in -o tx_in/obs30_tx.in -u average:0.005
+    py tx_cli.py merge tx_in/obs3*_tx.in -o tx_in/all_tx.in --index
+    py tx_cli.py station list tx_in/all_tx.in
+    py tx_cli.py station extract tx_in/all_tx.in 13.113 -o tx_in/obs30_tx.in
+    py tx_cli.py station replace tx_in/all_tx.in 13.113 tx_in/obs30_v2_tx.in
+    py tx_cli.py batch --horizons "horizon/*.csv" --jobs 4
+    py tx_cli.py watch --merge tx_in/all_tx.in
+
+`tx-manager` with arguments runs this. `batch` and `watch` take
+the arguments of `tx_batch.py` and `tx_watch.py`. Nothing on this path imports tkinter, so it
+runs on machines without a display, e.g. compute nodes.
+
+Exit code is 0 on success, 1 otherwise.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from core import SurveyType, make_multi_tx, make_tx, merge_tx
+import tx_batch
+from util.decimate import parse_decimation
+from util.dedup import parse_dedup
+from util.job_runner import no_progress
+from util.merge_manifest import MergeManifest
+from util.txin_index import ShotIndex
+from util import perf, txin
+
+
+def print_progress(fraction=None, message=None):
+    if message:
+        print('  %3d%% %s' %(round(100 * (fraction or 0)), message), file=sys.stderr)
+
+
+def per_horizon(values, n, name):
+    """Values of an option given once for all horizons, or once per horizon"""
+    if len(values) == 1:
+        return values * n
+    if len(values) != n:
+        raise ValueError('Expect 1 or %d values of %s, got %d' %(n, name, len(values)))
+    return values
+
+
+def cmd_make(args):
+    survey_path = tx_batch.resolve_survey_path(args.survey)
+    save_path = args.output or os.path.join(
+        tx_batch.DEFAULT_SAVE_DIR,
+        os.path.splitext(os.path.basename(args.horizons[0]))[0] + '_tx.in')
+    survey_type = SurveyType[args.survey_type.upper()] if args.survey_type else None
+    progress = print_progress if args.verbose else no_progress
+    n = len(args.horizons)
+    precisions = per_horizon(args.precision, n, '--precision')
+    ray_numbers = per_horizon(args.ray_number, n, '--ray-number')
+    decimation = parse_decimation(args.decimate)
+    if args.chunk_size is not None and args.chunk_size <= 0:
+        raise ValueError('Invalid --chunk-size %s, expect a positive number of MiB' %args.chunk_size)
+    chunk_size = int(args.chunk_size * 2**20) if args.chunk_size else None
+    if n == 1:
+        make_tx(
+            args.horizons[0], survey_path, save_path, precisions[0], ray_numbers[0],
+            survey_type, progress, decimation, args.companion, not args.no_qc, chunk_size)
+    else:
+        make_multi_tx(
+            list(zip(args.horizons, precisions, ray_numbers)), survey_path, save_path,
+            survey_type, progress, decimation, args.companion, not args.no_qc, chunk_size)
+    return save_path
+
+
+def cmd_merge(args):
+    missing = [p for p in args.sources if not os.path.isfile(p)]
+    if missing:
+        raise ValueError('File not exists: %s' %(', '.join(missing)))
+    dedup = parse_dedup(args.dedup)
+    # the first incremental merge to a file starts its manifest
+    new_manifest = args.incremental and dedup is None and MergeManifest.load(args.output) is None
+    reused = merge_tx(
+        args.sources, args.output, args.ray_number, args.incremental, args.jobs,
+        print_progress if args.verbose else no_progress, args.companion, not args.no_qc,
+        dedup, args.index)
+    if new_manifest:
+        print('No manifest of a previous merge to %s, merged all %d tx.in(s) and wrote %s' %(
+            args.output, len(args.sources), MergeManifest.manifest_path(args.output)))
+    elif args.incremental:
+        print('%d of %d tx.in(s) reused from the previous merge' %(reused, len(args.sources)))
+    return args.output
+
+
+def cmd_station(args):
+    """Stations of a merged tx.in, through its shot block index"""
+    if not os.path.isfile(args.txin):
+        raise ValueError('File not exists: %s' %args.txin)
+    index = ShotIndex.open(args.txin)
+    try:
+        if args.action == 'list':
+            for shot_loc, runs in sorted(index.stations().items()):
+                blocks = [i for start, stop in runs for i in range(start, stop)]
+                picks = sum(int(index.meta['count'][i]) - 1 for i in blocks)
+                groups = sorted(set(g for i in blocks for g in index.ray_groups(i).tolist()))
+                print('%10.3f  %d block(s)  %d picks  ray group(s) %s' %(
+                    shot_loc, len(blocks), picks, ' '.join(str(g) for g in groups)))
+            return args.txin
+        if args.action == 'extract':
+            text = index.extract(args.shot_loc) + txin.LINE_FMT %txin.ENDING_RECORD + '\n'
+            if args.output is None:
+                sys.stdout.write(text)
+                return args.txin
+            with open(args.output, 'w') as f:
+                f.write(text)
+            return args.output
+        if args.action == 'replace':
+            records = txin.load_records(args.source)
+            index.replace(args.shot_loc, records[~txin.is_ending(records)])
+        else:
+            index.delete(args.shot_loc)
+    except KeyError as e:
+        raise ValueError(e.args[0])
+    # the binary companion no longer fits the tx.in
+    txin.remove_companion(args.txin)
+    return args.txin
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='tx-manager', description='Create and merge rayinvr tx.in(s) without the GUI.')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    make = commands.add_parser(
+        'make', help='create a tx.in from horizon files of one survey')
+    make.add_argument(
+        'horizons', nargs='+',
+        help='horizon files exported from Kingdom ("Line,Trace,Time"), one per phase')
+    make.add_argument(
+        '-s', '--survey', required=True,
+        help='Trace-Number vs. X-Offset table, as a path or a name in trace_number_vs_x')
+    make.add_argument('--survey-type', choices=['obs', 'scs'], help='override guessed survey type')
+    make.add_argument(
+        '-p', '--precision', type=float, nargs='+', default=[tx_batch.DEFAULT_PRECISION],
+        help='horizon time precision, for all or for each horizon (default: %(default)s)')
+    make.add_argument(
+        '-r', '--ray-number', type=int, nargs='+', default=[tx_batch.DEFAULT_RAY_NUMBER],
+        help='ray group number, for all or for each horizon (default: %(default)s)')
+    make.add_argument(
+        '-o', '--output', help='tx.in to write (default: tx_in/<first horizon>_tx.in)')
+    make.add_argument(
+        '-d', '--decimate', metavar='METHOD:VALUE',
+        help='thin picks: nth:<n>, bin:<width km> or curvature:<tolerance s>, '
+             'see util/decimate.py')
+    make.add_argument(
+        '-b', '--companion', action='store_true',
+        help='also write the binary companion <tx.in>.npy for fast reload')
+    make.add_argument(
+        '--no-qc', action='store_true', help='skip quality checks, see util/qc.py')
+    make.add_argument(
+        '-c', '--chunk-size', type=float, metavar='MIB',
+        help='read horizons MIB MiB at a time and stream the tx.in to disk, '
+             'for horizons larger than memory')
+    make.add_argument('-v', '--verbose', action='store_true', help='print progress')
+    make.set_defaults(func=cmd_make)
+
+    merge = commands.add_parser('merge', help='merge tx.in(s) into one')
+    merge.add_argument('sources', nargs='+', help='tx.in(s) to merge, in order')
+    merge.add_argument('-o', '--output', required=True, help='merged tx.in to write')
+    merge.add_argument(
+        '-r', '--ray-number', type=int, help='reset ray group of all picks to this number')
+    merge.add_argument(
+        '-i', '--incremental', action='store_true',
+        help='reuse unchanged sources of the previous merge')
+    merge.add_argument('-j', '--jobs', type=int, default=1, help='number of worker processes')
+    merge.add_argument(
+        '-b', '--companion', action='store_true',
+        help='also write the binary companion <tx.in>.npy for fast reload')
+    merge.add_argument(
+        '-u', '--dedup', metavar='METHOD[:TOL]',
+        help='collapse duplicate picks of the sources within TOL km: drop or average, '
+             'see util/dedup.py')
+    merge.add_argument(
+        '--index', action='store_true',
+        help='also write the shot block index <tx.in>.idx.npz, see util/txin_index.py')
+    merge.add_argument(
+        '--no-qc', action='store_true', help='skip quality checks, see util/qc.py')
+    merge.add_argument('-v', '--verbose', action='store_true', help='print progress')
+    merge.set_defaults(func=cmd_merge)
+
+    station = commands.add_parser(
+        'station', help='list, extract, replace or delete stations of a merged tx.in')
+    actions = station.add_subparsers(dest='action', metavar='action')
+    actions.required = True
+    station_list = actions.add_parser('list', help='list stations by shot location')
+    station_list.add_argument('txin', help='merged tx.in')
+    extract = actions.add_parser('extract', help='write the shot blocks of a station as a tx.in')
+    extract.add_argument('txin', help='merged tx.in')
+    extract.add_argument('shot_loc', type=float, help='shot location of the station')
+    extract.add_argument('-o', '--output', help='tx.in to write (default: stdout)')
+    replace = actions.add_parser('replace', help='replace a station with the records of a tx.in')
+    replace.add_argument('txin', help='merged tx.in')
+    replace.add_argument('shot_loc', type=float, help='shot location of the station')
+    replace.add_argument('source', help='tx.in of the new station')
+    delete = actions.add_parser('delete', help='delete a station')
+    delete.add_argument('txin', help='merged tx.in')
+    delete.add_argument('shot_loc', type=float, help='shot location of the station')
+    station.set_defaults(func=cmd_station)
+
+    batch = commands.add_parser(
+        'batch', add_help=False, help='create tx.in(s) for many horizons, see tx_batch.py -h')
+    batch.add_argument('args', nargs=argparse.REMAINDER)
+
+    watch = commands.add_parser(
+        'watch', add_help=False,
+        help='rebuild tx.in(s) when horizons or surveys change, see tx_watch.py -h')
+    watch.add_argument('args', nargs=argparse.REMAINDER)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['batch']:
+        # tx_batch parses its own arguments, -h included
+        return tx_batch.main(argv[1:])
+    if argv[:1] == ['watch']:
+        import tx_watch
+        return tx_watch.main(argv[1:])
+    args = parse_args(argv)
+    start = time.perf_counter()
+    try:
+        save_path = args.func(args)
+    except (OSError, ValueError) as e:
+        print('Error: %s' %(e), file=sys.stderr)
+        return 1
+    print('%s (%.2fs)' %(save_path, time.perf_counter() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(perf.run_profiled(main))
@@ -1,7 +1,3 @@
-from enum import Enum
-from itertools import islice
-import logging
-import numpy as np
 import os
 import tkinter as tk
 from tkinter import ttk
@@ -9,14 +5,20 @@ from tkinter import filedialog
 from tkinter import messagebox
 import traceback
 
-from util.custom_widgets import TextLineNumbers, CustomText
+from __init__ import ROOT_DIR, SURVEY_DIR
+from util.custom_widgets import FilePreviewer, JobPanel, enable_dpi_awareness
+from util.job_runner import JobRunner
+from util.log import get_logger
+
+
+def __getattr__(name):
+    """Names of the core, imported on first use to keep numpy out of start-up"""
+    if name in ('SURVEY_REGISTRY', 'SurveyType', 'TxMakerCore'):
+        from core import maker
+        return getattr(maker, name)
+    raise AttributeError('module %r has no attribute %r' %(__name__, name))
 
 
-ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
-SURVEY_DIR = os.path.join(ROOT_DIR, 'trace_number_vs_x')
-SURVEY_NAMES = os.listdir(SURVEY_DIR)
-TIME_OFFSETS = [0] * len(SURVEY_NAMES)
-NLINE_PREVIEW = 100
 # SURVEY_NAMES = ('obs33a', 'obs34a', 'obs31', 'obs30', 'scs_line4a', 'scs_line1a')
 # TIME_OFFSETS = (0.0220, 0.0290, 0.0365, 0.1537, -0.0348, 0)
 
@@ -25,12 +27,13 @@ class TxMaker(ttk.Frame):
     """tx.in maker"""
     def __init__(self, master=None):
         super().__init__(master)
-        self.logger = self._get_logger()
+        self.logger = get_logger('TxMaker', 'tx_maker.log')
         self.init_variables()
         # self.set_custom_style()
         self.create_widgets()
 
     def init_variables(self):
+        self.survey_names = os.listdir(SURVEY_DIR)
         self.survey_idx = None
         self.horizon_path = tk.StringVar()
         self.horizon_preview_msg = tk.StringVar()
@@ -39,7 +42,7 @@ class TxMaker(ttk.Frame):
         self.ray_number = tk.IntVar()
         self.save_path = tk.StringVar()
         self.horizon_preview_msg.set(
-            'The heading %d lines of selected horizon file. (Format as "Line,Trace,Time"): ' %(NLINE_PREVIEW))
+            'Selected horizon file. (Format as "Line,Trace,Time"): ')
         self.horizon_precision.set(0.02)
         self.survey_preview_msg.set('The Trace-Number vs. X-Offset Table for selected survey: ')
         self.ray_number.set(1)
@@ -85,9 +88,8 @@ class TxMaker(ttk.Frame):
             horizon_preview_header, text='open it', style='sm.TButton', state=tk.DISABLED,
             command=self.open_horizon_file)
         self.btn_open_horizon_file.grid(row=0, column=1, sticky='nsw')
-        horizon_previewer = ttk.Frame(row_horizon)
-        self.horizon_text = self.create_text_previewer(horizon_previewer)
-        horizon_previewer.grid(row=2, column=0, pady=PADY_SM, sticky='nswe')
+        self.horizon_previewer = FilePreviewer(row_horizon)
+        self.horizon_previewer.grid(row=2, column=0, pady=PADY_SM, sticky='nswe')
 
         # Set horizon time precision
         prec_setter = ttk.Frame(row_horizon)
@@ -108,7 +110,7 @@ class TxMaker(ttk.Frame):
         survey_selector.grid(row=0, column=0, pady=PADY_SM, sticky='nswe')
         ttk.Label(survey_selector, text='Select Survey Meta File: ')\
             .grid(row=0, column=0, sticky='nsw')
-        cbox = ttk.Combobox(survey_selector, width=12, state='readonly', values=SURVEY_NAMES)
+        cbox = ttk.Combobox(survey_selector, width=12, state='readonly', values=self.survey_names)
         cbox.grid(row=0, column=1, sticky='nsw')
         cbox.bind('<<ComboboxSelected>>', self.survey_changed)
         # ttk.Label(survey_selector, text='Time offset for selected survey (second): ')\
@@ -119,9 +121,8 @@ class TxMaker(ttk.Frame):
         # Preview survey file
         ttk.Label(row_survey, textvariable=self.survey_preview_msg)\
             .grid(row=1, column=0, pady=PADY_SM, sticky='nsw')
-        survey_previewer = ttk.Frame(row_survey)
-        self.survey_text = self.create_text_previewer(survey_previewer)
-        survey_previewer.grid(row=2, column=0, pady=PADY_SM_E, sticky='nswe')
+        self.survey_previewer = FilePreviewer(row_survey)
+        self.survey_previewer.grid(row=2, column=0, pady=PADY_SM_E, sticky='nswe')
 
         # tx.in Options
         row_txin = ttk.LabelFrame(self, text='tx.in Options')
@@ -153,36 +154,12 @@ class TxMaker(ttk.Frame):
         row_cmd.rowconfigure(0, weight=1)
         row_cmd.columnconfigure(0, weight=1)
         row_cmd.grid(column=0, padx=PADX_LG, pady=PADY_LLG_E, sticky='nswe')
-        ttk.Button(row_cmd, text='OK', command=self.handle_ok).grid(row=0, column=0)
-
-
-    def create_text_previewer(self, container):
-        container.rowconfigure(0, weight=1)
-        container.columnconfigure(1, weight=1)
-        text_widget = CustomText(container, font=('Consolas', 10), state=tk.DISABLED)
-        text_widget.grid(row=0, column=1, sticky='nswe')
-        y_scroll = tk.Scrollbar(container, orient=tk.VERTICAL, command=text_widget.yview)
-        y_scroll.grid(row=0, column=2, sticky='ns')
-        text_widget.config(yscrollcommand=y_scroll.set)
-        # show text line numbers
-        horizon_text_ln = TextLineNumbers(container, width=30)
-        horizon_text_ln.attach(text_widget)
-        horizon_text_ln.grid(row=0, column=0, sticky='nsw')
-        text_widget.bind("<<Change>>", horizon_text_ln.redraw)
-        text_widget.bind("<Configure>", horizon_text_ln.redraw)
-        return text_widget
-
-
-    def _get_logger(self):
-        logger = logging.getLogger('TxMaker')
-        logger.setLevel(logging.DEBUG)
-        LOG_FILE_PATH = os.path.join(ROOT_DIR, 'log', 'tx_maker.log')
-        file_handler = logging.FileHandler(LOG_FILE_PATH, encoding='utf8')
-        file_handler.setLevel(logging.DEBUG)
-        formatter = logging.Formatter('[%(asctime)s] %(name)s %(levelname)s: %(message)s')
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-        return logger
+        self.btn_ok = ttk.Button(row_cmd, text='OK', command=self.handle_ok)
+        self.btn_ok.grid(row=0, column=0)
+        self.job_panel = JobPanel(row_cmd, on_cancel=self.cancel_job)
+        self.job_panel.grid(row=1, column=0, pady=PADY_LG, sticky='we')
+        self.job_runner = JobRunner(self, self.job_panel.set_progress)
+
 
     def select_horizon_path(self):
         p = filedialog.askopenfilename(
@@ -202,11 +179,7 @@ class TxMaker(ttk.Frame):
         # enable open-horizon-file button
         self.btn_open_horizon_file.config(state=tk.NORMAL)
         # show horizon preview
-        text = self._get_horizon_content()
-        self.horizon_text.config(state=tk.NORMAL)
-        self.horizon_text.delete('1.0', tk.END)
-        self.horizon_text.insert(tk.END, text)
-        self.horizon_text.config(state=tk.DISABLED)
+        self.horizon_previewer.set_file(self._get_horizon_preview_path())
         # # set default value for horizon precision
         # precision = 0.03 if 'obs' in new_path else 0.02
         # self.horizon_precision.set(precision)
@@ -232,145 +205,86 @@ class TxMaker(ttk.Frame):
 
     def survey_changed(self, event):
         self.survey_idx = event.widget.current()
-        text = self._get_survey_content()
-        self.survey_text.config(state=tk.NORMAL)
-        self.survey_text.delete('1.0', tk.END)
-        self.survey_text.insert(tk.END, text)
-        self.survey_text.config(state=tk.DISABLED)
+        self.survey_previewer.set_file(self._get_survey_preview_path())
 
-    def _get_horizon_content(self):
+    def _get_horizon_preview_path(self):
         file_path = self.horizon_path.get()
         if not os.path.isfile(file_path):
             messagebox.showerror('Error', 'File not exists: \n%s'%(file_path))
-            return ''
-        with open(file_path, 'r') as f:
-            lines = list(islice(f, NLINE_PREVIEW))
-            return ''.join(lines)
+            return None
+        return file_path
 
     def _get_survey_file_path(self):
-        survey_name = SURVEY_NAMES[self.survey_idx]
+        survey_name = self.survey_names[self.survey_idx]
         survey_path = os.path.join(SURVEY_DIR, survey_name)
         return survey_path
 
-    def _get_survey_content(self):
+    def _get_survey_preview_path(self):
         """Survey info: trace-number vs. x-offset table"""
-        survey_name = SURVEY_NAMES[self.survey_idx]
+        survey_name = self.survey_names[self.survey_idx]
         survey_path = self._get_survey_file_path()
         if not os.path.isfile(survey_path):
             messagebox.showerror(
                 'Error', 'No Trace-Number vs. X-Offset table for survey "%s".\nPlease create one '
                 'at "%s"' %(survey_name, os.path.join(SURVEY_DIR, survey_name)))
-            return ''
-        with open(survey_path, 'r') as f:
-            return f.read()
+            return None
+        return survey_path
 
     def handle_ok(self):
-        survey_name = SURVEY_NAMES[self.survey_idx]
-        survey_type = SurveyType.OBS if 'obs' in survey_name.lower() else SurveyType.SCS
+        if self.job_runner.busy:
+            return
+        # numpy and the core are imported on first use, not at start-up
+        from core.maker import SurveyType, TxMakerCore
+        survey_name = self.survey_names[self.survey_idx]
+        survey_type = SurveyType.from_survey_name(survey_name)
         survey_path = self._get_survey_file_path()
         tx_maker = TxMakerCore(
             survey_type, survey_path,
             self.horizon_path.get(), self.horizon_precision.get(),
             self.ray_number.get(), self.save_path.get(),)
-        tx_maker.run()
+        self.btn_ok.config(state=tk.DISABLED)
+        self.job_panel.start()
+        self.job_runner.start(
+            tx_maker.run, on_done=self._job_done, on_error=self._job_failed,
+            on_cancelled=self._job_cancelled)
+
+    def cancel_job(self):
+        self.job_runner.cancel()
+        self.job_panel.set_progress(message='Cancelling...')
+
+    def _job_finished(self, message):
+        self.btn_ok.config(state=tk.NORMAL)
+        self.job_panel.stop(message)
+
+    def _job_done(self, result):
+        self._job_finished('Completed.')
         messagebox.showinfo('Info', 'Completed.')
 
+    def _job_failed(self, exc, val, tb):
+        from util.qc import QCError
+        self._job_finished('Failed.')
+        if isinstance(val, QCError):
+            self.logger.error(val)
+            messagebox.showerror('QC Failed', str(val))
+            return
+        self.report_callback_exception(exc, val, tb)
+
+    def _job_cancelled(self):
+        self._job_finished('Cancelled.')
+
+    def destroy(self):
+        self.job_runner.shutdown()
+        super().destroy()
+
     def report_callback_exception(self, exc, val, tb):
-        self.logger.exception(val)
+        self.logger.error(val, exc_info=(exc, val, tb))
         err_msg = traceback.format_exception(exc, val, tb)
         err_msg = ''.join(err_msg)
         messagebox.showerror('Internal Error', err_msg)
 
 
-
-class SurveyType(Enum):
-    """Enumerate class for survey types"""
-    SCS = 1
-    OBS = 2
-
-
-class TxMakerCore(object):
-    """Create tx.in file from trace-time data exported from the Kingdom Software"""
-
-    LINE_FMT = '%10.3f%10.3f%10.3f%10d'
-
-    def __init__(
-            self, survey_type, survey_path, horizon_path,
-            horizon_precision, ray_number, save_path):
-        self.survey_type = survey_type
-        self.survey_path = survey_path
-        self.horizon_path = horizon_path
-        self.horizon_precision = horizon_precision
-        self.ray_number = ray_number
-        self.save_path = save_path
-
-    def load_survey_data(self):
-        with open(self.survey_path, 'r') as f:
-            # the first line contains meta info.
-            # meta line format: <shot_loc>,<time_offset>
-            meta_line = f.readline().strip()
-            trace_number_map = np.genfromtxt(f, delimiter=',')
-        if not np.all(np.diff(trace_number_map, axis=0) > 0):
-            raise ValueError(
-                'Invalid Trace-Number vs. X-Offset Table: [%s].'
-                'Rows should in order of increasing.' %(self.survey_path))
-        meta = self._parse_shot_meta(meta_line)
-        return meta, trace_number_map
-
-    def _parse_shot_meta(self, meta_line):
-        """meta line format: <shot_loc>,<time_offset>"""
-        meta_names = ['shot_loc', 'time_offset']
-        meta_values = [float(s.strip()) for s in meta_line.strip().split(',')]
-        if len(meta_names) != len(meta_values):
-            raise ValueError(
-                'Meta line(the first line) of file "{}" format error. Should contain '
-                'the following fields delimited by comma: [{}]'
-                .format(self.survey_path, ', '.join(meta_names)))
-        meta = dict(zip(meta_names, meta_values))
-        return meta
-
-    def load_horizon_data(self):
-        return np.genfromtxt(self.horizon_path, delimiter=',', usecols=(1, 2))
-
-    def make_tx_for_obs(self, tx_data, shot_loc):
-        idx = np.searchsorted(tx_data[:, 0], shot_loc)
-        res = np.vstack([
-            [shot_loc, -1, 0, 0],
-            tx_data[:idx, :],
-            [shot_loc, 1, 0, 0],
-            tx_data[idx:, :],
-            [0, 0, 0, -1],
-            ])
-        np.savetxt(self.save_path, res, fmt=self.LINE_FMT)
-
-    def make_tx_for_scs(self, tx_data):
-        fmt = self.LINE_FMT+'\n'
-        with open(self.save_path, 'w') as f:
-            for row in tx_data:
-                shot_loc = row[0]
-                f.write(fmt %(shot_loc, 1, 0, 0))
-                f.write(fmt %tuple(row))
-            f.write(fmt %(0, 0, 0, -1))
-
-    def run(self):
-        meta, trace_number_map = self.load_survey_data()
-        horizon_data = self.load_horizon_data()
-        trace_number = horizon_data[:, 0:1]
-        x = np.interp(trace_number, trace_number_map[:, 0], trace_number_map[:, 1])
-        time = horizon_data[:, 1:2] + meta['time_offset']
-        tx_data = np.hstack([x, time, np.ones_like(x)*self.horizon_precision, np.ones_like(x)*self.ray_number])
-        obs, scs = SurveyType.OBS, SurveyType.SCS
-        if self.survey_type in (obs, obs.name, obs.value, obs.name.lower()):
-            self.make_tx_for_obs(tx_data, meta['shot_loc'])
-        elif self.survey_type in (scs, scs.name, scs.value, scs.name.lower()):
-            self.make_tx_for_scs(tx_data)
-        else:
-            raise ValueError('Invalid survey type "%r". Support only "obs" and "scs"' %(self.survey_type))
-
-
 if __name__ == '__main__':
-    from ctypes import windll
-    windll.shcore.SetProcessDpiAwareness(1)
+    enable_dpi_awareness()
 
     root = tk.Tk()
     root.title('tx.in maker')
@@ -1,20 +1,27 @@
-import logging
-import os
+import importlib
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
 import traceback
 
-from __init__ import ROOT_DIR
-from tx_maker import TxMaker
-from tx_merger import TxMerger
+from util.custom_widgets import enable_dpi_awareness
+from util.log import get_logger
+
+
+# (tab text, module, frame class). Modules are imported when the tab is
+# first selected, so start-up does not pay for numpy or the other tab.
+TABS = (
+    (' Create tx.in ', 'tx_maker', 'TxMaker'),
+    (' Merge tx.in ', 'tx_merger', 'TxMerger'),
+    )
 
 
 class TxManager(ttk.Frame):
     """tx.in manager"""
     def __init__(self, master=None):
         super().__init__(master)
-        self.logger = self._get_logger()
+        self.logger = get_logger('TxManager', 'tx_manager.log')
+        self.tabs = {}
         # self.set_custom_style()
         self.create_widgets()
 
@@ -29,35 +36,36 @@ class TxManager(ttk.Frame):
         self.rowconfigure(0, weight=1)
         self.columnconfigure(0, weight=1)
 
-        # create a Notebook widget to contain several panels
-        notebook = ttk.Notebook(self)
-        notebook.grid(row=0, column=0, sticky='nswe')
-        tx_maker = TxMaker(notebook)
-        notebook.add(tx_maker, text=' Create tx.in ', sticky='nswe')
-        tx_merger = TxMerger(notebook)
-        notebook.add(tx_merger, text=' Merge tx.in ', sticky='nswe')
-
-    def _get_logger(self):
-        logger = logging.getLogger('TxManager')
-        logger.setLevel(logging.DEBUG)
-        LOG_FILE_PATH = os.path.join(ROOT_DIR, 'log', 'tx_manager.log')
-        file_handler = logging.FileHandler(LOG_FILE_PATH, encoding='utf8')
-        file_handler.setLevel(logging.DEBUG)
-        formatter = logging.Formatter('[%(asctime)s] %(name)s %(levelname)s: %(message)s')
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-        return logger
+        # create a Notebook widget to contain several panels, each is built
+        # when first selected
+        self.notebook = ttk.Notebook(self)
+        self.notebook.grid(row=0, column=0, sticky='nswe')
+        for text, _, _ in TABS:
+            holder = ttk.Frame(self.notebook)
+            holder.rowconfigure(0, weight=1)
+            holder.columnconfigure(0, weight=1)
+            self.notebook.add(holder, text=text, sticky='nswe')
+        self.notebook.bind('<<NotebookTabChanged>>', self.tab_changed)
+
+    def tab_changed(self, event=None):
+        holder = self.nametowidget(self.notebook.select())
+        if holder in self.tabs:
+            return
+        _, module_name, class_name = TABS[self.notebook.index(holder)]
+        frame_class = getattr(importlib.import_module(module_name), class_name)
+        frame = frame_class(holder)
+        frame.grid(row=0, column=0, sticky='nswe')
+        self.tabs[holder] = frame
 
     def report_callback_exception(self, exc, val, tb):
-        self.logger.exception(val)
+        self.logger.error(val, exc_info=(exc, val, tb))
         err_msg = traceback.format_exception(exc, val, tb)
         err_msg = ''.join(err_msg)
         messagebox.showerror('Internal Error', err_msg)
 
 
 if __name__ == '__main__':
-    from ctypes import windll
-    windll.shcore.SetProcessDpiAwareness(1)
+    enable_dpi_awareness()
 
     root = tk.Tk()
     root.title('tx.in manager')
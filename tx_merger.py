@@ -1,6 +1,4 @@
-import logging
 import os
-import re
 import tkinter as tk
 from tkinter import ttk
 from tkinter import filedialog
@@ -8,13 +6,25 @@ from tkinter import messagebox
 import traceback
 
 from __init__ import ROOT_DIR
+from core.merger import TxMergerCore
+from util.custom_widgets import JobPanel, enable_dpi_awareness
+from util.dedup import parse_dedup
+from util.job_runner import JobRunner
+from util.log import get_logger
+from util.merge_manifest import MergeManifest
+from util.qc import QCError
+from util.txin_catalog import TxinCatalog, describe, parse_filter
 
 
 class TxMerger(ttk.Frame):
     """Merge tx.in(s) from several OBS(s) into one tx.in file"""
     def __init__(self, master=None):
         super().__init__(master)
-        self.logger = self._get_logger()
+        self.logger = get_logger('TxMerger', 'tx_merger.log')
+        self.catalog = TxinCatalog(os.path.join(ROOT_DIR, 'cache', 'txin_catalog.json'))
+        # `TxinInfo` of the tx.in(s) in search path
+        self.txin_infos = []
+        self._reread_meta = False
         self.init_variables()
         # self.set_custom_style()
         self.create_widgets()
@@ -26,9 +36,17 @@ class TxMerger(ttk.Frame):
         self.filter_str = tk.StringVar()
         self.ray_number = tk.IntVar()
         self.enable_ray_number = tk.IntVar()
+        self.incremental = tk.IntVar()
+        self.workers = tk.IntVar()
+        self.dedup_method = tk.StringVar()
+        self.dedup_tolerance = tk.DoubleVar()
         self.save_path = tk.StringVar()
+        self.txin_info = tk.StringVar()
         self.search_path.set(os.path.join(ROOT_DIR, 'tx_in'))
         self.enable_ray_number.set(1)
+        self.workers.set(1)
+        self.dedup_method.set('keep')
+        self.dedup_tolerance.set(0.0)
         self.save_path.set(os.path.join(self.search_path.get(), 'undefined_tx.in'))
 
     def set_custom_style(self):
@@ -85,6 +103,9 @@ class TxMerger(ttk.Frame):
         y_scroll1.grid(row=0, column=1, sticky='ns')
         self.left_box['yscrollcommand'] = y_scroll1.set
         self.left_box.grid(row=0, column=0, sticky='nswe')
+        self.left_box.bind('<<ListboxSelect>>', self.show_txin_info)
+        ttk.Label(left_part, textvariable=self.txin_info, wraplength=360)\
+            .grid(row=1, column=0, columnspan=2, sticky='nsw')
 
         # right listbox: selected tx.in(s)
         ttk.Label(row1, text='Selected tx.in(s): ')\
@@ -124,6 +145,21 @@ class TxMerger(ttk.Frame):
         self.ray_number_label.grid(row=1, column=0, sticky='nsw')
         self.ray_number_box = tk.Spinbox(row2_1, state='readonly', from_=1, to=1e3, increment=1, width=4, textvariable=self.ray_number)
         self.ray_number_box.grid(row=1, column=1, sticky='nsw')
+        ttk.Label(row2_1, text='Worker processes for merging: ').grid(row=2, column=0, sticky='nsw')
+        tk.Spinbox(
+            row2_1, state='readonly', from_=1, to=max(os.cpu_count() or 1, 1), increment=1, width=4,
+            textvariable=self.workers,
+            ).grid(row=2, column=1, sticky='nsw')
+        ttk.Label(row2_1, text='Duplicate picks of the tx.in(s): ').grid(row=3, column=0, sticky='nsw')
+        dedup_area = ttk.Frame(row2_1)
+        dedup_area.grid(row=3, column=1, sticky='nsw')
+        ttk.Combobox(
+            dedup_area, state='readonly', width=8, values=('keep', 'drop', 'average'),
+            textvariable=self.dedup_method,
+            ).grid(row=0, column=0, sticky='nsw')
+        ttk.Label(dedup_area, text=' within (km): ').grid(row=0, column=1, sticky='nsw')
+        ttk.Entry(dedup_area, width=8, textvariable=self.dedup_tolerance)\
+            .grid(row=0, column=2, sticky='nsw')
 
         # set path for target tx.in file
         row2_2 = ttk.Frame(row2)
@@ -135,26 +171,26 @@ class TxMerger(ttk.Frame):
         entry.bind('<Return>', self.handle_ok)
         ttk.Button(row2_2, text='Select', command=self.select_save_path)\
             .grid(row=0, column=2, sticky='nse')
+        ttk.Checkbutton(
+            row2_2, text='Incremental: reuse tx.in(s) unchanged since the last merge to this file '
+                         '(keeps a <tx.in>.merge.json manifest).',
+            variable=self.incremental,
+            ).grid(row=1, column=0, columnspan=3, sticky='nsw')
 
         # command buttons
         row_cmd = ttk.Frame(self)
         row_cmd.rowconfigure(0, weight=1)
         row_cmd.columnconfigure(0, weight=1)
         row_cmd.grid(column=0, padx=PADX_LG, pady=PADY_LLG_E, sticky='nswe')
-        ttk.Button(row_cmd, text='OK', command=self.handle_ok).grid(row=0, column=0)
+        self.btn_ok = ttk.Button(row_cmd, text='OK', command=self.handle_ok)
+        self.btn_ok.grid(row=0, column=0)
+        self.job_panel = JobPanel(row_cmd, on_cancel=self.cancel_job)
+        self.job_panel.grid(row=1, column=0, pady=PADY_LG, sticky='we')
+        self.job_runner = JobRunner(self, self.job_panel.set_progress)
+        # reads metadata of tx.in(s) for the list, apart from merging
+        self.meta_runner = JobRunner(self, self._meta_progress)
 
 
-    def _get_logger(self):
-        logger = logging.getLogger('TxMerger')
-        logger.setLevel(logging.DEBUG)
-        LOG_FILE_PATH = os.path.join(ROOT_DIR, 'log', 'tx_merger.log')
-        file_handler = logging.FileHandler(LOG_FILE_PATH, encoding='utf8')
-        file_handler.setLevel(logging.DEBUG)
-        formatter = logging.Formatter('[%(asctime)s] %(name)s %(levelname)s: %(message)s')
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-        return logger
-
     def change_search_path(self):
         p = filedialog.askdirectory(
             initialdir=self.search_path.get(),
@@ -166,12 +202,85 @@ class TxMerger(ttk.Frame):
             self.load_all_txins()
 
     def _get_all_txins(self):
-        search_path = self.search_path.get()
-        return [s for s in os.listdir(search_path) if 'tx' in s and s.endswith('.in')]
+        try:
+            return self.catalog.scan(self.search_path.get())
+        except OSError as e:
+            self.logger.warning('Failed listing tx.in(s): %s', e)
+            return []
 
     def load_all_txins(self):
-        self.left_box.delete(0, self.left_box.size())
-        self.left_box.insert(tk.END, *self._get_all_txins())
+        """Scan search path again, then show tx.in(s) passing the filter"""
+        self.txin_infos = self._get_all_txins()
+        self.show_txins()
+        self._read_meta()
+
+    def show_txins(self):
+        """Filter tx.in(s) in memory, then fill the list at once"""
+        try:
+            match = parse_filter(self.filter_str.get())
+        except ValueError as e:
+            self.txin_info.set(str(e))
+            return
+        names = [info.name for info in self.txin_infos if match(info)]
+        self.left_box.delete(0, tk.END)
+        self.left_box.insert(tk.END, *names)
+        self.txin_info.set('%d of %d tx.in(s)' %(len(names), len(self.txin_infos)))
+
+    def show_txin_info(self, event=None):
+        selected = self.left_box.curselection()
+        if not selected:
+            return
+        name = self.left_box.get(selected[-1])
+        for info in self.txin_infos:
+            if info.name == name:
+                self.txin_info.set('%s: %s' %(name, describe(info.meta)))
+                return
+
+    def _read_meta(self):
+        """Read metadata of tx.in(s) not in the catalog, in background"""
+        if self.meta_runner.busy:
+            # reading for the previous list, start over when it stops
+            self._reread_meta = True
+            self.meta_runner.cancel()
+            return
+        infos = self.txin_infos
+        if all(info.meta is not None for info in infos):
+            return
+        self.meta_runner.start(
+            lambda progress: self.catalog.read_missing(infos, progress),
+            on_done=self._meta_done, on_error=self._meta_failed,
+            on_cancelled=self._meta_cancelled)
+
+    def _meta_progress(self, fraction, message):
+        if message:
+            self.txin_info.set(message)
+
+    def _meta_done(self, infos):
+        self.catalog.save()
+        read = dict((info.path, info) for info in infos)
+        self.txin_infos = [
+            read[info.path] if info.path in read and read[info.path].stamp == info.stamp else info
+            for info in self.txin_infos]
+        if self._reread_meta:
+            self._reread_meta = False
+            self._read_meta()
+        # keep selection unless the filter depends on metadata
+        if any(c in self.filter_str.get() for c in '=<>'):
+            self.show_txins()
+        else:
+            self.txin_info.set('%d of %d tx.in(s)' %(self.left_box.size(), len(self.txin_infos)))
+
+    def _meta_cancelled(self):
+        # metadata read so far is in the catalog
+        self.catalog.save()
+        self.txin_infos = self._get_all_txins()
+        if self._reread_meta:
+            self._reread_meta = False
+            self._read_meta()
+
+    def _meta_failed(self, exc, val, tb):
+        self.logger.error(val, exc_info=(exc, val, tb))
+        self.txin_info.set('Failed reading tx.in(s). Please read log for details.')
 
     def filter_txin(self, event=None):
         filter_str = self.filter_str.get()
@@ -185,12 +294,7 @@ class TxMerger(ttk.Frame):
             lst = lst[:MAX_HISTORY]
             self.combo_filter.config(values=tuple(lst))
 
-        # filter tx.in(s)
-        self.load_all_txins()
-        for i in reversed(range(self.left_box.size())):
-            file_name = self.left_box.get(i)
-            if filter_str not in file_name:
-                self.left_box.delete(i)
+        self.show_txins()
 
     def add_txins(self):
         """add tx.in(s) from left listbox to right listbox"""
@@ -225,80 +329,96 @@ class TxMerger(ttk.Frame):
             self.save_path.set(os.path.normpath(p))
 
     def _start_merge(self):
-        ok = True
         dest_path = self.save_path.get()
         if os.path.isfile(dest_path):
-            ok = messagebox.askquestion(
+            answer = messagebox.askquestion(
                 title='Confirm Save As',
                 message='%s already exists.\nDo you want to replace it?' %os.path.split(dest_path)[1],
                 icon=messagebox.WARNING,
                 parent=self)
-        if not ok:
-            return
+            if answer != messagebox.YES:
+                return
         src_paths = [os.path.join(self.search_path.get(), s) for s in self.right_box.get(0, self.right_box.size())]
         ray_number = self.ray_number.get() if self.enable_ray_number.get() else None
-        self.tx_merger.run(src_paths, dest_path, ray_number)
+        incremental, workers = bool(self.incremental.get()), self.workers.get()
+        dedup = None
+        if self.dedup_method.get() != 'keep':
+            try:
+                dedup = parse_dedup('%s:%s' %(self.dedup_method.get(), self.dedup_tolerance.get()))
+            except (ValueError, tk.TclError):
+                messagebox.showerror('Error', 'Invalid tolerance of duplicate picks', parent=self)
+                return
+
+        # the first incremental merge to a file starts its manifest
+        new_manifest = incremental and dedup is None and MergeManifest.load(dest_path) is None
+
+        def job(progress):
+            self.tx_merger.run(
+                src_paths, dest_path, ray_number, incremental, workers, progress=progress,
+                dedup=dedup)
+            return MergeManifest.manifest_path(dest_path) if new_manifest else None
+
+        self.btn_ok.config(state=tk.DISABLED)
+        self.job_panel.start()
+        self.job_runner.start(
+            job, on_done=self._job_done, on_error=self._job_failed,
+            on_cancelled=self._job_cancelled)
 
     def handle_ok(self, event=None):
+        if self.job_runner.busy:
+            return
         if self.right_box.size() == 0:
             messagebox.showerror('Error', 'You hasn\'t select any tx.in(s)')
             return
-        try:
-            self._start_merge()
-        except Exception as e:
-            self.logger.exception(e)
-            messagebox.showerror('Error', 'Failed merging tx.in(s).\nPlease read log for detailed error message.')
-        else:
-            messagebox.showinfo('Info', 'Merge complete.')
+        self._start_merge()
 
-    def report_callback_exception(self, exc, val, tb):
-        self.logger.exception(val)
-        err_msg = traceback.format_exception(exc, val, tb)
-        err_msg = ''.join(err_msg)
-        messagebox.showerror('Internal Error', err_msg)
+    def cancel_job(self):
+        self.job_runner.cancel()
+        self.job_panel.set_progress(message='Cancelling...')
 
+    def _job_finished(self, message):
+        self.btn_ok.config(state=tk.NORMAL)
+        self.job_panel.stop(message)
 
-class TxMergerCore(object):
-    """Merge tx.in(s) from several OBS(s) into one tx.in file"""
+    def _job_done(self, result):
+        self._job_finished('Merge complete.')
+        # the merged tx.in may be in search path
+        self.load_all_txins()
+        message = 'Merge complete.'
+        if result:
+            message += (
+                '\nNo manifest of a previous merge to this file, all tx.in(s) were merged.'
+                '\nThe manifest %s is written for the next incremental merge.'
+                %os.path.basename(result))
+        messagebox.showinfo('Info', message)
+
+    def _job_failed(self, exc, val, tb):
+        self._job_finished('Failed.')
+        if isinstance(val, QCError):
+            self.logger.error(val)
+            messagebox.showerror('QC Failed', str(val))
+            return
+        self.logger.error(val, exc_info=(exc, val, tb))
+        messagebox.showerror('Error', 'Failed merging tx.in(s).\nPlease read log for detailed error message.')
 
-    TX_ENDING_LINE = '%10.3f%10.3f%10.3f%10d\n' %(0,0,0,-1)
-
-    def __init__(self):
-        super().__init__()
-
-    def run(self, src_paths, target_path, ray_number=None):
-        with open(target_path, 'w') as fw:
-            for file in src_paths:
-                string = ''
-                with open(file, 'r') as fr:
-                    string = fr.read()
-                if not string.strip():
-                    raise ValueError('Empty tx.in file: %s' %file)
-                string = self.remove_tx_ending_line(string)
-                if ray_number is not None:
-                    if not isinstance(ray_number, int):
-                        raise ValueError('Invalid ray_number: %r' %ray_number)
-                    string = self.reset_ray_number(string, ray_number)
-                fw.write(string)
-            fw.write(self.TX_ENDING_LINE)
-
-    def remove_tx_ending_line(self, string):
-        string = string.rstrip()
-        if not string.endswith('-1'):
-            return string + '\n'
-        idx = string.rfind('\n')
-        if idx == -1:
-            raise ValueError('Invalid tx.in format')
-        return string[:idx+1]
-
-    def reset_ray_number(self, string, ray_number):
-        return re.sub('\s+[1-9]\d*\n', '%10d\n'%ray_number, string)
+    def _job_cancelled(self):
+        self._job_finished('Cancelled.')
 
+    def destroy(self):
+        self.job_runner.shutdown()
+        self.meta_runner.shutdown()
+        self.catalog.save()
+        super().destroy()
+
+    def report_callback_exception(self, exc, val, tb):
+        self.logger.error(val, exc_info=(exc, val, tb))
+        err_msg = traceback.format_exception(exc, val, tb)
+        err_msg = ''.join(err_msg)
+        messagebox.showerror('Internal Error', err_msg)
 
 
 if __name__ == '__main__':
-    from ctypes import windll
-    windll.shcore.SetProcessDpiAwareness(1)
+    enable_dpi_awareness()
 
     root = tk.Tk()
     root.title('tx.in merger')
@@ -0,0 +1,230 @@
+"""Watch mode: rebuild tx.in(s) when horizon exports or survey tables change.
+
+    py tx_watch.py --merge tx_in/all_tx.in --merge-ray-number 2
+    py tx_cli.py watch --once
+
+The horizon directory and the directories of the survey tables are
+polled with `os.scandir`, which costs one stat per file and works on
+network drives too. Changes are batched until none is seen for
+`--debounce` seconds, so a horizon still being exported is not read
+half-written. Then only the tx.in(s) whose
+horizon or survey changed are rebuilt, pairing horizons and surveys as
+`tx_batch.py --horizons` does. With `--merge`, the merged tx.in is then
+refreshed incrementally, copying the unchanged tx.in(s) as raw bytes.
+
+On start, tx.in(s) older than their horizon or survey are rebuilt. With
+`--once`, the exit code is 1 if a tx.in or the merge failed.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from __init__ import ROOT_DIR
+import tx_batch
+from util.log import get_logger
+from util import perf
+
+
+DEFAULT_HORIZON_DIR = os.path.join(ROOT_DIR, 'horizon')
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class DirectoryPoller(object):
+    """Changed files of directories, by polling their stats"""
+
+    def __init__(self, dirs):
+        self.dirs = dirs
+        self._stats = self._scan()
+
+    def _scan(self):
+        stats = {}
+        for d in self.dirs:
+            try:
+                with os.scandir(d) as entries:
+                    for entry in entries:
+                        if entry.is_file():
+                            st = entry.stat()
+                            stats[entry.path] = (st.st_mtime_ns, st.st_size)
+            except FileNotFoundError:
+                pass
+        return stats
+
+    def changes(self):
+        """Paths added, modified or removed since the last call"""
+        stats = self._scan()
+        changed = set(p for p, s in stats.items() if self._stats.get(p) != s)
+        changed.update(set(self._stats) - set(stats))
+        self._stats = stats
+        return changed
+
+    def batches(self, interval=1.0, debounce=2.0):
+        """Yield sets of changed paths, once no change is seen for `debounce` seconds"""
+        pending, last_change = set(), None
+        while True:
+            time.sleep(interval)
+            changed = self.changes()
+            if changed:
+                pending |= changed
+                last_change = time.monotonic()
+            elif pending and time.monotonic() - last_change >= debounce:
+                yield pending
+                pending = set()
+
+
+class TxWatch(object):
+    """Keep tx.in(s), and optionally their merge, up to date with horizons and surveys"""
+
+    def __init__(self, horizon_dir=DEFAULT_HORIZON_DIR, pattern='*.csv', surveys=None,
+                 precision=None, ray_number=None, save_dir=tx_batch.DEFAULT_SAVE_DIR,
+                 merge_path=None, merge_ray_number=None, jobs=1):
+        self.horizon_dir = horizon_dir
+        self.pattern = pattern
+        self.surveys = surveys
+        self.precision = precision
+        self.ray_number = ray_number
+        self.save_dir = save_dir
+        self.merge_path = merge_path
+        self.merge_ray_number = merge_ray_number
+        self.jobs = jobs
+        self.logger = get_logger('TxWatch', 'tx_watch.log')
+        # save path: (horizon stamp, survey stamp) of its last build
+        self._built = {}
+        self._merged_sources = None
+        # whether the merge of the last sync failed
+        self.merge_failed = False
+
+    def plan(self):
+        """(jobs, unmatched horizons) for the horizons and surveys as they are now"""
+        return tx_batch.jobs_from_glob(
+            os.path.join(self.horizon_dir, self.pattern),
+            tx_batch.list_survey_paths(self.surveys), self.precision, self.ray_number,
+            self.save_dir)
+
+    def outdated(self, job):
+        inputs = (_stamp(job.horizon_path), _stamp(job.survey_path))
+        built = self._built.get(job.save_path)
+        if built is not None:
+            return built != inputs
+        # not built by this watch: compare modification times, like make
+        target = _stamp(job.save_path)
+        return target is None or any(s is not None and s[0] > target[0] for s in inputs)
+
+    def watched_dirs(self):
+        """The horizon directory and those of the survey tables"""
+        dirs = [self.horizon_dir]
+        for path in tx_batch.list_survey_paths(self.surveys):
+            d = os.path.dirname(os.path.abspath(path))
+            if not any(os.path.abspath(w) == d for w in dirs):
+                dirs.append(d)
+        return dirs
+
+    def sync(self):
+        """Rebuild outdated tx.in(s), then refresh the merge. Returns the
+        results, `merge_failed` tells if the merge failed.
+        """
+        self.merge_failed = False
+        jobs, unmatched = self.plan()
+        for p in unmatched:
+            self.logger.warning('No matching survey for horizon: %s', p)
+        todo = [job for job in jobs if self.outdated(job)]
+        stamps = dict(
+            (job.save_path, (_stamp(job.horizon_path), _stamp(job.survey_path))) for job in todo)
+        results = []
+        if todo:
+            os.makedirs(self.save_dir, exist_ok=True)
+            results = tx_batch.run_batch(todo, self.jobs, self._report)
+        for result in results:
+            if result.ok:
+                self._built[result.job.save_path] = stamps[result.job.save_path]
+        sources = [job.save_path for job in jobs if os.path.isfile(job.save_path)]
+        if self.merge_path and sources and (
+                any(r.ok for r in results) or sources != self._merged_sources):
+            self._merge(sources)
+        return results
+
+    def _report(self, result):
+        job = result.job
+        if result.ok:
+            print('[ OK ] %s -> %s (%.2fs)' %(
+                os.path.basename(job.horizon_path), job.save_path, result.elapsed))
+        else:
+            print('[FAIL] %s: %s' %(os.path.basename(job.horizon_path), result.error))
+            self.logger.error('Job failed: %r\n%s', job, result.detail)
+
+    def _merge(self, sources):
+        # imported here, the merger is not needed if nothing is merged
+        from core.merger import merge_tx
+        start = time.perf_counter()
+        try:
+            reused = merge_tx(
+                sources, self.merge_path, self.merge_ray_number, incremental=True)
+        except (OSError, ValueError) as e:
+            print('[FAIL] merge %s: %s' %(self.merge_path, e))
+            self.logger.exception(e)
+            self.merge_failed = True
+            return
+        self._merged_sources = sources
+        print('[MERGE] %s: %d tx.in(s), %d unchanged (%.2fs)' %(
+            self.merge_path, len(sources), reused, time.perf_counter() - start))
+
+    def watch(self, interval=1.0, debounce=2.0):
+        dirs = self.watched_dirs()
+        poller = DirectoryPoller(dirs)
+        self.sync()
+        print('Watching %s ...' %', '.join(dirs))
+        for changed in poller.batches(interval, debounce):
+            self.logger.info('Changed: %s', sorted(changed))
+            self.sync()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Rebuild tx.in(s) when horizon exports or survey tables change.')
+    parser.add_argument(
+        '--horizon-dir', default=DEFAULT_HORIZON_DIR, help='directory of horizon exports')
+    parser.add_argument('--pattern', default='*.csv', help='horizon file names (default: *.csv)')
+    parser.add_argument(
+        '-s', '--surveys', nargs='+',
+        help='survey tables to pair with horizons (default: all in trace_number_vs_x)')
+    parser.add_argument('-p', '--precision', type=float, help='horizon time precision')
+    parser.add_argument('-r', '--ray-number', type=int, help='ray group number')
+    parser.add_argument(
+        '-o', '--save-dir', default=tx_batch.DEFAULT_SAVE_DIR, help='directory for tx.in(s)')
+    parser.add_argument('-m', '--merge', help='also keep this merged tx.in up to date')
+    parser.add_argument(
+        '--merge-ray-number', type=int, help='reset ray group of picks in the merged tx.in')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between polls')
+    parser.add_argument(
+        '--debounce', type=float, default=2.0,
+        help='seconds without change before rebuilding')
+    parser.add_argument('--once', action='store_true', help='sync once and exit, with 1 if a tx.in or the merge failed')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    tx_watch = TxWatch(
+        args.horizon_dir, args.pattern, args.surveys, args.precision, args.ray_number,
+        args.save_dir, args.merge, args.merge_ray_number, args.jobs)
+    if args.once:
+        results = tx_watch.sync()
+        return 0 if all(r.ok for r in results) and not tx_watch.merge_failed else 1
+    try:
+        tx_watch.watch(args.interval, args.debounce)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(perf.run_profiled(main))
@@ -0,0 +1,134 @@
+"""Fast reader for delimited numeric text, e.g. horizons exported from Kingdom.
+
+`np.genfromtxt` tokenizes every field in Python, which makes it the slowest
+step for horizons with millions of rows. Here the file is read in large
+blocks of complete lines and each block is parsed in bulk by the C parsers
+of numpy (`np.loadtxt`, or `np.fromstring` on old numpy). Blocks that can not
+be parsed in bulk (e.g. with empty cells) fall back to `np.genfromtxt`, so
+the result is the same as before for irregular files. `iter_columns`
+yields the parsed blocks one at a time, for files larger than memory.
+"""
+
+import io
+import warnings
+
+import numpy as np
+
+
+CHUNK_SIZE = 1 << 24
+# np.loadtxt is implemented in C since numpy 1.23, older versions parse with
+# np.fromstring instead
+_C_LOADTXT = np.lib.NumpyVersion(np.__version__) >= '1.23.0'
+
+
+def _is_data_line(line, delimiter):
+    field = line.split(delimiter, 1)[0].strip()
+    if not field:
+        return False
+    try:
+        float(field)
+    except ValueError:
+        return False
+    return True
+
+
+def _count_lines(block):
+    """Number of non-empty lines in a block"""
+    buf = np.frombuffer(block, dtype=np.uint8)
+    newlines = np.flatnonzero(buf == ord('\n'))
+    bounds = np.concatenate([[-1], newlines, [buf.size]])
+    return int(np.count_nonzero(np.diff(bounds) > 1))
+
+
+def _parse_regular_block(block, delimiter, nrows, ncols, usecols):
+    """Parse a block with `nrows` complete lines in bulk. None if irregular."""
+    if block.count(delimiter) != nrows * (ncols - 1):
+        return None
+    if _C_LOADTXT:
+        try:
+            values = np.loadtxt(
+                io.BytesIO(block), delimiter=delimiter.decode(), usecols=usecols,
+                ndmin=2, dtype=np.float64)
+        except ValueError:
+            return None
+        return values if values.shape[0] == nrows else None
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            values = np.fromstring(block.replace(delimiter, b' '), sep=' ')
+        except (ValueError, DeprecationWarning):
+            return None
+    if values.size != nrows * ncols:
+        return None
+    values = values.reshape(nrows, ncols)
+    return values if usecols is None else values[:, usecols]
+
+
+def _parse_block(block, delimiter, ncols, usecols):
+    block = block.replace(b'\r', b'')
+    nrows = _count_lines(block)
+    ncols_out = ncols if usecols is None else len(usecols)
+    if nrows == 0:
+        return np.empty((0, ncols_out))
+    values = _parse_regular_block(block, delimiter, nrows, ncols, usecols)
+    if values is not None:
+        return values
+    # irregular block, e.g. with empty cells, let genfromtxt deal with it
+    values = np.genfromtxt(
+        io.BytesIO(block), delimiter=delimiter.decode(), usecols=usecols, dtype=np.float64)
+    return values.reshape(-1, ncols_out)
+
+
+def iter_columns(path, usecols=None, delimiter=',', skip_header=0, chunk_size=CHUNK_SIZE):
+    """Yield numeric columns of a delimited text file as 2d float64 arrays,
+    one per block of about `chunk_size` bytes of complete lines.
+
+    Lines are skipped as by `load_columns`. Memory is bounded by the block
+    size, whatever the size of the file.
+    """
+    delimiter = delimiter.encode()
+    if usecols is not None:
+        usecols = list(usecols)
+    with open(path, 'rb') as f:
+        for _ in range(skip_header):
+            f.readline()
+        # skip blank lines and column titles before data
+        while True:
+            pos = f.tell()
+            line = f.readline()
+            if not line or _is_data_line(line, delimiter):
+                break
+        if not line:
+            return
+        ncols = line.count(delimiter) + 1
+        f.seek(pos)
+
+        rest = b''
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            data = rest + data
+            idx = data.rfind(b'\n')
+            if idx == -1:
+                rest = data
+                continue
+            rest = data[idx+1:]
+            yield _parse_block(data[:idx+1], delimiter, ncols, usecols)
+        if rest.strip():
+            yield _parse_block(rest, delimiter, ncols, usecols)
+
+
+def load_columns(path, usecols=None, delimiter=',', skip_header=0, chunk_size=CHUNK_SIZE):
+    """Load numeric columns of a delimited text file into a 2d float64 array.
+
+    The first `skip_header` lines are skipped, as well as blank lines and
+    non-numeric header lines before the first data line.
+    """
+    chunks = list(iter_columns(path, usecols, delimiter, skip_header, chunk_size))
+    if not chunks:
+        # no data line
+        return np.empty((0, 0 if usecols is None else len(usecols)))
+    if len(chunks) == 1:
+        return np.ascontiguousarray(chunks[0])
+    return np.concatenate(chunks)
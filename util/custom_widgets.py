@@ -1,53 +1,185 @@
+import sys
 import tkinter as tk
 from tkinter import ttk
+from tkinter import font as tkfont
 
 
-class TextLineNumbers(tk.Canvas):
-    def __init__(self, *args, **kwargs):
-        tk.Canvas.__init__(self, *args, **kwargs)
-        self.textwidget = None
+def enable_dpi_awareness():
+    """Render sharp on high-DPI displays of Windows. Does nothing elsewhere."""
+    if sys.platform != 'win32':
+        return
+    try:
+        from ctypes import windll
+        windll.shcore.SetProcessDpiAwareness(1)
+    except (ImportError, AttributeError, OSError):
+        # shcore is missing before Windows 8.1
+        pass
 
-    def attach(self, text_widget):
-        self.textwidget = text_widget
+
+class FilePreviewer(ttk.Frame):
+    """Read-only, scrollable view of a text file of any size.
+
+    Only the lines in view are read from disk, located with a `LineIndex`,
+    so the whole of a file of millions of lines can be scrolled through.
+    Scroll events only move the first line in view; the text and line
+    numbers are redrawn once for a burst of them.
+    """
+    REDRAW_MS = 30
+    WHEEL_LINES = 3
+
+    def __init__(self, master=None, font=('Consolas', 10), **kwargs):
+        ttk.Frame.__init__(self, master, **kwargs)
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(1, weight=1)
+        self.line_index = None
+        self.first = 0
+        self._pending = None
+        self.font = tkfont.Font(font=font)
+
+        self.line_numbers = tk.Canvas(self, width=30, highlightthickness=0)
+        self.line_numbers.grid(row=0, column=0, sticky='nsw')
+        self.text = tk.Text(self, font=self.font, wrap=tk.NONE, state=tk.DISABLED)
+        self.text.grid(row=0, column=1, sticky='nswe')
+        self.y_scroll = tk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+        self.y_scroll.grid(row=0, column=2, sticky='ns')
+
+        self.text.bind('<Configure>', self.schedule_redraw)
+        for seq in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.text.bind(seq, self._on_wheel)
+            self.line_numbers.bind(seq, self._on_wheel)
+        for seq, args in (
+                ('<Up>', (-1, 'units')), ('<Down>', (1, 'units')),
+                ('<Prior>', (-1, 'pages')), ('<Next>', (1, 'pages'))):
+            self.text.bind(seq, lambda e, args=args: self._scroll(*args))
+        self.text.bind('<Home>', lambda e: self._scroll_to(0))
+        self.text.bind('<End>', lambda e: self._scroll_to(len(self)))
+        # a file edited meanwhile is read again when shown, e.g. on tab
+        # change, or when the window gets the focus back
+        self.bind('<Map>', self.refresh)
+        self.winfo_toplevel().bind('<FocusIn>', self.refresh, add='+')
+
+    def __len__(self):
+        return len(self.line_index) if self.line_index is not None else 0
+
+    def set_file(self, path):
+        """Show a file, from its first line. None clears the view."""
+        self.line_index = self._index(path) if path else None
+        self.first = 0
+        self.redraw()
+
+    def refresh(self, event=None):
+        """Re-index the file if it changed on disk, keeping the position"""
+        if self.line_index is None or not self.winfo_exists():
+            return
+        try:
+            outdated = self.line_index.outdated
+        except OSError:
+            # removed or moved away
+            self.set_file(None)
+            return
+        if outdated:
+            first = self.first
+            self.line_index = self._index(self.line_index.path)
+            self._scroll_to(first)
+
+    @staticmethod
+    def _index(path):
+        # numpy is imported on first use, not at start-up
+        from util.line_index import LineIndex
+        return LineIndex(path)
+
+    @property
+    def page_rows(self):
+        return max(1, self.text.winfo_height() // self.font.metrics('linespace'))
+
+    def yview(self, *args):
+        """Scrollbar command: ('moveto', fraction) or ('scroll', n, 'units'|'pages')"""
+        if not args:
+            return self._fractions()
+        if args[0] == 'moveto':
+            self._scroll_to(int(round(float(args[1]) * len(self))))
+        elif args[0] == 'scroll':
+            self._scroll(int(args[1]), args[2])
+
+    def _scroll(self, n, what='units'):
+        self._scroll_to(self.first + n * (self.page_rows if what == 'pages' else 1))
+        return 'break'
+
+    def _scroll_to(self, first):
+        self.first = max(0, min(first, len(self) - self.page_rows))
+        self.y_scroll.set(*self._fractions())
+        self.schedule_redraw()
+        return 'break'
+
+    def _on_wheel(self, event):
+        if event.num == 4:
+            lines = -self.WHEEL_LINES
+        elif event.num == 5:
+            lines = self.WHEEL_LINES
+        else:
+            lines = -self.WHEEL_LINES * (event.delta // 120 or (1 if event.delta > 0 else -1))
+        return self._scroll(lines)
+
+    def _fractions(self):
+        n = len(self)
+        if n == 0:
+            return 0.0, 1.0
+        return self.first / n, min(1.0, (self.first + self.page_rows) / n)
+
+    def schedule_redraw(self, *args):
+        if self._pending is None:
+            self._pending = self.after(self.REDRAW_MS, self.redraw)
 
     def redraw(self, *args):
-        '''redraw line numbers'''
-        self.delete("all")
-
-        i = self.textwidget.index("@0,0")
-        while True :
-            dline= self.textwidget.dlineinfo(i)
-            if dline is None: break
-            y = dline[1]
-            linenum = str(i).split(".")[0]
-            self.create_text(2,y,anchor="nw", text=linenum)
-            i = self.textwidget.index("%s+1line" % i)
-
-
-class CustomText(tk.Text):
-    def __init__(self, *args, **kwargs):
-        tk.Text.__init__(self, *args, **kwargs)
-
-        # create a proxy for the underlying widget
-        self._orig = self._w + "_orig"
-        self.tk.call("rename", self._w, self._orig)
-        self.tk.createcommand(self._w, self._proxy)
-
-    def _proxy(self, *args):
-        # let the actual widget perform the requested action
-        cmd = (self._orig,) + args
-        result = self.tk.call(cmd)
-
-        # generate an event if something was added or deleted,
-        # or the cursor position changed
-        if (args[0] in ("insert", "replace", "delete") or
-            args[0:3] == ("mark", "set", "insert") or
-            args[0:2] == ("xview", "moveto") or
-            args[0:2] == ("xview", "scroll") or
-            args[0:2] == ("yview", "moveto") or
-            args[0:2] == ("yview", "scroll")
-        ):
-            self.event_generate("<<Change>>", when="tail")
-
-        # return what the actual widget returned
-        return result
+        if self._pending is not None:
+            self.after_cancel(self._pending)
+            self._pending = None
+        rows = self.page_rows
+        self.first = max(0, min(self.first, len(self) - rows))
+        stop = min(len(self), self.first + rows)
+        text = self.line_index.read_lines(self.first, stop) if self.line_index else ''
+        self.text.config(state=tk.NORMAL)
+        self.text.delete('1.0', tk.END)
+        self.text.insert(tk.END, text.rstrip('\n'))
+        self.text.config(state=tk.DISABLED)
+        self.y_scroll.set(*self._fractions())
+        self._draw_line_numbers(stop)
+
+    def _draw_line_numbers(self, stop):
+        """Line numbers of rows in view; rows are one line each without wrapping"""
+        canvas = self.line_numbers
+        canvas.delete('all')
+        canvas.config(width=self.font.measure(str(max(stop, 1))) + 6)
+        linespace = self.font.metrics('linespace')
+        y0 = sum(self.text.winfo_pixels(str(self.text.cget(option)))
+                 for option in ('pady', 'borderwidth', 'highlightthickness'))
+        for row, number in enumerate(range(self.first + 1, stop + 1)):
+            canvas.create_text(2, y0 + row * linespace, anchor='nw', text=str(number), font=self.font)
+
+
+class JobPanel(ttk.Frame):
+    """Progress bar, status message and cancel button of a background job"""
+    def __init__(self, master=None, on_cancel=None, **kwargs):
+        ttk.Frame.__init__(self, master, **kwargs)
+        self.columnconfigure(0, weight=1)
+        self.message = tk.StringVar()
+        self.progressbar = ttk.Progressbar(self, mode='determinate', maximum=100)
+        self.progressbar.grid(row=0, column=0, sticky='we')
+        self.btn_cancel = ttk.Button(self, text='Cancel', state=tk.DISABLED, command=on_cancel)
+        self.btn_cancel.grid(row=0, column=1, padx=(5, 0), sticky='e')
+        ttk.Label(self, textvariable=self.message).grid(row=1, column=0, columnspan=2, sticky='w')
+
+    def start(self, message='Running...'):
+        self.progressbar['value'] = 0
+        self.btn_cancel.config(state=tk.NORMAL)
+        self.message.set(message)
+
+    def set_progress(self, fraction=None, message=None):
+        if fraction is not None:
+            self.progressbar['value'] = fraction * 100
+        if message:
+            self.message.set(message)
+
+    def stop(self, message=''):
+        self.btn_cancel.config(state=tk.DISABLED)
+        self.message.set(message)
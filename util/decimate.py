@@ -0,0 +1,192 @@
+"""Thin picks before writing tx.in, to control its size and rayinvr run time.
+
+Kingdom horizons have a pick per trace, many more than rayinvr needs. Picks
+are thinned segment by segment, a segment being a run of picks of one ray
+group on one side of the shot, so that nothing is mixed across ray groups
+or across the shot. Methods:
+
+    nth:<n>            keep every n-th pick, and the last of each segment
+    bin:<width>        average picks in x windows of `width` km, anchored at
+                       the shot. Uncertainty of a bin is the rms uncertainty
+                       of its picks, sqrt(mean(u**2)), plus the scatter of
+                       its times in quadrature. It is not divided by
+                       sqrt(n): picks of adjacent traces of one horizon have
+                       correlated errors, so averaging them does not make
+                       the bin more certain than a single pick
+    curvature:<tol>    keep the picks needed to follow the horizon within
+                       `tol` seconds by linear interpolation (Douglas-Peucker
+                       on time). Flat stretches are thinned, bends are kept
+
+`StreamDecimator` thins picks coming a block at a time, with the same result
+as thinning them all at once, for nth and bin.
+"""
+
+import numpy as np
+
+from util import txin
+
+
+METHODS = ('nth', 'bin', 'curvature')
+
+
+def parse_decimation(spec):
+    """(method, value) from "<method>:<value>", e.g. "bin:0.1". None for None or "none"."""
+    if spec is None or spec.strip().lower() in ('', 'none'):
+        return None
+    method, _, value = spec.partition(':')
+    method = method.strip().lower()
+    try:
+        value = int(value) if method == 'nth' else float(value)
+    except ValueError:
+        value = None
+    if method not in METHODS or value is None or value <= 0:
+        raise ValueError(
+            'Invalid decimation "%s". Expect one of nth:<n>, bin:<width>, curvature:<tol>' %spec)
+    return method, value
+
+
+def segment_bounds(picks, shot_loc=None):
+    """Start of every segment, and the number of picks at the end"""
+    code = picks['code']
+    change = code[1:] != code[:-1]
+    if shot_loc is not None:
+        side = picks['x'] >= shot_loc
+        change |= side[1:] != side[:-1]
+    return np.concatenate([[0], np.flatnonzero(change) + 1, [picks.shape[0]]])
+
+
+def every_nth(picks, n, shot_loc=None):
+    bounds = segment_bounds(picks, shot_loc)
+    counts = np.diff(bounds)
+    position = np.arange(picks.shape[0]) - np.repeat(bounds[:-1], counts)
+    keep = (position % n == 0) | (position == np.repeat(counts, counts) - 1)
+    return picks[keep]
+
+
+def bin_average(picks, width, shot_loc=None):
+    if not picks.size:
+        return picks
+    anchor = 0.0 if shot_loc is None else shot_loc
+    bin_id = np.floor((picks['x'] - anchor) / width)
+    bounds = segment_bounds(picks, shot_loc)
+    segment = np.repeat(np.arange(bounds.size - 1), np.diff(bounds))
+    # a bin is a run of picks of one segment in one x window
+    change = (bin_id[1:] != bin_id[:-1]) | (segment[1:] != segment[:-1])
+    return average_runs(picks, np.concatenate([[0], np.flatnonzero(change) + 1]))
+
+
+def average_runs(picks, starts):
+    """One pick per run of picks starting at `starts`, averaged as by `bin_average`"""
+    counts = np.diff(np.append(starts, picks.shape[0]))
+
+    def mean(values):
+        return np.add.reduceat(values, starts) / counts
+
+    res = txin.empty_records(starts.size)
+    res['x'] = mean(picks['x'])
+    res['t'] = mean(picks['t'])
+    scatter = np.maximum(mean(picks['t'] ** 2) - res['t'] ** 2, 0)
+    res['uncertainty'] = np.sqrt(mean(picks['uncertainty'] ** 2) + scatter)
+    res['code'] = picks['code'][starts]
+    return res
+
+
+def _follow(x, t, tol):
+    """Mask of picks needed to follow t(x) within tol by linear interpolation"""
+    n = x.size
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, n - 1]] = True
+    stack = [(0, n - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        if x[b] != x[a]:
+            line = t[a] + (t[b] - t[a]) * (x[a+1:b] - x[a]) / (x[b] - x[a])
+        else:
+            line = np.full(b - a - 1, t[a])
+        err = np.abs(t[a+1:b] - line)
+        i = int(np.argmax(err))
+        if err[i] > tol:
+            k = a + 1 + i
+            keep[k] = True
+            stack.append((a, k))
+            stack.append((k, b))
+    return keep
+
+
+def thin_by_curvature(picks, tol, shot_loc=None):
+    bounds = segment_bounds(picks, shot_loc)
+    keep = np.zeros(picks.shape[0], dtype=bool)
+    for start, stop in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        if stop > start:
+            keep[start:stop] = _follow(picks['x'][start:stop], picks['t'][start:stop], tol)
+    return picks[keep]
+
+
+def decimate(picks, decimation, shot_loc=None):
+    """Thin picks by a (method, value) of `parse_decimation`. None keeps all."""
+    if decimation is None:
+        return picks
+    method, value = decimation
+    if method == 'nth':
+        return every_nth(picks, value, shot_loc)
+    if method == 'bin':
+        return bin_average(picks, value, shot_loc)
+    if method == 'curvature':
+        return thin_by_curvature(picks, value, shot_loc)
+    raise ValueError('Invalid decimation method: %r' %(method,))
+
+
+class StreamDecimator(object):
+    """`decimate` of picks coming a block at a time, e.g. from a chunked
+    maker, with the same result as decimating all of them at once.
+
+    The picks that the next block may change are held back: the last pick
+    for nth, which may or may not end its segment, and the last bin for bin.
+    curvature needs whole segments, which may be as large as the horizon.
+    """
+
+    def __init__(self, decimation, shot_loc=None):
+        if decimation is not None and decimation[0] not in ('nth', 'bin'):
+            raise ValueError(
+                'Decimation "%s" needs all picks at once, '
+                'support only nth and bin on picks in blocks' %decimation[0])
+        self.decimation = decimation
+        self.shot_loc = shot_loc
+        self._held = txin.empty_records(0)
+        # nth: position of the held pick in its segment
+        self._position = 0
+
+    def feed(self, picks):
+        """Thinned picks of a block that are final"""
+        if self.decimation is None:
+            return picks
+        picks = np.concatenate([self._held, picks])
+        if not picks.size:
+            return picks
+        method, value = self.decimation
+        bounds = segment_bounds(picks, self.shot_loc)
+        if method == 'nth':
+            counts = np.diff(bounds)
+            local = np.arange(picks.shape[0]) - np.repeat(bounds[:-1], counts)
+            position = local.copy()
+            position[:bounds[1]] += self._position
+            keep = (position % value == 0) | (local == np.repeat(counts, counts) - 1)
+            self._held, self._position = picks[-1:], int(position[-1])
+            return picks[:-1][keep[:-1]]
+        anchor = 0.0 if self.shot_loc is None else self.shot_loc
+        bin_id = np.floor((picks['x'] - anchor) / value)
+        segment = np.repeat(np.arange(bounds.size - 1), np.diff(bounds))
+        change = np.flatnonzero((bin_id[1:] != bin_id[:-1]) | (segment[1:] != segment[:-1]))
+        cut = int(change[-1]) + 1 if change.size else 0
+        self._held = picks[cut:]
+        return bin_average(picks[:cut], value, self.shot_loc)
+
+    def flush(self):
+        """Thinned picks held back, once all blocks are fed"""
+        held, self._held, self._position = self._held, txin.empty_records(0), 0
+        if self.decimation is None or self.decimation[0] == 'nth':
+            # the last pick ends its segment
+            return held
+        return bin_average(held, self.decimation[1], self.shot_loc)
@@ -0,0 +1,178 @@
+"""Collapse duplicate picks of several tx.in(s) merged into one.
+
+Phases or re-picks of the same OBS merged together often pick the same
+arrival twice. Picks are grouped by shot location, side of the shot and ray
+group, and sorted by x within each group, by two stable sorts. A cluster is
+a run of neighbouring picks of a group from different sources, all within
+`tolerance` km of its first pick: a cluster ends where a source already in
+it shows up again, or x is further than that. Picks of one source never
+collapse with each other, so a tolerance below the pick spacing keeps
+clusters to the re-picks of one arrival, even where the x of two sources
+interleave. Methods:
+
+    drop:<tol>       keep the pick of the first source in each cluster
+    average:<tol>    average each cluster, see `util.decimate.average_runs`.
+                     Re-picks of one arrival have correlated errors, so
+                     the uncertainty is the rms of theirs plus the scatter
+                     of their times, not reduced by averaging
+
+`<tol>` defaults to 0, i.e. only picks at the same x. e.g. two sources
+picked every 0.01 km, shifted by 0.005 km, collapse pairwise:
+
+    >>> picks = [(11.0, 1, 0, 0), (11.0, 2, 0.02, 1), (11.01, 2, 0.02, 1),
+    ...          (11.02, 2, 0.02, 1), (11.0, 1, 0, 0), (11.005, 2, 0.02, 1),
+    ...          (11.015, 2, 0.02, 1)]
+    >>> records = txin.to_records(picks)
+    >>> sources = [0, 0, 0, 0, 1, 1, 1]
+    >>> dedup_records(records, sources, ('drop', 0.006))['x'].tolist()
+    [11.0, 11.0, 11.01, 11.02, 0.0]
+
+Shot blocks are then emitted again, ordered by shot location with the
+left side (-1) first, picks ordered by ray group and x. All steps are
+vectorized, see `benchmark/bench_dedup.py` for tens of millions of picks.
+"""
+
+import numpy as np
+
+from util import txin
+from util.decimate import average_runs
+
+
+METHODS = ('drop', 'average')
+
+
+def parse_dedup(spec):
+    """(method, tolerance) from "<method>[:<tol>]", e.g. "average:0.01".
+    None for None or "none".
+    """
+    if spec is None or spec.strip().lower() in ('', 'none'):
+        return None
+    method, _, value = spec.partition(':')
+    method = method.strip().lower()
+    try:
+        tolerance = float(value) if value.strip() else 0.0
+    except ValueError:
+        tolerance = None
+    if method not in METHODS or tolerance is None or tolerance < 0:
+        raise ValueError(
+            'Invalid deduplication "%s". Expect drop[:<tol>] or average[:<tol>]' %spec)
+    return method, tolerance
+
+
+def _split_chains(is_start, x, src, tolerance):
+    """Split chains of linked neighbours into clusters, in place.
+
+    A chain of two picks is one cluster. In longer chains, e.g. of sources
+    with interleaving x, a cluster starting at pick i ends at next(i), the
+    first pick of a source already in it or at an x further than
+    `tolerance` from x[i]. next(i) is found for all picks at once: the
+    first repeated source is a reverse running minimum of the next pick of
+    each source, and x is then compared a step at a time up to it, i.e. at
+    most once per source. Cluster starts are the picks reached from the
+    chain start by next(), marked by pointer doubling in log2(clusters per
+    chain) passes.
+    """
+    chain = np.cumsum(is_start) - 1
+    if not chain.size:
+        return
+    idx = np.flatnonzero(np.bincount(chain)[chain] > 2)
+    if not idx.size:
+        return
+    n = idx.size
+    x, src = x[idx], src[idx]
+    head = np.concatenate([[True], chain[idx[1:]] != chain[idx[:-1]]])
+    first = np.flatnonzero(head)
+    # local chain of each pick, and end of its chain
+    local = np.cumsum(head) - 1
+    end = np.append(first[1:], n)[local]
+
+    # next pick of the same source in the chain, else the chain end; the
+    # first repeated source from i on is the minimum of those from i on.
+    # Later chains only have larger ones.
+    key = src.astype(np.uint16) if src.max() < 1 << 16 else src
+    order = np.argsort(key, kind='stable')
+    same = (local[order[1:]] == local[order[:-1]]) & (src[order[1:]] == src[order[:-1]])
+    repeat = end.copy()
+    repeat[order[:-1][same]] = order[1:][same]
+    repeat = np.minimum.accumulate(repeat[::-1])[::-1]
+
+    # then the first pick further than tolerance, before that
+    stop = np.arange(1, n + 1)
+    active = np.flatnonzero(stop < repeat)
+    while active.size:
+        active = active[x[stop[active]] - x[active] <= tolerance]
+        stop[active] += 1
+        active = active[stop[active] < repeat[active]]
+
+    # n is past all chains and leads to itself
+    jump = np.append(stop, n)
+    jump[:-1][jump[:-1] == end] = n
+    reached = np.zeros(n + 1, dtype=bool)
+    reached[first] = True
+    while True:
+        # reached holds the picks at fewer than 2**k steps from a chain
+        # start, jump leads 2**k steps
+        step = jump[np.flatnonzero(reached)]
+        if reached[step].all():
+            break
+        reached[step] = True
+        jump = jump[jump]
+    is_start[idx[reached[:-1]]] = True
+
+
+def dedup_records(records, sources, dedup):
+    """Records of shot blocks with duplicate picks collapsed, and the ending.
+
+    `records` are shot headers and picks of all sources, without ending
+    records, and `sources` the index of the source of each record.
+    `dedup` is a (method, tolerance) of `parse_dedup`.
+    """
+    method, tolerance = dedup
+    code = records['code']
+    block = np.cumsum(code == 0) - 1
+    is_pick = code > 0
+    if np.any(is_pick & (block < 0)):
+        raise ValueError('Picks before the first shot header')
+    shots = records[code == 0]
+    # shot headers, each (location, side) once, in order of location, left first
+    header_keys, shot_id = np.unique(
+        np.column_stack([shots['x'], shots['t']]), axis=0, return_inverse=True)
+    shot_id = shot_id.ravel()
+
+    picks = records[is_pick]
+    src = np.asarray(sources)[is_pick]
+    # one integer per (shot location, side, ray group)
+    n_codes = int(picks['code'].max()) + 1 if picks.size else 1
+    group = shot_id[block[is_pick]].astype(np.int64) * n_codes + picks['code']
+    # stable sorts by x, then by group: the first source comes first among
+    # equal x. Group ids fitting 16 bits are radix sorted.
+    x = np.ascontiguousarray(picks['x'])
+    order = np.argsort(x, kind='stable')
+    key = group[order]
+    if group.size and group.max() < 1 << 16:
+        key = key.astype(np.uint16)
+    order = order[np.argsort(key, kind='stable')]
+    x, src, group = x[order], src[order], group[order]
+    linked = (group[1:] == group[:-1]) & (src[1:] != src[:-1]) & (np.diff(x) <= tolerance)
+    is_start = np.concatenate([[picks.size > 0], ~linked])
+    _split_chains(is_start, x, src, tolerance)
+    starts = np.flatnonzero(is_start)
+
+    if not picks.size:
+        kept = picks
+    elif method == 'average':
+        kept = average_runs(picks[order], starts)
+    else:
+        # pick of the first source in each cluster, the first one of that source
+        rank = src.astype(np.int64) * picks.size + np.arange(picks.size)
+        starts = np.minimum.reduceat(rank, starts) % picks.size
+        kept = picks[order[starts]]
+    kept = kept.astype(txin.RECORD_DTYPE, copy=False)
+
+    # kept picks are in order of shot, so each header goes before the first
+    # pick of its shot
+    headers = txin.to_records(np.column_stack([
+        header_keys, np.zeros((header_keys.shape[0], 2))]))
+    positions = np.searchsorted(group[starts] // n_codes, np.arange(header_keys.shape[0]))
+    return np.concatenate([
+        np.insert(kept, positions, headers), txin.to_records(txin.ENDING_RECORD)])
@@ -0,0 +1,127 @@
+"""Run core jobs (e.g. `TxMakerCore.run`) off the Tk main thread.
+
+A job is a function taking a `JobProgress`. It runs in a worker thread and
+calls the progress object now and then to report its progress, which is
+also where it gets cancelled: once `JobRunner.cancel` is called, the next
+call raises `JobCancelled` inside the job. Jobs writing files call it last
+before replacing their output, and `report_committed` after. The Tk side polls for progress
+and completion with `after()`, so all callbacks run on the main thread.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import sys
+import threading
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when it is cancelled"""
+
+
+def no_progress(fraction=None, message=None):
+    """Progress reporter for jobs run without a `JobRunner`"""
+
+
+def report_committed(progress, fraction=None, message=None):
+    """Report progress of a job that has written its output already. It is
+    too late to cancel it then, so a cancellation is ignored and the job
+    completes.
+    """
+    try:
+        progress(fraction, message)
+    except JobCancelled:
+        pass
+
+
+class JobProgress(object):
+    """Progress reporter handed to a job, and its cancellation point"""
+
+    def __init__(self):
+        self.cancelled = threading.Event()
+        self.queue = queue.Queue()
+
+    def __call__(self, fraction=None, message=None):
+        """Report progress. Both arguments are optional, a bare call only
+        checks for cancellation.
+        """
+        if self.cancelled.is_set():
+            raise JobCancelled()
+        if fraction is not None or message is not None:
+            self.queue.put((fraction, message))
+
+
+class JobRunner(object):
+    """Run one job at a time in a background thread for a Tk widget"""
+
+    POLL_MS = 100
+
+    def __init__(self, widget, on_progress=None):
+        self.widget = widget
+        self.on_progress = on_progress
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._future = None
+        self._progress = None
+
+    @property
+    def busy(self):
+        return self._future is not None
+
+    def start(self, job, on_done=None, on_error=None, on_cancelled=None):
+        """Start job(progress). Callbacks are called on the Tk main thread:
+        on_done(result), on_error(exc_type, exc, tb) and on_cancelled().
+        """
+        if self.busy:
+            raise RuntimeError('Another job is running')
+        self._progress = JobProgress()
+        self._callbacks = (on_done, on_error, on_cancelled)
+        self._future = self._executor.submit(self._run, job, self._progress)
+        self.widget.after(self.POLL_MS, self._poll)
+
+    @staticmethod
+    def _run(job, progress):
+        # imported here, util.perf is not needed to show the window
+        from util import perf
+        try:
+            with perf.profiled():
+                return job(progress), None
+        except JobCancelled:
+            raise
+        except Exception:
+            # keep the traceback for report_callback_exception
+            return None, sys.exc_info()
+
+    def cancel(self):
+        if self._progress is not None:
+            self._progress.cancelled.set()
+
+    def _drain(self):
+        while True:
+            try:
+                fraction, message = self._progress.queue.get_nowait()
+            except queue.Empty:
+                return
+            if self.on_progress is not None:
+                self.on_progress(fraction, message)
+
+    def _poll(self):
+        self._drain()
+        if not self._future.done():
+            self.widget.after(self.POLL_MS, self._poll)
+            return
+        future, self._future = self._future, None
+        on_done, on_error, on_cancelled = self._callbacks
+        try:
+            result, exc_info = future.result()
+        except JobCancelled:
+            if on_cancelled is not None:
+                on_cancelled()
+            return
+        if exc_info is not None:
+            if on_error is not None:
+                on_error(*exc_info)
+        elif on_done is not None:
+            on_done(result)
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,62 @@
+"""Byte offsets of the lines of a text file, for reading any line range.
+
+The offsets are found with numpy a chunk at a time, so indexing a file of
+millions of lines takes a fraction of a second and 8 bytes per line. After
+that, reading lines [start, stop) is a single seek and read, whatever the
+size of the file.
+"""
+
+import os
+
+import numpy as np
+
+
+CHUNK_SIZE = 1 << 24
+
+
+class LineIndex(object):
+    """Offsets of the lines of a text file"""
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE):
+        self.path = path
+        st = os.stat(path)
+        self.stamp = (st.st_mtime_ns, st.st_size)
+        self.offsets = self._find_offsets(path, chunk_size)
+
+    @staticmethod
+    def _find_offsets(path, chunk_size):
+        """offsets[i] is the start of line i, offsets[-1] the end of the last line"""
+        ends = []
+        pos = 0
+        last = b''
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                ends.append(np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == 10) + (pos + 1))
+                pos += len(chunk)
+                last = chunk[-1:]
+        if pos and last != b'\n':
+            # the last line has no newline
+            ends.append(np.array([pos]))
+        return np.concatenate([[0]] + ends).astype(np.int64)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def outdated(self):
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size) != self.stamp
+
+    def read_lines(self, start, stop):
+        """Text of lines [start, stop), with '\\n' newlines"""
+        start, stop = max(start, 0), min(stop, len(self))
+        if start >= stop:
+            return ''
+        begin, end = int(self.offsets[start]), int(self.offsets[stop])
+        with open(self.path, 'rb') as f:
+            f.seek(begin)
+            data = f.read(end - begin)
+        return data.replace(b'\r\n', b'\n').decode('utf8', errors='replace')
@@ -0,0 +1,32 @@
+"""Loggers writing to `log/*.log`, configured once per process."""
+
+import logging
+from logging.handlers import RotatingFileHandler
+import os
+
+from __init__ import ROOT_DIR
+
+
+LOG_DIR = os.path.join(ROOT_DIR, 'log')
+LOG_FORMAT = '[%(asctime)s] %(name)s %(levelname)s: %(message)s'
+
+
+def get_logger(name, file_name, fmt=LOG_FORMAT, max_bytes=0, backup_count=0):
+    """Logger `name` writing to log/<file_name>, formatted by `fmt`.
+
+    The file handler is added on the first call only, so frames built
+    several times do not write every message several times. The file is
+    opened on the first message, not at start-up. With `max_bytes`, the
+    file is rotated once it reaches that size, keeping `backup_count` old
+    ones.
+    """
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        logger.setLevel(logging.DEBUG)
+        file_handler = RotatingFileHandler(
+            os.path.join(LOG_DIR, file_name), maxBytes=max_bytes, backupCount=backup_count,
+            encoding='utf8', delay=True)
+        file_handler.setLevel(logging.DEBUG)
+        file_handler.setFormatter(logging.Formatter(fmt))
+        logger.addHandler(file_handler)
+    return logger
@@ -0,0 +1,118 @@
+"""Manifest of a merged tx.in, for incremental re-merging.
+
+For the output of a merge the manifest records the sources in order, with
+their mtime, size and sha1, the ray number applied and the byte range each
+one takes in the output. It is stored next to the output as
+`<tx.in>.merge.json`. On the next merge, the segments of unchanged sources
+are copied from the previous output as raw bytes (with `os.copy_file_range`
+or `os.sendfile` where available) instead of being processed again.
+"""
+
+import hashlib
+import json
+import os
+
+
+MANIFEST_SUFFIX = '.merge.json'
+COPY_CHUNK = 1 << 22
+
+
+def file_stamp(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def copy_range(src, dst, offset, length):
+    """Copy `length` bytes at `offset` of file object src to the position of dst"""
+    dst.flush()
+    src_fd, dst_fd = src.fileno(), dst.fileno()
+    copied = 0
+    for func in ('copy_file_range', 'sendfile'):
+        if not hasattr(os, func):
+            continue
+        try:
+            while copied < length:
+                if func == 'copy_file_range':
+                    n = os.copy_file_range(src_fd, dst_fd, length - copied, offset + copied)
+                else:
+                    n = os.sendfile(dst_fd, src_fd, offset + copied, length - copied)
+                if n == 0:
+                    break
+                copied += n
+        except OSError:
+            # not supported for these files, try the next way
+            continue
+        if copied == length:
+            # the file object does not know the fd has moved
+            dst.seek(os.lseek(dst_fd, 0, os.SEEK_CUR))
+            return
+    while copied < length:
+        src.seek(offset + copied)
+        chunk = src.read(min(COPY_CHUNK, length - copied))
+        if not chunk:
+            raise ValueError('Unexpected end of file: %s' %src.name)
+        dst.write(chunk)
+        copied += len(chunk)
+    dst.flush()
+
+
+class MergeManifest(object):
+    """Sources and their byte ranges in a merged tx.in"""
+
+    def __init__(self, target_path, segments=None, target_stamp=None):
+        self.target_path = target_path
+        # each segment: {path, stamp, sha1, ray_number, offset, length}
+        self.segments = segments or []
+        self.target_stamp = target_stamp
+
+    @classmethod
+    def manifest_path(cls, target_path):
+        return target_path + MANIFEST_SUFFIX
+
+    @classmethod
+    def load(cls, target_path):
+        """Manifest of the existing output, None if missing or outdated"""
+        try:
+            with open(cls.manifest_path(target_path), 'r') as f:
+                data = json.load(f)
+            if data['target_stamp'] != file_stamp(target_path):
+                return None
+            return cls(target_path, data['segments'], data['target_stamp'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self):
+        self.target_stamp = file_stamp(self.target_path)
+        with open(self.manifest_path(self.target_path), 'w') as f:
+            json.dump({'target_stamp': self.target_stamp, 'segments': self.segments}, f, indent=1)
+
+    def find_unchanged(self, path, ray_number):
+        """Segment of an unchanged source merged with the same ray number"""
+        path = os.path.abspath(path)
+        stamp = file_stamp(path)
+        sha1 = None
+        for seg in self.segments:
+            if seg['path'] != path or seg['ray_number'] != ray_number:
+                continue
+            if seg['stamp'] == stamp:
+                return seg
+            if seg['stamp'][1] == stamp[1]:
+                # touched but maybe not modified
+                sha1 = sha1 or file_hash(path)
+                if seg['sha1'] == sha1:
+                    return seg
+        return None
+
+    def add(self, path, ray_number, offset, length, sha1=None):
+        path = os.path.abspath(path)
+        self.segments.append({
+            'path': path, 'stamp': file_stamp(path), 'sha1': sha1 or file_hash(path),
+            'ray_number': ray_number, 'offset': offset, 'length': length})
@@ -0,0 +1,186 @@
+"""Timing of pipeline stages, logged as JSON lines to `log/perf.log`.
+
+Stages are logged only if the environment variable TX_PERF is set (to
+anything but 0), and the log is rotated at `LOG_MAX_BYTES`.
+
+    with perf.stage('load_horizon_data', path=path) as st:
+        data = load_columns(path, usecols=(1, 2))
+        st.set(rows=data.shape[0], bytes_read=os.path.getsize(path))
+
+logs one record per stage, e.g.
+
+    {"time": "2024-05-02T10:31:07", "pid": 4242, "stage": "load_horizon_data",
+     "seconds": 0.412, "path": "...", "rows": 2000000, "bytes_read": 34777790,
+     "rss_start_mb": 78.2, "peak_rss_mb": 181.3, "peak_scope": "stage"}
+
+`peak_rss_mb` is the peak RSS during the stage on Linux, where the peak is
+reset as the stage starts (see `reset_peak_rss`), and `rss_start_mb` the
+RSS at its start. Elsewhere the peak can not be reset, and `peak_scope` is
+"process" instead of "stage": the peak is that of the process so far.
+Stages reset the peak of the whole process, so do not nest them.
+
+Setting the environment variable TX_PROFILE to a file name also profiles
+the command line tools (`profiled`) and GUI jobs (`util.job_runner`) into
+that file: with cProfile, or pyinstrument if TX_PROFILER=pyinstrument.
+A `.prof` dump of cProfile is read with `py -m pstats <file>` or snakeviz.
+"""
+
+import cProfile
+from contextlib import contextmanager
+import datetime
+import json
+import os
+import sys
+import time
+
+from util.log import get_logger
+
+
+PERF_ENV = 'TX_PERF'
+PROFILE_ENV = 'TX_PROFILE'
+PROFILER_ENV = 'TX_PROFILER'
+LOG_MAX_BYTES = 4 << 20
+LOG_BACKUP_COUNT = 2
+
+
+def enabled():
+    """Whether stages are logged, see TX_PERF"""
+    return os.environ.get(PERF_ENV, '0') not in ('', '0')
+
+
+def peak_rss_mb():
+    """Peak RSS of this process in MiB, None where unknown (Windows)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 1024
+
+
+def rss_mb():
+    """Current RSS of this process in MiB, None where unknown"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    """Reset the peak RSS of this process to its current RSS. Returns
+    whether it could, i.e. on Linux only.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+class Stage(object):
+    """Context of a timed stage. Logs its record on exit, failed or not,
+    if TX_PERF is set. Does nothing otherwise.
+    """
+
+    def __init__(self, name, **fields):
+        self.name = name
+        self.fields = fields
+        self.start = None
+        self.enabled = enabled()
+        self.rss_start = None
+        self.peak_scope = None
+
+    def set(self, **fields):
+        """Add fields to the record, e.g. rows, bytes_read or bytes_written"""
+        self.fields.update(fields)
+
+    def __enter__(self):
+        if self.enabled:
+            self.rss_start = rss_mb()
+            self.peak_scope = 'stage' if reset_peak_rss() else 'process'
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.enabled:
+            return False
+        record = {
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'pid': os.getpid(),
+            'stage': self.name,
+            'seconds': round(time.perf_counter() - self.start, 6),
+        }
+        record.update(self.fields)
+        record['rss_start_mb'] = self.rss_start
+        record['peak_rss_mb'] = peak_rss_mb()
+        record['peak_scope'] = self.peak_scope
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        logger = get_logger(
+            'TxPerf', 'perf.log', '%(message)s', LOG_MAX_BYTES, LOG_BACKUP_COUNT)
+        logger.info(json.dumps(record, default=str))
+        return False
+
+
+def stage(name, **fields):
+    return Stage(name, **fields)
+
+
+@contextmanager
+def profiled(path=None, profiler=None):
+    """Profile the enclosed code into path, by default those of TX_PROFILE
+    and TX_PROFILER. Does nothing if no path is given. Profiles the
+    calling thread only.
+    """
+    path = path or os.environ.get(PROFILE_ENV)
+    if not path:
+        yield
+        return
+    profiler = (profiler or os.environ.get(PROFILER_ENV) or 'cprofile').lower()
+    if profiler == 'pyinstrument':
+        # optional dependency, only needed when asked for
+        from pyinstrument import Profiler
+        prof = Profiler()
+        prof.start()
+        try:
+            yield
+        finally:
+            prof.stop()
+            with open(path, 'w', encoding='utf8') as f:
+                f.write(prof.output_html() if path.endswith('.html') else prof.output_text())
+        return
+    if profiler != 'cprofile':
+        raise ValueError('Invalid profiler "%s". Support only cprofile and pyinstrument' %profiler)
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield
+    finally:
+        prof.disable()
+        prof.dump_stats(path)
+
+
+def run_profiled(main):
+    """main() of a command line tool, profiled if TX_PROFILE is set"""
+    with profiled():
+        return main()
@@ -0,0 +1,445 @@
+"""Quality control of horizons and tx.in records, before rayinvr sees them.
+
+Every check is a few column operations over the whole array, so a QC pass
+costs milliseconds even for millions of picks. A check finds either errors,
+which make the maker or merger stop before writing anything, or warnings,
+which are reported only.
+
+Horizon data (trace, time), before mapping traces to x:
+
+    nan              blank or invalid cells                         error
+    trace_range      traces outside the survey table, which
+                     np.interp would silently clamp to its ends     error
+    duplicate_trace  traces picked more than once                   error
+
+tx.in records:
+
+    nan              nan or infinite x, t or uncertainty            error
+    code             codes below -1                                 error
+    ending           missing ending record, or one not at the end   error
+    first_record     picks before the first shot header             error
+    shot_header      shot headers with t other than -1 or 1         error
+    uncertainty      negative uncertainties                         error
+    duplicate_pick   same x and ray group twice in a shot block     error
+    monotonic        x going back and forth in a run of picks of
+                     one ray group in a shot block                  warning
+
+`HorizonCheck` and `RecordsCheck` run the same checks on data coming a
+block at a time, e.g. of the chunked maker, with rows counted across blocks.
+`RecordsCheck` carries the open shot block and run of picks from a block to
+the next, so its report is that of `check_records` whatever the block size.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from util import txin
+from util.txin_reader import TxinFile
+
+
+ERROR = 'error'
+WARNING = 'warning'
+
+# `index` is the first offending row
+QCIssue = namedtuple('QCIssue', 'check severity count index message')
+# order of issues in a report, whatever order they are found in
+CHECKS = (
+    'nan', 'trace_range', 'duplicate_trace', 'code', 'ending', 'first_record', 'shot_header',
+    'uncertainty', 'monotonic', 'duplicate_pick')
+
+
+def _issue_rank(issue):
+    check = CHECKS.index(issue.check) if issue.check in CHECKS else len(CHECKS)
+    return check, issue.severity != ERROR
+
+
+class QCError(ValueError):
+    """Raised for data failing QC. `reports` are the failed `QCReport`(s)."""
+
+    def __init__(self, reports):
+        super().__init__('\n'.join(report.summary() for report in reports))
+        self.reports = reports
+
+    def __reduce__(self):
+        # rebuilt from its reports, e.g. when raised in a worker process
+        return QCError, (self.reports,)
+
+
+class QCReport(object):
+    """Issues found in the data of `source`"""
+
+    def __init__(self, source):
+        self.source = source
+        self.issues = []
+
+    def add(self, check, severity, mask, message, offset=0):
+        """Add an issue if any of mask is set. `offset` is the row of mask[0].
+        The same issue found again, e.g. in a later block, adds to its count.
+        """
+        count = int(np.count_nonzero(mask))
+        if not count:
+            return
+        for i, issue in enumerate(self.issues):
+            if (issue.check, issue.severity, issue.message) == (check, severity, message):
+                self.issues[i] = issue._replace(count=issue.count + count)
+                return
+        issue = QCIssue(check, severity, count, offset + int(np.argmax(mask)), message)
+        pos = len(self.issues)
+        while pos and _issue_rank(self.issues[pos - 1]) > _issue_rank(issue):
+            pos -= 1
+        self.issues.insert(pos, issue)
+
+    @property
+    def errors(self):
+        return [issue for issue in self.issues if issue.severity == ERROR]
+
+    @property
+    def warnings(self):
+        return [issue for issue in self.issues if issue.severity == WARNING]
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def summary(self):
+        if not self.issues:
+            return 'QC of %s: ok' %self.source
+        lines = ['QC of %s: %d error(s), %d warning(s)' %(
+            self.source, len(self.errors), len(self.warnings))]
+        for issue in self.issues:
+            lines.append('  %s: %s: %d row(s), first at row %d: %s' %(
+                issue.severity, issue.check, issue.count, issue.index + 1, issue.message))
+        return '\n'.join(lines)
+
+    def raise_for_errors(self):
+        if not self.ok:
+            raise QCError([self])
+        return self
+
+
+def _check_horizon_rows(report, horizon_data, trace_range, offset=0):
+    """nan and trace_range checks. Returns the mask of traces repeated
+    within the rows.
+    """
+    trace, time = horizon_data[:, 0], horizon_data[:, 1]
+    report.add(
+        'nan', ERROR, np.isnan(trace) | np.isnan(time), 'blank or invalid trace or time', offset)
+    first, last = trace_range
+    with np.errstate(invalid='ignore'):
+        outside = (trace < first) | (trace > last)
+    report.add(
+        'trace_range', ERROR, outside,
+        'traces outside %d-%d of the survey table' %(first, last), offset)
+    dup = np.zeros(trace.size, dtype=bool)
+    if trace.size > 1:
+        order = np.argsort(trace, kind='stable')
+        dup[order[1:]] = trace[order[1:]] == trace[order[:-1]]
+    return dup
+
+
+def check_horizon(horizon_data, trace_range, source='horizon'):
+    """QC of (trace, time) rows of a horizon against (first, last) trace of
+    the survey table
+    """
+    report = QCReport(source)
+    dup = _check_horizon_rows(report, horizon_data, trace_range)
+    report.add('duplicate_trace', ERROR, dup, 'traces picked more than once')
+    return report
+
+
+def _shot_block_ids(code):
+    """Index of the shot block of every record, -1 before the first shot"""
+    return np.cumsum(code == 0) - 1
+
+
+class HorizonCheck(object):
+    """`check_horizon` of a horizon read a block at a time. Traces repeated
+    across blocks are found with a bitmap of the traces of the survey table,
+    which are integers. The few other traces, fractional or outside the
+    table, are looked up among the sorted ones seen so far.
+    """
+
+    def __init__(self, trace_range, source='horizon'):
+        self.report = QCReport(source)
+        self.trace_range = trace_range
+        self.rows = 0
+        first, last = trace_range
+        self._seen = np.zeros(int(last - first) + 1, dtype=bool)
+        self._seen_others = np.zeros(0)
+
+    def update(self, horizon_data):
+        """QC of the next block of rows. Returns the report so far."""
+        dup = _check_horizon_rows(self.report, horizon_data, self.trace_range, self.rows)
+        trace = horizon_data[:, 0]
+        first, last = self.trace_range
+        with np.errstate(invalid='ignore'):
+            in_table = (trace >= first) & (trace <= last) & (trace == np.rint(trace))
+        rows = np.flatnonzero(in_table)
+        bit = (trace[rows] - first).astype(np.int64)
+        dup[rows] |= self._seen[bit]
+        self._seen[bit] = True
+        rows = np.flatnonzero(~in_table & ~np.isnan(trace))
+        if rows.size:
+            seen = self._seen_others
+            if seen.size:
+                pos = np.minimum(np.searchsorted(seen, trace[rows]), seen.size - 1)
+                dup[rows] |= seen[pos] == trace[rows]
+            self._seen_others = np.union1d(seen, trace[rows])
+        self.report.add(
+            'duplicate_trace', ERROR, dup, 'traces picked more than once', self.rows)
+        self.rows += horizon_data.shape[0]
+        return self.report
+
+
+# the run of picks open at the last record of a `RecordsCheck` update:
+# shot block, ray group and x of that record, row of its first pick, steps
+# so far, and whether x went up or down in them
+_OpenRun = namedtuple('_OpenRun', 'block code x start steps up down')
+
+
+def _code_ranges(code, low, high):
+    """Sorted unique codes, with the minimum of low and maximum of high of each"""
+    order = np.argsort(code, kind='stable')
+    code = code[order]
+    starts = np.flatnonzero(np.concatenate([[True], code[1:] != code[:-1]]))
+    return (
+        code[starts], np.minimum.reduceat(low[order], starts),
+        np.maximum.reduceat(high[order], starts))
+
+
+class RecordsCheck(object):
+    """`check_records` of records coming a block at a time, e.g. as they are
+    written. The report does not depend on the block size: the run of picks
+    open at the end of a block goes on in the next one, and so do the picks
+    of the last shot block, for duplicate_pick. Those are kept, so memory
+    grows with the size of a shot block, not of the records.
+    """
+
+    def __init__(self, source='tx.in', require_ending=True):
+        self.report = QCReport(source)
+        self.require_ending = require_ending
+        self.rows = 0
+        # shot headers so far
+        self._blocks = 0
+        # whether the last record so far is an ending record
+        self._ended = False
+        # `_OpenRun` if the last record so far is a pick
+        self._run = None
+        # last shot block so far, (code, x) of its picks and the range of
+        # x of each code in them
+        self._open_block = -1
+        self._open_picks = []
+        self._open_ranges = (np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0))
+
+    def update(self, records, final=False):
+        """QC of the next block of records, `final` for the last one.
+        Returns the report so far.
+        """
+        report, offset = self.report, self.rows
+        n = records.shape[0]
+        # contiguous columns are faster to compute on than fields of records
+        x = np.ascontiguousarray(records['x'])
+        t = np.ascontiguousarray(records['t'])
+        unc = np.ascontiguousarray(records['uncertainty'])
+        code = np.ascontiguousarray(records['code'])
+
+        report.add(
+            'nan', ERROR, ~(np.isfinite(x) & np.isfinite(t) & np.isfinite(unc)),
+            'nan or infinite x, t or uncertainty', offset)
+        report.add(
+            'code', ERROR, code < -1, 'invalid codes, expect -1, 0 or a ray group', offset)
+
+        ending = code == -1
+        before_end = 'ending record (0 0 0 -1) before the end'
+        if self._ended and n:
+            report.add('ending', ERROR, np.ones(1, dtype=bool), before_end, offset - 1)
+        if n:
+            self._ended = bool(ending[-1])
+        report.add('ending', ERROR, ending[:-1] if self._ended else ending, before_end, offset)
+        if final and not self._ended:
+            # at the last record, of this block or of the previous one
+            mask = np.zeros(max(n, 1), dtype=bool)
+            mask[-1] = True
+            report.add(
+                'ending', ERROR if self.require_ending else WARNING, mask,
+                'missing ending record (0 0 0 -1)', offset if n else max(offset - 1, 0))
+
+        # shot blocks numbered across updates, -1 before the first one
+        shot = code == 0
+        block = _shot_block_ids(code) + self._blocks
+        self._blocks += int(np.count_nonzero(shot))
+        pick = code > 0
+        report.add(
+            'first_record', ERROR, pick & (block < 0), 'picks before the first shot header', offset)
+        report.add(
+            'shot_header', ERROR, shot & (t != 1) & (t != -1),
+            'shot headers with t other than -1 (left) or 1 (right)', offset)
+        report.add('uncertainty', ERROR, pick & (unc < 0), 'negative uncertainties', offset)
+        if n:
+            self._check_picks(x, code, block, pick, offset)
+        self.rows += n
+        return report
+
+    def _check_picks(self, x, code, block, pick, offset):
+        """monotonic and duplicate_pick of the picks of an update, going on
+        from the open run and shot block of the previous ones
+        """
+        report, n, run = self.report, x.size, self._run
+        idx = np.flatnonzero(pick)
+        if run is not None:
+            # the last pick before, as row -1
+            idx = np.concatenate([[-1], idx])
+        px, pb, pc = x[idx], block[idx], code[idx]
+        if run is not None:
+            px[0], pb[0], pc[0] = run.x, run.block, run.code
+        dup = np.zeros(n, dtype=bool)
+
+        if idx.size:
+            # picks of one ray group in one shot block share a key
+            key = pb * (int(pc.max()) + 1) + pc
+            # a run is consecutive records of one key
+            in_run = (key[1:] == key[:-1]) & (idx[1:] == idx[:-1] + 1)
+            step = np.diff(px)
+            run_id = np.concatenate([[0], np.cumsum(~in_run)])
+            n_runs = int(run_id[-1]) + 1
+            up = np.zeros(n_runs, dtype=bool)
+            down = np.zeros(n_runs, dtype=bool)
+            up[run_id[1:][in_run & (step > 0)]] = True
+            down[run_id[1:][in_run & (step < 0)]] = True
+            if run is not None:
+                up[0] |= run.up
+                down[0] |= run.down
+            bad_run = up & down
+            message = 'picks in runs of one ray group with x going back and forth'
+            if run is not None and bad_run[0] and not (run.up and run.down) and run.steps:
+                # the run went back only now, its steps before count too
+                report.add(
+                    'monotonic', WARNING, np.ones(run.steps, dtype=bool), message, run.start + 1)
+            turn = np.zeros(n, dtype=bool)
+            turn[idx[1:][in_run & bad_run[run_id[1:]]]] = True
+            report.add('monotonic', WARNING, turn, message, offset)
+
+            run_keys = key[np.concatenate([[0], np.flatnonzero(~in_run) + 1])]
+            if not bad_run.any() and np.unique(run_keys).size == n_runs:
+                # every key is a single monotonic run: duplicates are neighbours
+                dup[idx[1:][in_run & (step == 0)]] = True
+            else:
+                order = np.lexsort((px, key))
+                same = (key[order[1:]] == key[order[:-1]]) & (px[order[1:]] == px[order[:-1]])
+                rows = idx[order[1:]][same]
+                dup[rows[rows >= 0]] = True
+
+            if pick[-1]:
+                # the last run goes on in the next update
+                last = n_runs - 1
+                first = int(np.searchsorted(run_id, last))
+                steps = idx.size - 1 - first
+                if first == 0 and run is not None:
+                    start, steps = run.start, steps + run.steps
+                else:
+                    start = offset + int(idx[first])
+                self._run = _OpenRun(
+                    int(pb[-1]), int(pc[-1]), float(px[-1]), start, steps,
+                    bool(up[last]), bool(down[last]))
+            else:
+                self._run = None
+
+        # picks of the shot block open before, against its picks so far
+        cont = np.flatnonzero(pick & (block == self._open_block))
+        if cont.size and self._open_picks:
+            dup[cont[self._seen_before(code[cont], x[cont])]] = True
+        report.add(
+            'duplicate_pick', ERROR, dup, 'same x and ray group twice in a shot block', offset)
+
+        if self._blocks - 1 != self._open_block:
+            self._open_block = self._blocks - 1
+            self._open_picks = []
+            self._open_ranges = (np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0))
+        keep = pick & (block == self._open_block)
+        if keep.any():
+            kc, kx = code[keep], x[keep]
+            self._open_picks.append((kc, kx))
+            codes, low, high = self._open_ranges
+            self._open_ranges = _code_ranges(
+                np.concatenate([codes, kc]), np.concatenate([low, kx]),
+                np.concatenate([high, kx]))
+
+    def _seen_before(self, code, x):
+        """Mask of picks (code, x) found in the open shot block so far. Only
+        picks within the range of x of their code are looked up, so picks
+        going on in one direction cost nothing.
+        """
+        codes, low, high = self._open_ranges
+        pos = np.minimum(np.searchsorted(codes, code), codes.size - 1)
+        inside = (codes[pos] == code) & (x >= low[pos]) & (x <= high[pos])
+        seen = np.zeros(code.size, dtype=bool)
+        if not inside.any():
+            return seen
+        if len(self._open_picks) > 1:
+            self._open_picks = [tuple(np.concatenate(c) for c in zip(*self._open_picks))]
+        old_code, old_x = self._open_picks[0]
+        new = np.flatnonzero(inside)
+        all_code = np.concatenate([old_code, code[new]])
+        all_x = np.concatenate([old_x, x[new]])
+        is_new = np.arange(all_code.size) >= old_code.size
+        # equal picks sort together, those seen before first
+        order = np.lexsort((is_new, all_x, all_code))
+        all_code, all_x, is_new = all_code[order], all_x[order], is_new[order]
+        group_start = np.concatenate([
+            [True], (all_code[1:] != all_code[:-1]) | (all_x[1:] != all_x[:-1])])
+        first = np.maximum.accumulate(np.where(group_start, np.arange(order.size), 0))
+        seen[new[order[is_new] - old_code.size]] = ~is_new[first][is_new]
+        return seen
+
+
+def check_records(records, source='tx.in', require_ending=True):
+    """QC of tx.in records. Without `require_ending`, a missing ending
+    record is a warning only (the merger adds its own).
+    """
+    return RecordsCheck(source, require_ending).update(records, final=True)
+
+
+def _iter_txin_blocks(path):
+    """Records of a tx.in, a block of `txin.BLOCK_ROWS` at a time: from its
+    binary companion, its memory map if fixed-width, or parsed as text
+    """
+    records = txin.load_companion(path) if not path.endswith(txin.COMPANION_SUFFIX) else None
+    if records is not None:
+        for i in range(0, records.shape[0], txin.BLOCK_ROWS):
+            yield records[i:i+txin.BLOCK_ROWS]
+        return
+    try:
+        tx_file = TxinFile(path)
+    except ValueError:
+        # empty, not fixed-width or a companion itself
+        yield from txin.iter_record_blocks(path)
+        return
+    with tx_file:
+        for i in range(0, len(tx_file), txin.BLOCK_ROWS):
+            yield tx_file.records(i, i + txin.BLOCK_ROWS)
+
+
+def check_txin(path, require_ending=False):
+    """QC of a tx.in file, e.g. an input of the merger. It is read a block
+    at a time, see `RecordsCheck`.
+    """
+    check = RecordsCheck(path, require_ending)
+    for records in _iter_txin_blocks(path):
+        check.update(records)
+    return check.update(txin.empty_records(0), final=True)
+
+
+def check_txins(paths, require_ending=False, progress=None):
+    """QC of several tx.in(s). Raises `QCError` with the reports of all
+    failed ones, else returns all reports.
+    """
+    reports = []
+    for i, path in enumerate(paths):
+        if progress is not None:
+            progress(i / len(paths), 'Checking %s' %path)
+        reports.append(check_txin(path, require_ending))
+    failed = [report for report in reports if not report.ok]
+    if failed:
+        raise QCError(failed)
+    return reports
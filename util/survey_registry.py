@@ -0,0 +1,155 @@
+"""Cache of parsed Trace-Number vs. X-Offset tables (`trace_number_vs_x/*`).
+
+Each table is parsed and validated once and kept in memory as a contiguous
+float64 array, until the file changes (by mtime or size). Optionally the
+parsed table is persisted as a `.npz` sidecar in a cache directory, so that
+a new process (e.g. a batch worker) does not need to parse the text again.
+"""
+
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+from util.columnar_reader import load_columns
+from util.trace_lookup import TraceLookup
+
+
+META_NAMES = ('shot_loc', 'time_offset')
+
+
+def parse_shot_meta(meta_line, survey_path):
+    """meta line format: <shot_loc>,<time_offset>"""
+    try:
+        meta_values = [float(s.strip()) for s in meta_line.strip().split(',')]
+    except ValueError:
+        meta_values = []
+    if len(META_NAMES) != len(meta_values):
+        raise ValueError(
+            'Meta line(the first line) of file "{}" format error. Should contain '
+            'the following fields delimited by comma: [{}]'
+            .format(survey_path, ', '.join(META_NAMES)))
+    return dict(zip(META_NAMES, meta_values))
+
+
+def parse_survey_file(survey_path):
+    """Parse and validate a survey file. Returns (meta, table)"""
+    with open(survey_path, 'r') as f:
+        # the first line contains meta info.
+        # meta line format: <shot_loc>,<time_offset>
+        meta_line = f.readline().strip()
+    table = load_columns(survey_path, skip_header=1)
+    if table.ndim != 2 or table.shape[1] != 2 or not np.all(np.diff(table, axis=0) > 0):
+        raise ValueError(
+            'Invalid Trace-Number vs. X-Offset Table: [%s].'
+            'Rows should in order of increasing.' %(survey_path))
+    meta = parse_shot_meta(meta_line, survey_path)
+    return meta, np.ascontiguousarray(table, dtype=np.float64)
+
+
+class SurveyTable(object):
+    """Parsed Trace-Number vs. X-Offset table of a survey"""
+
+    def __init__(self, path, meta, table, stamp):
+        self.path = path
+        self.meta = meta
+        self.table = table
+        self.stamp = stamp
+        self._lookup = None
+
+    @property
+    def shot_loc(self):
+        return self.meta['shot_loc']
+
+    @property
+    def time_offset(self):
+        return self.meta['time_offset']
+
+    @property
+    def trace_number(self):
+        return self.table[:, 0]
+
+    @property
+    def x(self):
+        return self.table[:, 1]
+
+    @property
+    def lookup(self):
+        """`TraceLookup` of the table, built on first use"""
+        if self._lookup is None:
+            self._lookup = TraceLookup(self.table)
+        return self._lookup
+
+
+class SurveyRegistry(object):
+    """Parse each survey table once, shared by GUI, core and batch mode"""
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stamp(path):
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def get(self, survey_path):
+        """The parsed `SurveyTable` of a survey file, reparsed if file changed"""
+        path = os.path.abspath(survey_path)
+        stamp = self._stamp(path)
+        with self._lock:
+            old = self._entries.get(path)
+            if old is not None and old.stamp == stamp:
+                return old
+            entry = self._load_sidecar(path, stamp)
+            if entry is None:
+                meta, table = parse_survey_file(path)
+                entry = SurveyTable(path, meta, table, stamp)
+                self._save_sidecar(entry)
+            self._entries[path] = entry
+            return entry
+
+    def invalidate(self, survey_path=None):
+        with self._lock:
+            if survey_path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(survey_path), None)
+
+    def _sidecar_path(self, path):
+        digest = hashlib.sha1(path.encode('utf8')).hexdigest()[:8]
+        return os.path.join(
+            self.cache_dir, '%s.%s.npz' %(os.path.basename(path), digest))
+
+    def _load_sidecar(self, path, stamp):
+        if self.cache_dir is None:
+            return None
+        sidecar = self._sidecar_path(path)
+        try:
+            with np.load(sidecar) as data:
+                if tuple(data['stamp'].tolist()) != stamp:
+                    return None
+                meta = dict(zip(META_NAMES, data['meta'].tolist()))
+                table = np.ascontiguousarray(data['table'], dtype=np.float64)
+        except (OSError, KeyError, ValueError):
+            return None
+        return SurveyTable(path, meta, table, stamp)
+
+    def _save_sidecar(self, entry):
+        if self.cache_dir is None:
+            return
+        sidecar = self._sidecar_path(entry.path)
+        tmp_path = '%s.%d.tmp' %(sidecar, os.getpid())
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                np.savez(
+                    f, stamp=np.array(entry.stamp, dtype=np.int64), table=entry.table,
+                    meta=np.array([entry.meta[k] for k in META_NAMES]))
+            os.replace(tmp_path, sidecar)
+        except OSError:
+            # the cache is optional
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -0,0 +1,55 @@
+"""Map trace numbers to x by direct indexing instead of `np.interp`.
+
+Trace numbers of a survey table are near-contiguous integers (11120, 11121,
+...), and so are those of horizon picks. For such a table, x of every
+integer trace in its range is interpolated once into a lookup array, and a
+pick is then mapped by indexing it with `trace - first trace`. Values are
+exactly those of `np.interp`, gaps in the table included. Fractional traces,
+and tables too sparse for a lookup array, are interpolated as before.
+"""
+
+import numpy as np
+
+
+# no lookup array for tables spanning more traces than this many per row
+MAX_SPAN_RATIO = 4
+
+
+class TraceLookup(object):
+    """Trace number to x mapping of a Trace-Number vs. X-Offset table"""
+
+    def __init__(self, table):
+        table = np.asarray(table, dtype=np.float64)
+        self.trace = np.ascontiguousarray(table[:, 0])
+        self.x = np.ascontiguousarray(table[:, 1])
+        self.first = None
+        self.lut = None
+        if self.trace.size and np.all(self.trace == np.rint(self.trace)):
+            first, last = int(self.trace[0]), int(self.trace[-1])
+            span = last - first + 1
+            if span <= MAX_SPAN_RATIO * self.trace.size + 1024:
+                self.first = first
+                self.lut = np.interp(np.arange(first, last + 1), self.trace, self.x)
+
+    @property
+    def direct(self):
+        """Whether integer traces are mapped by direct indexing"""
+        return self.lut is not None
+
+    def __call__(self, traces):
+        """x of traces, same as np.interp(traces, trace, x)"""
+        traces = np.asarray(traces, dtype=np.float64)
+        if self.lut is None:
+            return np.interp(traces, self.trace, self.x)
+        idx = traces - self.first
+        # nan and huge values also fail this check
+        with np.errstate(invalid='ignore'):
+            int_idx = idx.astype(np.int64)
+        exact = int_idx == idx
+        # out of range traces take the end values, like np.interp
+        np.clip(int_idx, 0, self.lut.size - 1, out=int_idx)
+        out = self.lut[int_idx]
+        if not exact.all():
+            rest = ~exact
+            out[rest] = np.interp(traces[rest], self.trace, self.x)
+        return out
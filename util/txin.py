@@ -0,0 +1,340 @@
+"""rayinvr tx.in records.
+
+Each line of tx.in is a record of 4 fixed-width fields formatted with
+`LINE_FMT`: x, t, uncertainty and code. The code tells the kind of record:
+
+    shot header:  <shot_loc>  <-1|1>  0  0   (picks at left/right of shot)
+    pick:         <x>  <t>  <uncertainty>  <ray group, > 0>
+    ending:       0  0  0  -1
+
+Records are kept as structured arrays of `RECORD_DTYPE`, so that filtering
+or renumbering ray groups are column operations. They are parsed and
+formatted in bulk: the digits of a whole block of records are
+computed with numpy into a character array, instead of one `%` operation per
+row. Values that numpy can not format exactly like `%` does (too wide, nan,
+or too close to a rounding tie) are formatted by `%`, so the output is
+always byte-identical to `LINE_FMT % tuple(row)`.
+
+A tx.in may have a binary companion, `<tx.in>.npy`: its records as a `.npy`
+array of `COMPANION_DTYPE` (little-endian x, t, uncertainty as float64 and
+code as int64). Values are those of the text, i.e. rounded to 3 decimals,
+so the companion loads to the same records as parsing the tx.in and formats
+to the same text. It can be memory-mapped and loads in milliseconds.
+"""
+
+import os
+import warnings
+
+import numpy as np
+
+
+LINE_FMT = '%10.3f%10.3f%10.3f%10d'
+FIELD_WIDTH = 10
+DECIMALS = 3
+LINE_WIDTH = 4 * FIELD_WIDTH + 1
+ENDING_RECORD = (0, 0, 0, -1)
+BLOCK_ROWS = 1 << 16
+BLOCK_SIZE = 1 << 22
+RECORD_DTYPE = np.dtype([
+    ('x', np.float64), ('t', np.float64), ('uncertainty', np.float64), ('code', np.int64)])
+COMPANION_DTYPE = RECORD_DTYPE.newbyteorder('<')
+COMPANION_SUFFIX = '.npy'
+
+_ZERO, _DOT, _MINUS, _SPACE = ord('0'), ord('.'), ord('-'), ord(' ')
+# a scaled value closer than this to x.5 may round either way
+_TIE_EPS = 1e-6
+
+
+def _put_digits(out, col_end, magnitude, ndigits):
+    """Write `ndigits` digits of integer `magnitude` right-aligned at `col_end`"""
+    for k in range(ndigits):
+        out[:, col_end-k] = _ZERO + magnitude % 10
+        magnitude = magnitude // 10
+
+
+def _format_field(out, col, values, decimals):
+    """Format one column into out[:, col:col+FIELD_WIDTH].
+
+    Same as '%10.3f' (or '%10d' if `decimals` is 0). Returns a mask of rows
+    that could not be formatted here.
+    """
+    end = col + FIELD_WIDTH - 1
+    bad = ~np.isfinite(values)
+    values = np.where(bad, 0, values)
+    if decimals:
+        scaled = np.abs(values) * 10**decimals
+        bad |= np.abs(scaled - np.floor(scaled) - 0.5) < _TIE_EPS
+        magnitude = np.rint(scaled)
+        negative = np.signbit(values)
+    else:
+        # '%d' truncates floats toward zero
+        magnitude = np.abs(np.trunc(values))
+        negative = (magnitude > 0) & (values < 0)
+    # wider values do not fit the field anyway
+    bad |= magnitude >= 10**(FIELD_WIDTH - 1)
+    magnitude = np.where(bad, 0, magnitude).astype(np.int64)
+
+    out[:, col:col+FIELD_WIDTH] = _SPACE
+    if decimals:
+        _put_digits(out, end, magnitude % 10**decimals, decimals)
+        out[:, end-decimals] = _DOT
+        int_end = end - decimals - 1
+    else:
+        int_end = end
+    int_part = magnitude // 10**decimals
+    # number of integer digits, at least one
+    int_digits = np.ones(magnitude.shape, dtype=np.int64)
+    for k in range(1, int_end - col + 1):
+        used = int_part >= 10**k
+        if not used.any():
+            break
+        int_digits += used
+    out[:, int_end] = _ZERO + int_part % 10
+    for k in range(1, int(int_digits.max(initial=1))):
+        used = k < int_digits
+        out[used, int_end-k] = _ZERO + (int_part[used] // 10**k) % 10
+    bad |= int_end - int_digits + 1 - negative < col
+    rows = np.flatnonzero(negative & ~bad)
+    out[rows, int_end - int_digits[rows]] = _MINUS
+    return bad
+
+
+def _format_block(block):
+    n = block.shape[0]
+    out = np.empty((n, LINE_WIDTH), dtype=np.uint8)
+    bad = np.zeros(n, dtype=bool)
+    for i in range(4):
+        bad |= _format_field(out, i*FIELD_WIDTH, block[:, i], DECIMALS if i < 3 else 0)
+    out[:, -1] = ord('\n')
+    if not bad.any():
+        return out.tobytes().decode('ascii')
+    fallback = [LINE_FMT %tuple(row) for row in block[bad].tolist()]
+    if any(len(s) != LINE_WIDTH - 1 for s in fallback):
+        # some record is wider than the fixed width
+        return ((LINE_FMT + '\n') * n) %tuple(block.ravel().tolist())
+    out[bad, :-1] = np.frombuffer(
+        ''.join(fallback).encode('ascii'), dtype=np.uint8).reshape(-1, LINE_WIDTH-1)
+    return out.tobytes().decode('ascii')
+
+
+def empty_records(n):
+    return np.zeros(n, dtype=RECORD_DTYPE)
+
+
+def to_records(columns):
+    """Records from an (n, 4) array of x, t, uncertainty and code"""
+    columns = np.asarray(columns, dtype=np.float64).reshape(-1, 4)
+    records = empty_records(columns.shape[0])
+    for i, name in enumerate(RECORD_DTYPE.names):
+        records[name] = columns[:, i]
+    return records
+
+
+def to_columns(records):
+    """(n, 4) float64 array of records, which may be structured or not"""
+    if records.dtype.names is None:
+        return np.asarray(records, dtype=np.float64).reshape(-1, 4)
+    columns = np.empty((records.shape[0], 4))
+    for i, name in enumerate(RECORD_DTYPE.names):
+        columns[:, i] = records[name]
+    return columns
+
+
+def is_pick(records):
+    return records['code'] > 0
+
+
+def is_shot(records):
+    return records['code'] == 0
+
+
+def is_ending(records):
+    return records['code'] == -1
+
+
+def _count_lines(text):
+    """Number of non-blank lines"""
+    return sum(1 for line in text.splitlines() if line.strip())
+
+
+def _has_lines(text, nlines):
+    """Whether text has `nlines` non-blank lines"""
+    # the common case, without blank lines
+    if text.count('\n') + (not text.endswith('\n')) == nlines:
+        return True
+    return _count_lines(text) == nlines
+
+
+def parse_records(text):
+    """Parse text of complete tx.in lines into records"""
+    if not text.strip():
+        # np.fromstring gives [-1.] for blank text
+        return empty_records(0)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            values = np.fromstring(text, sep=' ')
+        except (ValueError, DeprecationWarning):
+            values = None
+    if values is None or values.size % 4 or not _has_lines(text, values.size // 4):
+        raise ValueError('Invalid tx.in format')
+    return to_records(values)
+
+
+def iter_record_blocks(path, block_size=BLOCK_SIZE):
+    """Yield records of a tx.in file, parsed a block of complete lines at a time.
+
+    A binary companion is read in blocks of `BLOCK_ROWS` records instead.
+    """
+    if path.endswith(COMPANION_SUFFIX):
+        records = np.load(path, mmap_mode='r')
+        for i in range(0, records.shape[0], BLOCK_ROWS):
+            yield np.array(records[i:i+BLOCK_ROWS], dtype=RECORD_DTYPE)
+        return
+    pending = ''
+    with open(path, 'r') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            data = pending + block
+            idx = data.rfind('\n')
+            if idx == -1:
+                pending = data
+                continue
+            pending = data[idx+1:]
+            yield parse_records(data[:idx+1])
+    if pending.strip():
+        yield parse_records(pending)
+
+
+def load_records(path):
+    """Records of a tx.in, from its binary companion if it is up to date.
+
+    `path` may also be the companion itself.
+    """
+    if path.endswith(COMPANION_SUFFIX):
+        return np.load(path, mmap_mode='r')
+    records = load_companion(path)
+    if records is not None:
+        return records
+    blocks = list(iter_record_blocks(path))
+    return np.concatenate(blocks) if blocks else empty_records(0)
+
+
+def format_records(records, block_rows=BLOCK_ROWS):
+    """Yield the text of records, a block of rows at a time.
+
+    `records` is either of `RECORD_DTYPE` or an (n, 4) array.
+    """
+    records = np.asarray(records)
+    if records.dtype.names is None:
+        records = to_columns(records)
+    for i in range(0, records.shape[0], block_rows):
+        yield _format_block(to_columns(records[i:i+block_rows]))
+
+
+def write_records(f, records, block_rows=BLOCK_ROWS):
+    """Write records to a file object opened in text mode"""
+    for text in format_records(records, block_rows):
+        f.write(text)
+
+
+def save_records(path, records, block_rows=BLOCK_ROWS):
+    with open(path, 'w') as f:
+        write_records(f, records, block_rows)
+
+
+def companion_path(path):
+    return path + COMPANION_SUFFIX
+
+
+def _round_field(values):
+    """Values of '%.3f' text of values, without formatting"""
+    scaled = values * 10**DECIMALS
+    # np.rint keeps the sign of zero, like '-0.000'
+    rounded = np.rint(scaled) / 10**DECIMALS
+    # the product may round either way near a tie, '%' decides
+    ties = np.flatnonzero(np.abs(np.abs(scaled) - np.floor(np.abs(scaled)) - 0.5) < _TIE_EPS)
+    for i in ties.tolist():
+        rounded[i] = float('%.3f' %values[i])
+    return rounded
+
+
+def text_values(records):
+    """Records with the values they have once written as text and parsed"""
+    records = np.asarray(records)
+    if records.dtype.names is None:
+        records = to_records(records)
+    res = empty_records(records.shape[0])
+    for name in ('x', 't', 'uncertainty'):
+        res[name] = _round_field(records[name].astype(np.float64))
+    # '%d' truncates toward zero
+    res['code'] = np.trunc(records['code'])
+    return res
+
+
+def save_companion(path, records, exact=False):
+    """Write the binary companion of tx.in `path` holding records.
+
+    Pass `exact=True` if records already have their text values, e.g. were
+    parsed from the tx.in. Write it after the tx.in, as a companion older
+    than its tx.in is ignored.
+    """
+    if not exact:
+        records = text_values(records)
+    tmp_path = '%s.%d.tmp' %(companion_path(path), os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.asarray(records, dtype=COMPANION_DTYPE))
+    os.replace(tmp_path, companion_path(path))
+
+
+def save_companion_blocks(path, blocks, rows):
+    """Write the binary companion of tx.in `path` from blocks of `rows`
+    records in all, with their text values, e.g. of a tx.in too large to
+    hold in memory.
+    """
+    tmp_path = '%s.%d.tmp' %(companion_path(path), os.getpid())
+    companion = np.lib.format.open_memmap(
+        tmp_path, mode='w+', dtype=COMPANION_DTYPE, shape=(rows,))
+    i = 0
+    for block in blocks:
+        companion[i:i+block.shape[0]] = block
+        i += block.shape[0]
+    if i != rows:
+        raise ValueError('Expect %d records for the companion, got %d' %(rows, i))
+    companion.flush()
+    del companion
+    os.replace(tmp_path, companion_path(path))
+
+
+def load_companion(path, mmap_mode='r'):
+    """Records of the binary companion of tx.in `path`, memory-mapped.
+
+    None if there is no companion, or it is older than the tx.in or does not
+    fit its size.
+    """
+    try:
+        st, cst = os.stat(path), os.stat(companion_path(path))
+    except OSError:
+        return None
+    if cst.st_mtime_ns < st.st_mtime_ns:
+        return None
+    try:
+        records = np.load(companion_path(path), mmap_mode=mmap_mode)
+    except (OSError, ValueError):
+        return None
+    if records.dtype != COMPANION_DTYPE:
+        return None
+    # '\n' or '\r\n' newlines
+    if st.st_size not in (records.shape[0] * LINE_WIDTH, records.shape[0] * (LINE_WIDTH + 1)):
+        return None
+    return records
+
+
+def remove_companion(path):
+    """Remove the binary companion of a tx.in about to be rewritten"""
+    try:
+        os.remove(companion_path(path))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,223 @@
+"""Catalog of the tx.in(s) of a directory, with metadata, for the merger.
+
+A directory is listed with `os.scandir`, which also gives the mtime and
+size of every file, without a stat call on Windows. Metadata of a
+tx.in (number of picks, ray groups, shots and x range) is read from its
+`x` and `code` columns only (see `util.txin_reader`) and kept in a json
+cache keyed by path, mtime and size, so it is read once per version of a
+file, across sessions. So is the error of a file that can not be read,
+which is then not read again until it changes.
+
+Filters are matched in memory. A filter is a list of terms separated by
+spaces, all of which must match:
+
+    obs3         file name contains "obs3"
+    ray=2        has picks of ray group 2
+    picks>1000   has more than 1000 picks (also picks<, picks=)
+    x=35.2       picks cover x = 35.2 km
+    shot=13.1    has a shot within SHOT_TOLERANCE km of 13.1
+
+e.g. "obs3 ray=2 picks>100".
+"""
+
+from collections import namedtuple
+import json
+import operator
+import os
+import re
+import threading
+
+import numpy as np
+
+from util import txin
+from util.txin_reader import TxinFile
+
+
+# km, for shot=<x> terms of filters
+SHOT_TOLERANCE = 0.5
+
+# one tx.in of a directory. meta is a dict of `read_meta`, {'error': message}
+# if it can not be read, or None if not read yet
+TxinInfo = namedtuple('TxinInfo', 'name path stamp meta')
+
+_TERM = re.compile(r'^(ray|picks|x|shot)\s*(=|<|>)\s*(\S+)$', re.IGNORECASE)
+_OPS = {'=': operator.eq, '<': operator.lt, '>': operator.gt}
+
+
+def is_txin_name(name):
+    return 'tx' in name and name.endswith('.in')
+
+
+def read_meta(path):
+    """Metadata of a tx.in: picks, ray_groups, shot_count, shot_range, x_range"""
+    try:
+        with TxinFile(path) as tx_file:
+            code = tx_file.code.copy()
+            x = tx_file.column('x').copy()
+    except ValueError:
+        # empty or not fixed-width
+        records = txin.load_records(path)
+        code, x = np.asarray(records['code']), np.asarray(records['x'])
+    picks, shots = code > 0, code == 0
+
+    def value_range(values):
+        return [float(values.min()), float(values.max())] if values.size else None
+
+    return {
+        'picks': int(picks.sum()),
+        'ray_groups': np.unique(code[picks]).tolist(),
+        'shot_count': int(shots.sum()),
+        'shot_range': value_range(x[shots]),
+        'x_range': value_range(x[picks]),
+    }
+
+
+def describe(meta):
+    """One line summary of metadata, for the GUI"""
+    if meta is None:
+        return 'Reading...'
+    if 'error' in meta:
+        return 'Can not be read: %s' %meta['error']
+    parts = ['%d picks' %meta['picks']]
+    if meta['ray_groups']:
+        parts.append('ray group(s) %s' %' '.join(str(g) for g in meta['ray_groups']))
+    if meta['x_range']:
+        parts.append('x %.3f to %.3f km' %tuple(meta['x_range']))
+    shot_range = meta['shot_range']
+    if meta['shot_count'] == 1 or (shot_range and shot_range[0] == shot_range[1]):
+        parts.append('shot at %.3f km' %shot_range[0])
+    elif shot_range:
+        parts.append('%d shots, %.3f to %.3f km' %(meta['shot_count'], *shot_range))
+    return ', '.join(parts)
+
+
+def parse_filter(text):
+    """Predicate on `TxinInfo` for a filter, see module doc.
+
+    Metadata terms do not match tx.in(s) whose metadata is not read yet,
+    or can not be read.
+    Raises ValueError for a metadata term with an invalid value.
+    """
+    names, tests = [], []
+    for term in text.split():
+        m = _TERM.match(term)
+        if m is None:
+            names.append(term)
+            continue
+        key, op, value = m.group(1).lower(), m.group(2), m.group(3)
+        try:
+            value = int(value) if key in ('ray', 'picks') else float(value)
+        except ValueError:
+            raise ValueError('Invalid filter term "%s"' %term)
+        if key == 'picks':
+            tests.append(lambda meta, op=_OPS[op], v=value: op(meta['picks'], v))
+        elif op != '=':
+            raise ValueError('Invalid filter term "%s", expect %s=<value>' %(term, key))
+        elif key == 'ray':
+            tests.append(lambda meta, v=value: v in meta['ray_groups'])
+        elif key == 'x':
+            tests.append(lambda meta, v=value: bool(
+                meta['x_range']) and meta['x_range'][0] <= v <= meta['x_range'][1])
+        else:
+            tests.append(lambda meta, v=value: bool(meta['shot_range']) and (
+                meta['shot_range'][0] - SHOT_TOLERANCE <= v
+                <= meta['shot_range'][1] + SHOT_TOLERANCE))
+
+    def match(info):
+        if not all(s in info.name for s in names):
+            return False
+        if tests and (info.meta is None or 'error' in info.meta):
+            return False
+        return all(test(info.meta) for test in tests)
+    return match
+
+
+class TxinCatalog(object):
+    """tx.in(s) of directories with their metadata, cached in memory and in
+    `cache_path` (if given)
+    """
+
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        # path: {'stamp': [mtime_ns, size], 'meta': {...}}, see `TxinInfo`
+        self._meta = {}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not self.cache_path:
+            return
+        try:
+            with open(self.cache_path, 'r') as f:
+                self._meta = json.load(f)
+        except (OSError, ValueError):
+            # missing or broken, rebuilt as tx.in(s) are read
+            self._meta = {}
+
+    def save(self):
+        """Write the metadata cache, if changed"""
+        with self._lock:
+            if not self.cache_path or not self._dirty:
+                return
+            data = json.dumps(self._meta)
+            self._dirty = False
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = '%s.%d.tmp' %(self.cache_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, self.cache_path)
+
+    def scan(self, dir_path):
+        """`TxinInfo` of the tx.in(s) of a directory, sorted by name.
+        Metadata is taken from the cache, None if not read yet.
+        """
+        dir_path = os.path.abspath(dir_path)
+        infos = []
+        with os.scandir(dir_path) as entries, self._lock:
+            for entry in entries:
+                if not (is_txin_name(entry.name) and entry.is_file()):
+                    continue
+                # stat of a DirEntry is cached, and free on Windows
+                st = entry.stat()
+                stamp = [st.st_mtime_ns, st.st_size]
+                cached = self._meta.get(entry.path)
+                meta = cached['meta'] if cached and cached['stamp'] == stamp else None
+                infos.append(TxinInfo(entry.name, entry.path, stamp, meta))
+            # forget files gone from the directory
+            seen = set(info.path for info in infos)
+            for path in [p for p in self._meta if os.path.dirname(p) == dir_path]:
+                if path not in seen:
+                    del self._meta[path]
+                    self._dirty = True
+        infos.sort(key=lambda info: info.name)
+        return infos
+
+    def read_missing(self, infos, progress=None):
+        """`infos` with metadata read for those without. Files that can not
+        be read get {'error': message}. `progress(fraction, message)` is
+        called per file.
+        """
+        res = []
+        todo = sum(info.meta is None for info in infos)
+        done = 0
+        for info in infos:
+            if info.meta is not None:
+                res.append(info)
+                continue
+            if progress is not None:
+                progress(done / todo, 'Reading %s' %info.name)
+            done += 1
+            try:
+                meta = read_meta(info.path)
+            except FileNotFoundError:
+                # gone since the scan
+                res.append(info)
+                continue
+            except (OSError, ValueError) as e:
+                meta = {'error': str(e)}
+            with self._lock:
+                self._meta[info.path] = {'stamp': info.stamp, 'meta': meta}
+                self._dirty = True
+            res.append(info._replace(meta=meta))
+        return res
@@ -0,0 +1,273 @@
+"""Index of shot blocks of a fixed-width tx.in, e.g. a merged one.
+
+A shot block is a shot header record followed by its picks. For every shot
+block the index records its byte offset, number of records, shot location,
+direction (-1 for picks at the left of the shot and 1 for the right) and the
+ray groups of its picks. Contiguous blocks of the same shot location make a
+station, e.g. the two blocks written for one OBS by `TxMakerCore`.
+
+The index is stored as a `<tx.in>.idx.npz` sidecar. With it, a station can
+be extracted by reading its byte range only, and replaced or deleted by
+copying the byte ranges around it, as raw bytes, to a temporary file that
+then replaces the tx.in. A failure leaves the tx.in and its index as they
+were. The merger writes it with `index=True`
+(`tx_cli.py merge --index`) and keeps it up to date once it exists;
+`tx_cli.py station` extracts, replaces and deletes stations with it.
+"""
+
+import os
+
+import numpy as np
+
+from util import txin
+from util.merge_manifest import copy_range
+from util.txin_reader import TxinFile
+
+
+SIDECAR_SUFFIX = '.idx.npz'
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _station_key(shot_loc):
+    # shot locations are written with 3 decimals
+    return round(float(shot_loc), 3)
+
+
+def _block_meta(x, t, code, starts, stops, line_width):
+    """Meta of shot blocks [starts, stops), given as record indexes"""
+    picks = np.flatnonzero(code > 0)
+    if starts.size:
+        picks = picks[(picks >= starts[0]) & (picks < stops[-1])]
+    else:
+        picks = picks[:0]
+    # ray groups of each block, from unique (block, ray group) pairs
+    block = np.searchsorted(starts, picks, side='right') - 1
+    pairs = np.unique(np.stack([block, code[picks]], axis=1), axis=0).reshape(-1, 2)
+    return {
+        'offset': starts * line_width,
+        'count': stops - starts,
+        'shot_loc': x[starts],
+        'direction': t[starts].astype(np.int64),
+        'ray_groups': pairs[:, 1],
+        'ray_ptr': np.searchsorted(pairs[:, 0], np.arange(starts.size + 1)),
+        }
+
+
+def _file_meta(tx_file, start=0):
+    """Meta of shot blocks of a `TxinFile` from record `start` on"""
+    starts, stops = tx_file.shot_blocks()
+    keep = starts >= start
+    return _block_meta(
+        tx_file.column('x'), tx_file.column('t'), tx_file.code,
+        starts[keep], stops[keep], tx_file.line_width)
+
+
+def _concat_meta(head, tail):
+    """Concatenate block meta of two parts of a file"""
+    return {
+        'offset': np.concatenate([head['offset'], tail['offset']]),
+        'count': np.concatenate([head['count'], tail['count']]),
+        'shot_loc': np.concatenate([head['shot_loc'], tail['shot_loc']]),
+        'direction': np.concatenate([head['direction'], tail['direction']]),
+        'ray_groups': np.concatenate([head['ray_groups'], tail['ray_groups']]),
+        'ray_ptr': np.concatenate([head['ray_ptr'][:-1], tail['ray_ptr'] + head['ray_ptr'][-1]]),
+        }
+
+
+def _slice_meta(meta, start, stop):
+    """Block meta of blocks [start, stop)"""
+    ray_ptr = meta['ray_ptr'][start:stop+1]
+    return {
+        'offset': meta['offset'][start:stop],
+        'count': meta['count'][start:stop],
+        'shot_loc': meta['shot_loc'][start:stop],
+        'direction': meta['direction'][start:stop],
+        'ray_groups': meta['ray_groups'][ray_ptr[0]:ray_ptr[-1]],
+        'ray_ptr': ray_ptr - ray_ptr[0],
+        }
+
+
+class ShotIndex(object):
+    """Shot block index of a fixed-width tx.in file"""
+
+    def __init__(self, path, meta, line_width, newline):
+        self.path = path
+        self.meta = meta
+        self.line_width = line_width
+        self.newline = newline
+        self._stations = None
+
+    @classmethod
+    def sidecar_path(cls, path):
+        return path + SIDECAR_SUFFIX
+
+    @classmethod
+    def build(cls, path):
+        with TxinFile(path) as tx_file:
+            index = cls(path, _file_meta(tx_file), tx_file.line_width, tx_file.newline)
+        index.save()
+        return index
+
+    @classmethod
+    def open(cls, path):
+        """Load the index of a tx.in, updating or rebuilding it if outdated"""
+        sidecar = cls.sidecar_path(path)
+        stamp = _stamp(path)
+        try:
+            with np.load(sidecar) as data:
+                saved_stamp = tuple(data['stamp'].tolist())
+                meta = {k: data[k] for k in (
+                    'offset', 'count', 'shot_loc', 'direction', 'ray_groups', 'ray_ptr')}
+                line_width = int(data['line_width'])
+                newline = data['newline'].tobytes()
+        except (OSError, KeyError, ValueError):
+            return cls.build(path)
+        index = cls(path, meta, line_width, newline)
+        if saved_stamp == stamp:
+            return index
+        if stamp[1] > saved_stamp[1] and index.update():
+            return index
+        return cls.build(path)
+
+    def save(self):
+        with open(self.sidecar_path(self.path), 'wb') as f:
+            np.savez(
+                f, stamp=np.array(_stamp(self.path), dtype=np.int64),
+                line_width=self.line_width, newline=np.frombuffer(self.newline, np.uint8),
+                **self.meta)
+
+    def update(self):
+        """Index blocks appended to the file since the index was saved.
+
+        Blocks up to the last indexed one are assumed unchanged, which is
+        checked against its shot header. Returns False if that fails.
+        """
+        n = len(self)
+        if n == 0:
+            return False
+        with TxinFile(self.path) as tx_file:
+            if tx_file.line_width != self.line_width:
+                return False
+            start = int(self.meta['offset'][-1]) // self.line_width
+            if start >= len(tx_file) or tx_file.code[start] != 0 \
+                    or _station_key(tx_file.column('x')[start]) != _station_key(self.meta['shot_loc'][-1]):
+                return False
+            tail = _file_meta(tx_file, start)
+        self.meta = _concat_meta(_slice_meta(self.meta, 0, n - 1), tail)
+        self._stations = None
+        self.save()
+        return True
+
+    def __len__(self):
+        return len(self.meta['offset'])
+
+    def ray_groups(self, i):
+        ptr = self.meta['ray_ptr']
+        return self.meta['ray_groups'][ptr[i]:ptr[i+1]]
+
+    def stations(self):
+        """{shot location: [(first block, stop block), ...]} of all stations"""
+        if self._stations is None:
+            keys = np.round(self.meta['shot_loc'], 3)
+            bounds = np.flatnonzero(np.diff(keys) != 0) + 1
+            starts = np.concatenate([[0], bounds]) if len(keys) else bounds
+            stops = np.append(bounds, len(keys))
+            self._stations = {}
+            for start, stop in zip(starts.tolist(), stops.tolist()):
+                self._stations.setdefault(_station_key(keys[start]), []).append((start, stop))
+        return self._stations
+
+    def _byte_range(self, start, stop):
+        """Byte range of blocks [start, stop)"""
+        offset, count = self.meta['offset'], self.meta['count']
+        begin = int(offset[start])
+        end = int(offset[stop-1] + count[stop-1] * self.line_width)
+        return begin, end
+
+    def _station_runs(self, shot_loc):
+        runs = self.stations().get(_station_key(shot_loc))
+        if not runs:
+            raise KeyError('No station at shot location %.3f in %s' %(shot_loc, self.path))
+        return runs
+
+    def extract(self, shot_loc):
+        """Text of all shot blocks of a station"""
+        chunks = []
+        with open(self.path, 'rb') as f:
+            for start, stop in self._station_runs(shot_loc):
+                begin, end = self._byte_range(start, stop)
+                f.seek(begin)
+                chunks.append(f.read(end - begin))
+        return b''.join(chunks).replace(self.newline, b'\n').decode('ascii')
+
+    def replace(self, shot_loc, records):
+        """Replace the shot blocks of a station with records (no ending record)"""
+        runs = self._station_runs(shot_loc)
+        if len(runs) > 1:
+            raise ValueError(
+                'Station at shot location %.3f is not contiguous in %s' %(shot_loc, self.path))
+        self._splice([(runs[0], records)])
+
+    def delete(self, shot_loc):
+        """Delete all shot blocks of a station"""
+        self._splice([(run, txin.empty_records(0)) for run in self._station_runs(shot_loc)])
+
+    def _splice(self, edits):
+        """Write the file with blocks [start, stop) of each ((start, stop),
+        records) of edits, in order of blocks, replaced by records
+        """
+        texts = []
+        for run, records in edits:
+            records = np.asarray(records)
+            if records.dtype.names is None:
+                records = txin.to_records(records)
+            if records.size and records['code'][0] != 0:
+                raise ValueError('Records of a station should start with a shot header')
+            if np.any(txin.is_ending(records)):
+                raise ValueError('Records of a station should not contain the ending record')
+            data = ''.join(txin.format_records(records)).encode('ascii')
+            if self.newline != b'\n':
+                data = data.replace(b'\n', self.newline)
+            if len(data) != records.size * self.line_width:
+                raise ValueError('Records do not fit the fixed width of %s' %self.path)
+            texts.append((run, records, data))
+
+        tmp_path = '%s.%d.tmp' %(self.path, os.getpid())
+        parts, pos, block, delta = [], 0, 0, 0
+        try:
+            with open(self.path, 'rb') as f, open(tmp_path, 'wb') as fw:
+                size = os.fstat(f.fileno()).st_size
+                for (start, stop), records, data in texts:
+                    begin, end = self._byte_range(start, stop)
+                    copy_range(f, fw, pos, begin - pos)
+                    fw.write(data)
+                    # meta of the blocks before, shifted, and of the new ones
+                    head = _slice_meta(self.meta, block, start)
+                    head['offset'] = head['offset'] + delta
+                    starts = np.flatnonzero(txin.is_shot(records))
+                    stops = np.append(starts[1:], records.size) if starts.size else starts
+                    new = _block_meta(
+                        records['x'], records['t'], records['code'], starts, stops,
+                        self.line_width)
+                    new['offset'] = new['offset'] + begin + delta
+                    parts.extend([head, new])
+                    delta += len(data) - (end - begin)
+                    pos, block = end, stop
+                copy_range(f, fw, pos, size - pos)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, self.path)
+        tail = _slice_meta(self.meta, block, len(self))
+        tail['offset'] = tail['offset'] + delta
+        meta = tail
+        for part in reversed(parts):
+            meta = _concat_meta(part, meta)
+        self.meta = meta
+        self._stations = None
+        self.save()
@@ -0,0 +1,162 @@
+"""Memory-mapped reader for fixed-width tx.in files.
+
+tx.in(s) written with `LINE_FMT` have lines of the same length, so record i
+starts at byte i * line length. `TxinFile` maps such a file into memory and
+views it as an array of fixed-width byte fields without reading it. Fields
+are parsed to numbers only when asked for, and only for the records asked
+for, so even a multi-GB merged tx.in opens instantly.
+"""
+
+import mmap
+import os
+
+import numpy as np
+
+from util import txin
+
+
+class TxinFile(object):
+    """Lazy, read-only view of the records of a fixed-width tx.in file.
+
+    Raises ValueError if the file is empty or not fixed-width, in which case
+    it can still be read with `txin.iter_record_blocks`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map(os.fstat(self._file.fileno()).st_size)
+        except Exception:
+            self.close()
+            raise
+        self._columns = {}
+
+    def _map(self, size):
+        if size == 0:
+            raise ValueError('Empty tx.in file: %s' %self.path)
+        head = self._file.read(txin.LINE_WIDTH + 1)
+        width = txin.LINE_WIDTH - 1
+        if head[width:width+1] == b'\n':
+            self.newline = b'\n'
+        elif head[width:width+2] == b'\r\n':
+            self.newline = b'\r\n'
+        else:
+            raise ValueError('Not a fixed-width tx.in file: %s' %self.path)
+        self.line_width = width + len(self.newline)
+        if size % self.line_width:
+            raise ValueError('Not a fixed-width tx.in file: %s' %self.path)
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = [(name, 'S%d' %txin.FIELD_WIDTH) for name in txin.RECORD_DTYPE.names]
+        fields.append(('newline', 'S%d' %len(self.newline)))
+        self.raw = np.frombuffer(self._mmap, dtype=np.dtype(fields))
+        if not np.all(self.raw['newline'] == self.newline):
+            raise ValueError('Not a fixed-width tx.in file: %s' %self.path)
+
+    def close(self):
+        self.raw = None
+        self._columns = {}
+        if getattr(self, '_mmap', None) is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # views of the map are still alive, leave it to gc
+                pass
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.raw)
+
+    def offset(self, i):
+        """Byte offset of record i"""
+        return i * self.line_width
+
+    def column(self, name):
+        """Parsed column of all records, cached"""
+        if name not in self._columns:
+            self._columns[name] = self.raw[name].astype(txin.RECORD_DTYPE[name])
+        return self._columns[name]
+
+    @property
+    def code(self):
+        return self.column('code')
+
+    @property
+    def has_ending(self):
+        return int(self.raw['code'][-1]) == -1
+
+    def records(self, start=0, stop=None):
+        """Records [start, stop) parsed into `txin.RECORD_DTYPE`"""
+        raw = self.raw[start:stop]
+        records = txin.empty_records(len(raw))
+        for name in txin.RECORD_DTYPE.names:
+            records[name] = raw[name].astype(txin.RECORD_DTYPE[name])
+        return records
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.step not in (None, 1):
+                raise ValueError('Slicing with step is not supported')
+            return self.records(key.start, key.stop)
+        return self.records(key, key + 1 if key != -1 else None)[0]
+
+    def shot_blocks(self):
+        """(start, stop) record indexes of every shot block.
+
+        A shot block is a shot header followed by its picks.
+        """
+        starts = np.flatnonzero(self.code == 0)
+        stops = np.append(starts[1:], len(self) - self.has_ending)
+        return starts, stops
+
+    def shot_block(self, i):
+        starts, stops = self.shot_blocks()
+        return self.records(starts[i], stops[i])
+
+    def ray_group_counts(self):
+        """{ray group: number of picks}"""
+        code = self.code
+        groups, counts = np.unique(code[code > 0], return_counts=True)
+        return dict(zip(groups.tolist(), counts.tolist()))
+
+    def select_x(self, xmin=None, xmax=None):
+        """Picks with xmin <= x <= xmax"""
+        mask = self.code > 0
+        x = self.column('x')
+        if xmin is not None:
+            mask &= x >= xmin
+        if xmax is not None:
+            mask &= x <= xmax
+        idx = np.flatnonzero(mask)
+        records = txin.empty_records(idx.size)
+        for name in txin.RECORD_DTYPE.names:
+            records[name] = self.raw[name][idx].astype(txin.RECORD_DTYPE[name])
+        return records
+
+    def iter_text(self, start=0, stop=None, ray_number=None, block_rows=txin.BLOCK_ROWS):
+        """Yield original text of records [start, stop) with '\\n' newlines.
+
+        If `ray_number` is given, the ray group of picks is rewritten in the
+        raw bytes, without parsing and formatting the other fields.
+        """
+        stop = len(self) if stop is None else stop
+        if ray_number is not None:
+            code_field = (b'%10d' %ray_number)
+            if len(code_field) != txin.FIELD_WIDTH:
+                raise ValueError('Invalid ray_number: %r' %ray_number)
+        for i in range(start, stop, block_rows):
+            raw = self.raw[i:min(i+block_rows, stop)]
+            if ray_number is not None:
+                raw = raw.copy()
+                raw['code'][raw['code'].astype(np.int64) > 0] = code_field
+            data = raw.tobytes()
+            if self.newline != b'\n':
+                data = data.replace(self.newline, b'\n')
+            yield data.decode('ascii')